@@ -1,6 +1,6 @@
 {
     "name": "Base Marketplace Connector",
-    "version": "1.0",
+    "version": "1.2",
     "category": "Extra",
     "summary": "Base app for all the marketplace connector of TeqStars.",
 
@@ -27,6 +27,7 @@
 
         'data/ir_sequence_data.xml',
         'data/ir_cron.xml',
+        'data/ir_config_parameter.xml',
         'data/dashboard_data.xml',
 
         'views/marketplace_queue_job_line_view.xml',
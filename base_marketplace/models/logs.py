@@ -1,4 +1,4 @@
-from odoo import models, fields, _
+from odoo import models, fields, api, _
 
 
 class MKLog(models.Model):
@@ -23,31 +23,62 @@ class MKLog(models.Model):
             mk_log_line_dict_ctx[type].append(log_dict)
         return log_line_list
 
+    @api.model
+    def is_log_required(self, state, mk_log_id=False, mk_instance_id=False):
+        """ Whether log lines of given state are kept according to the instance log level, check it before preparing costly log messages.
+        :param state: success or error.
+        """
+        mk_instance_id = mk_instance_id or (mk_log_id or self.env.context.get('log_id') or self.browse()).mk_instance_id
+        return mk_instance_id.log_level in [state, 'all']
+
     def create_update_log(self, mk_log_id=False, mk_instance_id=False, operation_type='', mk_log_line_dict=None):
         if not mk_instance_id and mk_log_id:
             mk_instance_id = mk_log_id.mk_instance_id
-        log_line_list, log_level = [], mk_instance_id.log_level
+        log_line_list = []
         operation_type = self.env.context.get('operation_type', operation_type)
         marketplace_log_id = self.env.context.get('log_id', False) if not mk_log_id else mk_log_id
         mk_log_line_dict = mk_log_line_dict or self.env.context.get('mk_log_line_dict', {})
         if mk_log_line_dict:
-            if log_level == 'error':
-                log_line_list.extend(self.prepare_create_line_vals(mk_log_line_dict, 'error'))
-            if log_level == 'success':
-                log_line_list.extend(self.prepare_create_line_vals(mk_log_line_dict, 'success'))
-            if log_level == 'all':
-                log_line_list.extend(self.prepare_create_line_vals(mk_log_line_dict, 'success'))
-                log_line_list.extend(self.prepare_create_line_vals(mk_log_line_dict, 'error'))
+            for state in ['success', 'error']:
+                if self.is_log_required(state, mk_instance_id=mk_instance_id):
+                    log_line_list.extend(self.prepare_create_line_vals(mk_log_line_dict, state))
 
         if not marketplace_log_id:
             log_vals = {'mk_instance_id': mk_instance_id and mk_instance_id.id or False, 'operation_type': operation_type}
             if log_line_list:
                 log_vals.update({'log_line_ids': log_line_list})
             marketplace_log_id = self.create(log_vals)
-        else:
-            marketplace_log_id.write({'log_line_ids': log_line_list})
+        elif log_line_list:
+            log_buffer = self.env.context.get('mk_log_buffer')
+            if log_buffer is None:
+                marketplace_log_id.write({'log_line_ids': log_line_list})
+            else:
+                self._buffer_log_lines(log_buffer, marketplace_log_id, log_line_list)
         return marketplace_log_id
 
+    def _buffer_log_lines(self, log_buffer, marketplace_log_id, log_line_list):
+        # Lines are written before the transaction is committed. On rollback they are kept in the buffer, so the caller can still write the lines
+        # explaining the failure, and the flush is registered again with the next transaction.
+        registered_buffer_ids = self.env.cr.precommit.data.setdefault('mk_log_buffer_ids', set())
+        if id(log_buffer) not in registered_buffer_ids:
+            registered_buffer_ids.add(id(log_buffer))
+            self.env.cr.precommit.add(self.flush_log_buffer)
+        log_buffer.setdefault(marketplace_log_id.id, []).extend(log_line_list)
+
+    def flush_log_buffer(self):
+        """ Write log lines gathered in the log buffer, the buffer is an empty dict passed in context key mk_log_buffer by a queue batch or cron run
+        so its log lines are created together with one multi-row insert per log instead of one write per log event.
+        """
+        log_buffer = self.env.context.get('mk_log_buffer')
+        if not log_buffer:
+            return True
+        buffered_log_dict = dict(log_buffer)
+        log_buffer.clear()
+        for log_id, log_line_list in buffered_log_dict.items():
+            self.browse(log_id).write({'log_line_ids': log_line_list})
+        self.flush()
+        return True
+
     def create(self, vals):
         if vals.get('name', _('New')) == _('New'):
             vals['name'] = self.env['ir.sequence'].next_by_code('mk.log') or _('New')
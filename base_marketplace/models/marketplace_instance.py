@@ -1,17 +1,28 @@
+import copy
 import json
+import time
 import babel
 import random
 import base64
+import logging
 from lxml import etree
 from odoo.osv import expression
 from odoo.tools import date_utils
 from datetime import date, timedelta
 from odoo import models, fields, api, _
+from odoo.tools.lru import LRU
 from odoo.tools.misc import format_date
 from odoo.tools import DEFAULT_SERVER_DATE_FORMAT
 from odoo.exceptions import UserError, ValidationError
 from babel.dates import format_date as babel_format_date
-from babel.dates import get_quarter_names, format_datetime
+from babel.dates import get_quarter_names
+
+_logger = logging.getLogger("Teqstars:Base Marketplace")
+
+DASHBOARD_CACHE_TTL = 300
+# Dashboard data computed by this worker, entries are dropped once the TTL is over or marketplace orders are confirmed/cancelled in any worker.
+DASHBOARD_CACHE = LRU(256)
+DASHBOARD_CACHE_STAT = {'hit': 0, 'miss': 0}
 
 
 class MkInstance(models.Model):
@@ -39,23 +50,31 @@ class MkInstance(models.Model):
         return api_limit
 
     def _get_mk_kanban_counts(self):
+        instance_ids = self._origin.ids
+        count_dict = {}
+        if instance_ids:
+            count_domain_dict = {'mk_listing_count': ('mk.listing', []),
+                                 'mk_order_count': ('sale.order', []),
+                                 'mk_invoice_count': ('account.move', []),
+                                 'mk_shipment_count': ('stock.picking', []),
+                                 'mk_queue_count': ('mk.queue.job', [('state', '!=', 'processed')])}
+            for count_field, (model_name, domain) in count_domain_dict.items():
+                count_data = self.env[model_name].read_group([('mk_instance_id', 'in', instance_ids)] + domain, ['mk_instance_id'], ['mk_instance_id'])
+                count_dict[count_field] = {data['mk_instance_id'][0]: data['mk_instance_id_count'] for data in count_data}
+            customer_data = self.env['res.partner'].read_group([('mk_instance_ids', 'in', instance_ids), ('parent_id', '=', False)],  # not consider child partners.
+                                                               ['mk_instance_ids'], ['mk_instance_ids'])
+            count_dict['mk_customer_count'] = {data['mk_instance_ids'][0]: data['mk_instance_ids_count'] for data in customer_data}
+            select_sql_clause, query_args = self._origin._get_bar_graph_select_query()
+            self.env.cr.execute(select_sql_clause + " GROUP BY move.mk_instance_id", query_args)
+            count_dict['mk_total_revenue'] = {data['mk_instance_id']: data['total'] for data in self.env.cr.dictfetchall()}
         for mk_instance_id in self:
-            mk_instance_id.mk_listing_count = len(mk_instance_id.mk_listing_ids)
-            mk_instance_id.mk_order_count = self.env['sale.order'].search_count([('mk_instance_id', '=', mk_instance_id.id)])
-            mk_instance_id.mk_invoice_count = self.env['account.move'].search_count([('mk_instance_id', '=', mk_instance_id.id)])
-            mk_instance_id.mk_shipment_count = self.env['stock.picking'].search_count([('mk_instance_id', '=', mk_instance_id.id)])
-            mk_instance_id.mk_queue_count = len(mk_instance_id.mk_queue_ids.filtered(lambda x: x.state != 'processed'))
-            mk_instance_id.mk_customer_count = self.env['res.partner'].search_count(
-                [('mk_instance_ids', 'in', mk_instance_id.ids), ('parent_id', '=', False)])  # not consider child partners.
-            if mk_instance_id.name:
-                select_sql_clause, query_args = mk_instance_id._get_bar_graph_select_query()
-                self.env.cr.execute(select_sql_clause, query_args)
-                query_results = self.env.cr.dictfetchone()
-                mk_instance_id.mk_total_revenue = query_results.get('total', 0.0)
+            for count_field in ['mk_listing_count', 'mk_order_count', 'mk_invoice_count', 'mk_shipment_count', 'mk_queue_count', 'mk_customer_count', 'mk_total_revenue']:
+                mk_instance_id[count_field] = count_dict.get(count_field, {}).get(mk_instance_id._origin.id, 0)
 
     def _kanban_dashboard_graph(self):
+        weekly_total_dict = self._origin._get_bar_graph_weekly_total()
         for mk_instance_id in self:
-            chart_data = mk_instance_id.get_bar_graph_datas()
+            chart_data = mk_instance_id.get_bar_graph_datas(weekly_total_dict.get(mk_instance_id._origin.id, {}))
             mk_instance_id.kanban_dashboard_graph = json.dumps(chart_data)
             mk_instance_id.is_sample_data = chart_data[0].get('is_sample_data', False)
 
@@ -96,6 +115,7 @@ class MkInstance(models.Model):
     company_currency_id = fields.Many2one('res.currency', related='company_id.currency_id', string="Company Currency")
     show_in_systray = fields.Boolean("Show in Systray Menu?", copy=False)
     queue_batch_limit = fields.Integer("Queue Batch Limit", default=100, help="Odoo will create a batch with defined limit.")
+    is_compress_queue_data = fields.Boolean("Compress Queue Data?", default=False, help="Store data of queue lines as compressed JSON to reduce database size.")
     image = fields.Binary("Marketplace Image", attachment=True, help="This field holds the image used as photo for the marketplace, limited to 1024x1024px.")
     image_medium = fields.Binary("Medium-sized photo", related="image", store=True,
                                  help="Medium-sized photo of the marketplace. It is automatically resized as a 128x128px image, with aspect ratio preserved. ")
@@ -283,30 +303,56 @@ class MkInstance(models.Model):
     def _get_bar_graph_select_query(self):
         """
         Returns a tuple containing the base SELECT SQL query used to gather
-        the bar graph's data as its first element, and the arguments dictionary
-        for it as its second.
+        the bar graph's data of all instances of the recordset as its first
+        element, and the arguments dictionary for it as its second. The query
+        needs to be completed with a GROUP BY on move.mk_instance_id.
         """
-        # return ("""SELECT sum(amount_residual_signed) as total, min(date_invoice) as aggr_date
-        #        FROM account_move
-        #        WHERE mk_instance_id = %(mk_instance_id)s and state = 'paid'""", {'mk_instance_id': self.id})
-        return ('''
-                SELECT SUM(move.amount_total) AS total, MIN(invoice_date_due) AS aggr_date
+        return ("""
+                SELECT move.mk_instance_id AS mk_instance_id, SUM(move.amount_total) AS total, MIN(invoice_date_due) AS aggr_date
                 FROM account_move move
-                WHERE move.mk_instance_id = %(mk_instance_id)s
+                WHERE move.mk_instance_id IN %(mk_instance_ids)s
                 AND move.state = 'posted'
                 AND move.payment_state = 'paid'
                 AND move.move_type IN %(invoice_types)s
-            ''', {
+            """, {
             'invoice_types': tuple(['out_invoice']),
-            'mk_instance_id': self.id
+            'mk_instance_ids': tuple(self.ids)
         })
 
-    def get_bar_graph_datas(self):
+    def _get_first_day_of_week(self):
+        today = fields.Date.context_today(self)
+        day_of_week = int(babel_format_date(today, 'e', locale=self._context.get('lang') or 'en_US'))
+        return today + timedelta(days=-day_of_week + 1)
+
+    def _get_bar_graph_weekly_total(self):
+        """ Total selling of all instances of the recordset, grouped by the week of due date. Invoices older than
+        four weeks are summed in the past bucket.
+        :return: {mk_instance_id: {bucket_index: total}}, bucket index 0 is past and 5 is this week.
+        """
+        weekly_total_dict = {}
+        if not self:
+            return weekly_total_dict
+        first_day_of_week = self._get_first_day_of_week()
+        start_date = first_day_of_week + timedelta(weeks=-4)
+        select_sql_clause, query_args = self._get_bar_graph_select_query()
+        # date_trunc('week') starts weeks on monday, due dates are shifted to follow the first day of week of the user language.
+        query_args.update({'start_date': start_date, 'end_date': first_day_of_week + timedelta(weeks=1), 'week_shift': first_day_of_week.weekday()})
+        self.env.cr.execute(select_sql_clause + """
+                AND invoice_date_due < %(end_date)s
+                GROUP BY move.mk_instance_id,
+                         CASE WHEN invoice_date_due < %(start_date)s THEN NULL ELSE date_trunc('week', invoice_date_due - %(week_shift)s) END
+        """, query_args)
+        for data in self.env.cr.dictfetchall():
+            index = 0 if data['aggr_date'] < start_date else (data['aggr_date'] - start_date).days // 7 + 1
+            weekly_total_dict.setdefault(data['mk_instance_id'], {})[index] = data['total']
+        return weekly_total_dict
+
+    def get_bar_graph_datas(self, weekly_total=None):
+        if weekly_total is None:
+            weekly_total = self._get_bar_graph_weekly_total().get(self.id, {})
         data = []
-        today = fields.Datetime.now(self)
         data.append({'label': _('Past'), 'value': 0.0, 'type': 'past'})
-        day_of_week = int(format_datetime(today, 'e', locale=self._context.get('lang') or 'en_US'))
-        first_day_of_week = today + timedelta(days=-day_of_week + 1)
+        first_day_of_week = self._get_first_day_of_week()
         for i in range(-4, 1):
             if i == 0:
                 label = _('This Week')
@@ -321,38 +367,17 @@ class MkInstance(models.Model):
                                                                                                                                               'lang') or 'en_US')
             data.append({'label': label, 'value': 0.0, 'type': 'past' if i < 0 else 'future'})
 
-        # Build SQL query to find amount aggregated by week
-        (select_sql_clause, query_args) = self._get_bar_graph_select_query()
-        query = ''
-        o_start_date = today + timedelta(days=-day_of_week + 1)
-        start_date = today + timedelta(days=-day_of_week + 1)
-        for i in range(-4, 2):
-            if i == -4:
-                start_date = o_start_date + timedelta(days=i * 7)
-                query += "(" + select_sql_clause + " and invoice_date_due < '" + start_date.strftime(DEFAULT_SERVER_DATE_FORMAT) + "')"
-            else:
-                next_date = o_start_date + timedelta(days=i * 7)
-                query += " UNION ALL (" + select_sql_clause + " and invoice_date_due >= '" + start_date.strftime(
-                    DEFAULT_SERVER_DATE_FORMAT) + "' and invoice_date_due < '" + next_date.strftime(DEFAULT_SERVER_DATE_FORMAT) + "')"
-                start_date = next_date
-        self.env.cr.execute(query, query_args)
-        query_results = self.env.cr.dictfetchall()
-
-        for index in range(0, len(query_results)):
-            if query_results[index].get('aggr_date') != None:
-                data[index]['value'] = query_results[index].get('total')
-
         # Added random Sample data for better visualization.
         is_sample_data = True
-        for index in range(0, len(query_results)):
-            if query_results[index].get('total') not in [None, 0.0]:
+        for index, total in weekly_total.items():
+            if total not in [None, 0.0]:
                 is_sample_data = False
-                data[index]['value'] = query_results[index].get('total')
+                data[index]['value'] = total
 
         [graph_title, graph_key] = self._graph_title_and_key()
 
         if is_sample_data:
-            for index in range(0, len(query_results)):
+            for index in range(0, len(data)):
                 data[index]['type'] = 'o_sample_data'
                 # we use unrealistic values for the sample data
                 data[index]['value'] = random.randint(0, 20)
@@ -415,27 +440,80 @@ class MkInstance(models.Model):
             date_to = next(reversed(total_orders)).date_order
         return date_from, date_to
 
+    def init(self):
+        # Same approach as the registry signaling, nextval is not transactional so bumping the version never waits on other transactions.
+        self.env.cr.execute("CREATE SEQUENCE IF NOT EXISTS mk_dashboard_cache_signaling")
+
+    def _get_dashboard_cache_version(self):
+        self.env.cr.execute("SELECT last_value FROM mk_dashboard_cache_signaling")
+        return self.env.cr.fetchone()[0]
+
+    @api.model
+    def invalidate_dashboard_cache(self):
+        """ Invalidate cached dashboard data of all workers once the current transaction is committed, only once per transaction. """
+        # postcommit data is cleared with the callbacks after commit or rollback.
+        postcommit_data = self.env.cr.postcommit.data
+        if postcommit_data.get('mk_dashboard_invalidate'):
+            return True
+        postcommit_data['mk_dashboard_invalidate'] = True
+        dbname = self.env.cr.dbname
+
+        def signal_dashboard_change():
+            with self.pool.cursor() as cr:
+                cr.execute("SELECT nextval('mk_dashboard_cache_signaling')")
+            _logger.debug("Marketplace dashboard cache invalidated for database %s.", dbname)
+
+        self.env.cr.postcommit.add(signal_dashboard_change)
+        return True
+
+    @api.model
+    def get_dashboard_cache_stats(self):
+        return dict(DASHBOARD_CACHE_STAT, size=len(DASHBOARD_CACHE))
+
     def get_mk_dashboard_data(self, date_from, date_to, is_general_dashboard=True):
+        """ Cached version of _compute_mk_dashboard_data, see DASHBOARD_CACHE.
+        The TTL can be changed with system parameter base_marketplace.dashboard_cache_ttl, 0 disables the cache.
+        """
+        ttl = int(self.env['ir.config_parameter'].sudo().get_param('base_marketplace.dashboard_cache_ttl', DASHBOARD_CACHE_TTL) or 0)
+        if not ttl:
+            return self._compute_mk_dashboard_data(date_from, date_to, is_general_dashboard=is_general_dashboard)
+        # Record rules depend on the user and the active companies, cached data is only shared by the same user and companies.
+        cache_key = (self.env.cr.dbname, self.env.uid, tuple(sorted(self.env.companies.ids)), self.env.company.id, tuple(sorted(self.ids)), date_from, date_to,
+                     is_general_dashboard, self.env.lang)
+        cache_version = self._get_dashboard_cache_version()
+        cached_data = DASHBOARD_CACHE.get(cache_key)
+        if cached_data and cached_data[0] == cache_version and cached_data[1] > time.time():
+            DASHBOARD_CACHE_STAT['hit'] += 1
+            _logger.debug("Marketplace dashboard cache hit, stats: %s", DASHBOARD_CACHE_STAT)
+            return copy.deepcopy(cached_data[2])
+        DASHBOARD_CACHE_STAT['miss'] += 1
+        _logger.debug("Marketplace dashboard cache miss, stats: %s", DASHBOARD_CACHE_STAT)
+        dashboard_data = self._compute_mk_dashboard_data(date_from, date_to, is_general_dashboard=is_general_dashboard)
+        DASHBOARD_CACHE[cache_key] = (cache_version, time.time() + ttl, copy.deepcopy(dashboard_data))
+        return dashboard_data
+
+    def _compute_mk_dashboard_data(self, date_from, date_to, is_general_dashboard=True):
         country_dict, category_dict, mk_type_dict = {}, {}, {}
         dashboard_data_list = dict(currency_id=self.env.user.company_id.currency_id.id, is_general_dashboard=is_general_dashboard,
                                    sale_graph=[], best_sellers=[], category_graph=[], country_graph=[],
                                    summary=dict(total_orders=0, total_sales=0, pending_shipments=0, avg_order_value=0))
 
-        total_orders = self.env['sale.order'].search([('date_order', '>=', date_from),
-                                                      ('date_order', '<=', date_to),
-                                                      ('state', 'in', ['sale', 'done']),
-                                                      ('mk_instance_id', 'in', self.ids)], order="date_order")
         if not date_from or not date_to or not self:
             return dashboard_data_list
+        order_domain = [('date_order', '>=', date_from), ('date_order', '<=', date_to), ('state', 'in', ['sale', 'done']), ('mk_instance_id', 'in', self.ids)]
+        total_orders = self.env['sale.order'].search_count(order_domain)
         date_date_from = fields.Date.from_string(date_from)
         date_date_to = fields.Date.from_string(date_to)
 
-        sales_domain = [('state', 'in', ['sale', 'done']), ('order_id', 'in', total_orders.ids), ('date', '>=', date_from), ('date', '<=', date_to)]
+        # The report is refreshed by cron, only ask for an earlier run instead of writing the report while reading the dashboard.
+        sale_report_obj = self.env['mk.sale.report.materialized']
+        sale_report_obj.trigger_refresh_report()
+        sales_domain = [('state', 'in', ['sale', 'done']), ('mk_instance_id', 'in', self.ids), ('date', '>=', date_from), ('date', '<=', date_to)]
 
         # Product-based computation
-        report_product_lines = self.env['sale.report'].read_group(domain=sales_domain + [('product_type', '!=', 'service')],
-                                                                  fields=['product_tmpl_id', 'product_uom_qty', 'price_total'],
-                                                                  groupby='product_tmpl_id', orderby='price_total desc', limit=10)
+        report_product_lines = sale_report_obj.read_group(domain=sales_domain + [('product_type', '!=', 'service')],
+                                                          fields=['product_tmpl_id', 'product_uom_qty', 'price_total'],
+                                                          groupby='product_tmpl_id', orderby='price_total desc', limit=10)
 
         for product_line in report_product_lines:
             product_tmpl_id = self.env['product.template'].browse(product_line['product_tmpl_id'][0])
@@ -452,7 +530,8 @@ class MkInstance(models.Model):
             series_data_list, bar_categories, bar_data = [], [], []
             for mk_instance_id in self:
                 instance_name = mk_instance_id.name
-                sale_graph_data = self._compute_sale_graph(date_date_from, date_date_to, [('state', 'in', ['sale', 'done']), ('mk_instance_id', '=', mk_instance_id.id)])
+                sale_graph_data = self._compute_sale_graph(date_date_from, date_date_to, [('state', 'in', ['sale', 'done']), ('mk_instance_id', '=', mk_instance_id.id),
+                                                                                           ('date', '>=', date_from), ('date', '<=', date_to)])
                 series_data_list.append({'name': instance_name, 'data': sale_graph_data[1]})
                 bar_data.append({'name': instance_name, 'data': [round(sum(sale_graph_data[1]), 2)]})
                 # bar_data.append(sum(sale_graph_data[1]))
@@ -462,40 +541,40 @@ class MkInstance(models.Model):
             dashboard_data_list['bar_graph'] = {'series': bar_data, 'categories': bar_categories}
 
             # Marketplace Type wise selling
-            mk_type_data = self.env['sale.report'].read_group(domain=sales_domain,
-                                                              fields=['marketplace_type', 'price_total'],
-                                                              groupby='marketplace_type', orderby='price_total desc', limit=5)
+            mk_type_data = sale_report_obj.read_group(domain=sales_domain,
+                                                      fields=['marketplace_type', 'price_total'],
+                                                      groupby='marketplace_type', orderby='price_total desc', limit=5)
             [mk_type_dict.update({dict(self._fields['marketplace'].selection).get(mk_type_line['marketplace_type']): mk_type_line['price_total']}) for mk_type_line in mk_type_data]
             dashboard_data_list['mk_revenue_pieChart'] = {'series': list(mk_type_dict.values()), 'labels': list(mk_type_dict.keys())}
 
         # Country wise selling
-        country_lines = self.env['sale.report'].read_group(domain=sales_domain,
-                                                           fields=['country_id', 'price_total'],
-                                                           groupby='country_id', orderby='price_total desc', limit=5)
+        country_lines = sale_report_obj.read_group(domain=sales_domain,
+                                                   fields=['country_id', 'price_total'],
+                                                   groupby='country_id', orderby='price_total desc', limit=5)
         [country_dict.update({country_line['country_id'][1]: country_line['price_total']}) for country_line in country_lines if country_line.get('country_id')]
         dashboard_data_list['country_graph'] = {'series': list(country_dict.values()), 'labels': list(country_dict.keys())}
 
         # Category wise selling
-        category_lines = self.env['sale.report'].read_group(domain=sales_domain,
-                                                            fields=['categ_id', 'price_total'],
-                                                            groupby='categ_id', orderby='price_total desc', limit=5)
+        category_lines = sale_report_obj.read_group(domain=sales_domain,
+                                                    fields=['categ_id', 'price_total'],
+                                                    groupby='categ_id', orderby='price_total desc', limit=5)
         [category_dict.update({category_line['categ_id'][1]: category_line['price_total']}) for category_line in category_lines]
         dashboard_data_list['category_graph'] = {'series': list(category_dict.values()), 'labels': list(category_dict.keys())}
 
         # Tiles Summery
         if not is_general_dashboard:
-            total_sales = self.env['sale.report'].read_group(domain=sales_domain, fields=['price_total'], groupby='mk_instance_id')
+            total_sales = sale_report_obj.read_group(domain=sales_domain, fields=['price_total'], groupby='mk_instance_id')
             total_sales = total_sales[0].get('price_total') if total_sales else 0
             to_ship_domain = [('mk_instance_id', 'in', self.ids)]
         else:
-            total_sales = total_orders.mapped('amount_total')
-            total_sales = sum(total_sales) if total_sales else 0
+            total_sales = self.env['sale.order'].read_group(domain=order_domain, fields=['amount_total'], groupby=[])
+            total_sales = total_sales[0].get('amount_total') or 0 if total_sales else 0
             dashboard_data_list['summary']['total_sales'] = total_sales
             to_ship_domain = [('mk_instance_id', '!=', False), ('mk_instance_id.state', '=', 'confirmed')]
 
         to_ship_count = self.env['stock.picking'].search_count(
             to_ship_domain + [('state', 'not in', ['cancel', 'done']), ('create_date', '>=', date_from), ('create_date', '<=', date_to)])
-        dashboard_data_list['summary']['total_orders'] = len(total_orders)
+        dashboard_data_list['summary']['total_orders'] = total_orders
         dashboard_data_list['summary']['pending_shipments'] = to_ship_count
         dashboard_data_list['summary']['total_sales'] = total_sales
         days_diff = fields.Date.from_string(date_to) - fields.Date.from_string(date_from)
@@ -506,9 +585,9 @@ class MkInstance(models.Model):
         days_between = (date_to - date_from).days
         date_list = [(date_from + timedelta(days=x)) for x in range(0, days_between + 1)]
 
-        daily_sales = self.env['sale.report'].read_group(domain=sales_domain,
-                                                         fields=['date', 'price_subtotal'],
-                                                         groupby='date:day')
+        daily_sales = self.env['mk.sale.report.materialized'].read_group(domain=sales_domain,
+                                                                         fields=['date', 'price_subtotal'],
+                                                                         groupby='date:day')
 
         daily_sales_dict = {p['date:day']: p['price_subtotal'] for p in daily_sales}
 
@@ -120,35 +120,84 @@ class MkListing(models.Model):
             return mk_uom_id._compute_quantity(weight, weight_uom_id, round=False)
         return False
 
+    def get_listing_import_cache(self, cache_name):
+        """ Lookup cache shared by all listings of the batch being imported, the batch passes an empty dict in context key listing_import_cache.
+        Outside of a batch a new dict is returned every time so nothing is cached.
+        :param cache_name: name of the lookup, Exp. 'barcode'.
+        :return: dict
+        """
+        listing_import_cache = self.env.context.get('listing_import_cache')
+        if listing_import_cache is None:
+            return {}
+        return listing_import_cache.setdefault(cache_name, {})
+
+    def preload_odoo_product_variant_and_listing_item(self, mk_instance_id, variant_list):
+        """ Resolve listing items by marketplace id and Odoo products by SKU and Barcode of all given variants with three queries into the listing import cache.
+        Values not found are cached as False so they are not searched again.
+        :param variant_list: list of dict having id, sku and barcode of marketplace variants.
+        """
+        listing_item_cache = self.get_listing_import_cache('mk_listing_item')
+        mk_ids = set(str(variant.get('id')) for variant in variant_list if variant.get('id')) - set(listing_item_cache)
+        if mk_ids:
+            for listing_item in self.env['mk.listing.item'].search([('mk_instance_id', '=', mk_instance_id.id), ('mk_id', 'in', list(mk_ids))]):
+                listing_item_cache.setdefault(listing_item.mk_id, listing_item.id)
+            [listing_item_cache.setdefault(mk_id, False) for mk_id in mk_ids]
+        for field_name, variant_key in [('default_code', 'sku'), ('barcode', 'barcode')]:
+            product_cache = self.get_listing_import_cache(field_name)
+            values = set(variant.get(variant_key) for variant in variant_list if variant.get(variant_key)) - set(product_cache)
+            if values:
+                for product in self.env['product.product'].search([(field_name, 'in', list(values))]):
+                    product_cache.setdefault(product[field_name], product.id)
+                [product_cache.setdefault(value, False) for value in values]
+        return True
+
+    def evict_listing_import_cache(self, variant_list):
+        """ Forget cached lookups of the given variants, processing them may have created or updated matching listing items and products. """
+        listing_item_cache, sku_cache, barcode_cache = self.get_listing_import_cache('mk_listing_item'), self.get_listing_import_cache('default_code'), \
+                                                       self.get_listing_import_cache('barcode')
+        for variant in variant_list:
+            listing_item_cache.pop(str(variant.get('id')), None)
+            sku_cache.pop(variant.get('sku'), None)
+            barcode_cache.pop(variant.get('barcode'), None)
+        return True
+
+    def get_mk_listing_item_by_mk_id(self, mk_instance_id, variant_id):
+        listing_item_cache = self.get_listing_import_cache('mk_listing_item')
+        if variant_id and str(variant_id) in listing_item_cache:
+            return self.env['mk.listing.item'].browse(listing_item_cache[str(variant_id)])
+        listing_item_id = self.env['mk.listing.item'].search([('mk_id', '=', variant_id), ('mk_instance_id', '=', mk_instance_id.id)], limit=1)
+        if variant_id:
+            listing_item_cache[str(variant_id)] = listing_item_id.id
+        return listing_item_id
+
+    def get_odoo_product_by_field(self, field_name, value):
+        """ Find Odoo product having given SKU (default_code) or Barcode, through the listing import cache.
+        Cached products are checked to still have the value as they may have been updated by another listing of the batch.
+        """
+        product_cache = self.get_listing_import_cache(field_name)
+        if value in product_cache:
+            product_id = self.env['product.product'].browse(product_cache[value])
+            if not product_id or product_id[field_name] == value:
+                return product_id
+        product_id = self.env['product.product'].search([(field_name, '=', value)], limit=1)
+        product_cache[value] = product_id.id
+        return product_id
+
     def get_odoo_product_variant_and_listing_item(self, mk_instance_id, variant_id, variant_barcode, variant_sku):
-        odoo_product_obj, mk_listing_item_obj, odoo_product_id = self.env['product.product'], self.env['mk.listing.item'], False
-        listing_item_id = mk_listing_item_obj.search([('mk_id', '=', variant_id), ('mk_instance_id', '=', mk_instance_id.id)], limit=1)
-        if mk_instance_id.sync_product_with == 'barcode' and variant_barcode:
-            if not listing_item_id:
-                listing_item_id = mk_listing_item_obj.search([('product_id.barcode', '=', variant_barcode), ('mk_id', '=', variant_id), ('mk_instance_id', '=', mk_instance_id.id)],
-                                                             limit=1)
-            if not listing_item_id:
-                odoo_product_id = odoo_product_obj.search([('barcode', '=', variant_barcode)], limit=1)
+        odoo_product_id = False
+        listing_item_id = self.get_mk_listing_item_by_mk_id(mk_instance_id, variant_id)
+        if not listing_item_id:
+            if mk_instance_id.sync_product_with == 'barcode' and variant_barcode:
+                odoo_product_id = self.get_odoo_product_by_field('barcode', variant_barcode)
 
-        if mk_instance_id.sync_product_with == 'sku' and variant_sku:
-            if not listing_item_id:
-                listing_item_id = mk_listing_item_obj.search([('default_code', '=', variant_sku), ('mk_id', '=', variant_id), ('mk_instance_id', '=', mk_instance_id.id)], limit=1)
-            if not listing_item_id:
-                listing_item_id = mk_listing_item_obj.search(
-                    [('product_id.default_code', '=', variant_sku), ('mk_id', '=', variant_id), ('mk_instance_id', '=', mk_instance_id.id)], limit=1)
-            if not listing_item_id:
-                odoo_product_id = odoo_product_obj.search([('default_code', '=', variant_sku)], limit=1)
+            if mk_instance_id.sync_product_with == 'sku' and variant_sku:
+                odoo_product_id = self.get_odoo_product_by_field('default_code', variant_sku)
 
-        if mk_instance_id.sync_product_with == 'barcode_or_sku':
-            if variant_sku and not listing_item_id:
-                listing_item_id = mk_listing_item_obj.search([('default_code', '=', variant_sku), ('mk_id', '=', variant_id), ('mk_instance_id', '=', mk_instance_id.id)], limit=1)
-            if variant_barcode and not listing_item_id:
-                listing_item_id = mk_listing_item_obj.search([('product_id.barcode', '=', variant_sku), ('mk_id', '=', variant_id), ('mk_instance_id', '=', mk_instance_id.id)],
-                                                             limit=1)
-            if not listing_item_id and variant_sku:
-                odoo_product_id = odoo_product_obj.search([('default_code', '=', variant_sku)], limit=1)
-            if not odoo_product_id and not listing_item_id and variant_barcode:
-                odoo_product_id = odoo_product_obj.search([('barcode', '=', variant_barcode)], limit=1)
+            if mk_instance_id.sync_product_with == 'barcode_or_sku':
+                if variant_sku:
+                    odoo_product_id = self.get_odoo_product_by_field('default_code', variant_sku)
+                if not odoo_product_id and variant_barcode:
+                    odoo_product_id = self.get_odoo_product_by_field('barcode', variant_barcode)
         return odoo_product_id or listing_item_id.product_id, listing_item_id
 
     def check_for_duplicate_sku_or_barcode_in_marketplace_product(self, sync_product_with, listing_item_validation_dict):
@@ -205,10 +254,11 @@ class MkListing(models.Model):
 
             # Looking for Odoo product having the same barcode to avoid duplication of Odoo product.
             if barcode:
-                if not odoo_product_id and self.env['product.product'].search([('barcode', '=', barcode)]):
+                barcode_product_id = self.get_odoo_product_by_field('barcode', barcode)
+                if not odoo_product_id and barcode_product_id:
                     return False, "IMPORT LISTING: Duplicate Barcode ({}) found in Odoo for Product {} and MK ID: {}".format(barcode, listing_item_validation_dict.get('name'),
                                                                                                                              listing_item_validation_dict.get('id'))
-                elif listing_item_id and self.env['product.product'].search([('barcode', '=', barcode), ('id', '!=', listing_item_id.product_id.id)]):
+                elif listing_item_id and barcode_product_id and barcode_product_id != listing_item_id.product_id:
                     return False, "IMPORT LISTING: Duplicate Barcode ({}) found in Odoo for Product {} and MK ID: {}".format(barcode, listing_item_validation_dict.get('name'),
                                                                                                                              listing_item_validation_dict.get('id'))
 
@@ -235,9 +285,12 @@ class MkListing(models.Model):
 
     def _find_odoo_product_from_marketplace_attribute(self, mk_attribute_dict, product_tmpl_id):
         domain = [('product_tmpl_id', '=', product_tmpl_id.id)]
+        attribute_dict = self.env['product.attribute'].get_mk_attributes(list(mk_attribute_dict.keys()), create=False)
+        attribute_value_dict = self.env['product.attribute.value'].get_mk_attribute_values([(attribute_dict.get(name.lower()), value) for name, value in mk_attribute_dict.items()],
+                                                                                           create=False)
         for name, value in mk_attribute_dict.items():
-            attribute_id = self.env['product.attribute'].search([('name', '=ilike', name)], limit=1)
-            attribute_value_id = self.env['product.attribute.value'].search([('attribute_id', '=', attribute_id.id), ('name', '=ilike', value)], limit=1)
+            attribute_id = attribute_dict.get(name.lower(), self.env['product.attribute'])
+            attribute_value_id = attribute_id and value and attribute_value_dict.get((attribute_id.id, value.lower()))
             if attribute_value_id:
                 ptav_id = self.env['product.template.attribute.value'].search([
                     ('product_attribute_value_id', '=', attribute_value_id.id), ('attribute_id', '=', attribute_id.id), ('product_tmpl_id', '=', product_tmpl_id.id)], limit=1)
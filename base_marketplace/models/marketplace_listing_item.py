@@ -34,6 +34,16 @@ class MkListingItem(models.Model):
     sale_price = fields.Monetary(compute="_compute_sales_price_with_currency", currency_field='currency_id')
     currency_id = fields.Many2one('res.currency', compute="_compute_sales_price_with_currency")
 
+    def get_listing_item_stock(self, location_ids, stock_type):
+        """ Quantity to export of every listing item for each location, computed in bulk.
+        :return: dict of (listing item id, location id) and quantity.
+        """
+        product_obj = self.env['product.product']
+        stock_dict = self.mapped('product_id').get_products_stock(location_ids, stock_type)
+        return {(listing_item.id, location_id.id): product_obj.get_export_qty(stock_dict.get((listing_item.product_id.id, location_id.id), 0),
+                                                                             listing_item.export_qty_type, listing_item.export_qty_value)
+                for listing_item in self for location_id in location_ids}
+
     def create_or_update_pricelist_item(self, variant_price):
         self.ensure_one()
         instance_id = self.mk_instance_id or self.mk_listing_id.mk_instance_id
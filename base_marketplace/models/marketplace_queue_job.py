@@ -1,10 +1,18 @@
+import json
+import zlib
+import base64
 import logging
+import threading
 
-from odoo import models, fields, api, _
+from odoo import models, fields, api, tools, _
 from dateutil.relativedelta import relativedelta
+from odoo.tools.safe_eval import safe_eval
 
 _logger = logging.getLogger("Teqstars:Base Marketplace")
 
+QUEUE_WORKER_COUNT = 1
+QUEUE_LEASE_MINUTES = 30
+
 
 class MkQueueJob(models.Model):
     _name = "mk.queue.job"
@@ -43,6 +51,8 @@ class MkQueueJob(models.Model):
     cancelled_count = fields.Integer(string='Cancelled Count', compute='_compute_queue_line_counts_and_state', compute_sudo=True)
     failed_count = fields.Integer(string='Fail Count', compute='_compute_queue_line_counts_and_state', compute_sudo=True)
     no_of_retry_count = fields.Integer(string="Retry Count", help="No of count that queue went in process.", compute_sudo=True)
+    lease_expire_at = fields.Datetime("Lease Expires At", copy=False, readonly=True,
+                                      help="Set while a worker is processing the queue, other workers skip it until the lease is released or expired.")
 
     def create(self, vals):
         if vals.get('name', _('New')) == _('New'):
@@ -87,27 +97,105 @@ class MkQueueJob(models.Model):
         else:
             mk_log_id = self.mk_log_id
         mk_log_line_dict = self.env.context.get('mk_log_line_dict', {'error': [], 'success': []})
+        # Log lines of the queue are buffered, and written at each commit of the queue process.
+        mk_log_buffer = self.env.context.get('mk_log_buffer', {})
         if hasattr(self, '%s_%s_queue_process' % (self.mk_instance_id.marketplace, self.type)):
-            getattr(self.with_context({'mk_log_line_dict': mk_log_line_dict, 'hide_notification': not cron}),
+            getattr(self.with_context({'mk_log_line_dict': mk_log_line_dict, 'hide_notification': not cron, 'mk_log_buffer': mk_log_buffer}),
                     '%s_%s_queue_process' % (self.mk_instance_id.marketplace, self.type))()
+        self.env['mk.log'].with_context(mk_log_buffer=mk_log_buffer).flush_log_buffer()
         if not mk_log_id.log_line_ids:
             mk_log_id.unlink()
         return True
 
-    def cron_do_process(self):
-        for record in self.search(
-                [('state', 'not in', ['failed', 'processed']), '|', ('no_of_retry_count', '<', 3), ('no_of_retry_count', '=', False), ('mk_instance_id.state', '=', 'confirmed')],
-                order='id'):
+    def _claim_queue_job(self, lease_minutes, done_queue_ids):
+        """ Lock the next pending queue with SKIP LOCKED so concurrent workers never claim the same queue, and lease it.
+        :param lease_minutes: minutes after which the lease expires, so queues of crashed workers are picked up again.
+        :param done_queue_ids: ids of queues already handled in this run.
+        :return: claimed mk.queue.job record or empty recordset.
+        """
+        self.env.cr.execute("""
+            SELECT queue.id
+              FROM mk_queue_job queue
+              JOIN mk_instance instance ON instance.id = queue.mk_instance_id
+             WHERE (queue.state IS NULL OR queue.state NOT IN ('failed', 'processed'))
+               AND (queue.no_of_retry_count < 3 OR queue.no_of_retry_count IS NULL)
+               AND instance.state = 'confirmed'
+               AND (queue.lease_expire_at IS NULL OR queue.lease_expire_at < (now() at time zone 'UTC'))
+               AND NOT (queue.id = ANY(%s))
+          ORDER BY queue.id
+             LIMIT 1
+               FOR UPDATE OF queue SKIP LOCKED
+        """, (list(done_queue_ids),))
+        row = self.env.cr.fetchone()
+        if not row:
+            return self.browse()
+        self.env.cr.execute("UPDATE mk_queue_job SET lease_expire_at = (now() at time zone 'UTC') + %s * interval '1 minute' WHERE id = %s", (lease_minutes, row[0]))
+        self.env.cr.commit()
+        record = self.browse(row[0])
+        record.invalidate_cache(['lease_expire_at'])
+        done_queue_ids.append(record.id)
+        return record
+
+    def _process_queue_jobs(self, lease_minutes, done_queue_ids):
+        while True:
+            record = self._claim_queue_job(lease_minutes, done_queue_ids)
+            if not record:
+                break
+            mk_log_buffer = {}
             try:
-                record.do_process(cron=True)
+                record.with_context(mk_log_buffer=mk_log_buffer).do_process(cron=True)
             except Exception as e:
+                self.env.cr.rollback()
+                record.invalidate_cache()
                 record.message_post(body='Facing issue while process Queue {}, ERROR: {}'.format(record.name, e))
+                record._flush_failed_log_buffer(mk_log_buffer)
             finally:
                 if record.no_of_retry_count == 2 and record.failed_count:
                     record.create_activity_action(
                         "System tried 3 times to process queue but something went wrong! Therefor, Manual attention needed to process failed queue lines.")
                 record.no_of_retry_count += 1
-            self.env.cr.commit()  # TODO: Need to check working.
+                record.lease_expire_at = False
+            self.env.cr.commit()
+        return True
+
+    def _flush_failed_log_buffer(self, mk_log_buffer):
+        """ Write log lines buffered before a failed queue process was rolled back, they explain why the queue failed.
+        Lines of logs created in the rolled back transaction are written to the log of the queue, created again if needed.
+        """
+        self.ensure_one()
+        log_obj = self.env['mk.log']
+        existing_log_ids = log_obj.browse(list(mk_log_buffer)).exists().ids
+        for log_id in [log_id for log_id in mk_log_buffer if log_id not in existing_log_ids]:
+            if not self.mk_log_id.exists():
+                self.mk_log_id = log_obj.create_update_log(mk_instance_id=self.mk_instance_id, operation_type='import')
+            mk_log_buffer.setdefault(self.mk_log_id.id, []).extend(mk_log_buffer.pop(log_id))
+        return log_obj.with_context(mk_log_buffer=mk_log_buffer).flush_log_buffer()
+
+    def _queue_worker_thread(self, lease_minutes, done_queue_ids):
+        threading.current_thread().dbname = self.env.cr.dbname
+        threading.current_thread().uid = self.env.uid
+        with self.pool.cursor() as cr:
+            try:
+                self.with_env(self.env(cr=cr))._process_queue_jobs(lease_minutes, done_queue_ids)
+            except Exception as e:
+                _logger.exception("Queue worker stopped with ERROR: {}".format(e))
+
+    def cron_do_process(self):
+        """ Process pending queues. With base_marketplace.queue_worker_count > 1 that many threads, each with its own cursor, process different queues
+        concurrently. Several cron jobs calling this method can run side by side as well, queues are claimed with row locks and leases.
+        """
+        config_parameter_obj = self.env['ir.config_parameter'].sudo()
+        worker_count = int(config_parameter_obj.get_param('base_marketplace.queue_worker_count', QUEUE_WORKER_COUNT) or QUEUE_WORKER_COUNT)
+        lease_minutes = int(config_parameter_obj.get_param('base_marketplace.queue_lease_minutes', QUEUE_LEASE_MINUTES) or QUEUE_LEASE_MINUTES)
+        done_queue_ids = []
+        if worker_count <= 1:
+            return self._process_queue_jobs(lease_minutes, done_queue_ids)
+        workers = [threading.Thread(target=self._queue_worker_thread, args=(lease_minutes, done_queue_ids), name='mk_queue_worker_{}'.format(index))
+                   for index in range(worker_count)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
         return True
 
     def action_mark_as_complete(self):
@@ -161,9 +249,55 @@ class MkQueueJobLine(models.Model):
     mk_instance_id = fields.Many2one('mk.instance', string='Instance', related='queue_id.mk_instance_id', store=False)
     processed_date = fields.Datetime("Processed At", readonly=True)
     data_to_process = fields.Text("Data", copy=False)
+    data_to_process_compressed = fields.Binary("Compressed Data", attachment=False, copy=False)
+    data_encoding = fields.Selection([('json', 'JSON'), ('json_zlib', 'Compressed JSON')], string="Data Encoding", copy=False,
+                                     help="Empty for lines queued before JSON encoding, those are stored as Python literal.")
+    data_preview = fields.Text("Data Preview", compute='_compute_data_preview')
     order_id = fields.Many2one("sale.order", string="Order", copy=False, default=False)
     mk_listing_id = fields.Many2one("mk.listing", string="Listing", copy=False, default=False)
 
+    def _compute_data_preview(self):
+        for line in self:
+            try:
+                line.data_preview = json.dumps(line.get_data_to_process(), indent=4)
+            except Exception:
+                line.data_preview = line.data_to_process
+
+    @api.model
+    def prepare_data_to_process_vals(self, data, mk_instance_id):
+        """ Encode marketplace data of queue line as minified JSON, zlib compressed if instance is configured so.
+        :param data: dict received from marketplace.
+        :param mk_instance_id: mk.instance record.
+        :return: dict of values to write on queue line.
+        """
+        data_json = json.dumps(data, separators=(',', ':'), default=str)
+        if mk_instance_id.is_compress_queue_data:
+            return {'data_to_process': False, 'data_to_process_compressed': base64.b64encode(zlib.compress(data_json.encode('utf-8'))), 'data_encoding': 'json_zlib'}
+        return {'data_to_process': data_json, 'data_to_process_compressed': False, 'data_encoding': 'json'}
+
+    def get_data_to_process(self):
+        self.ensure_one()
+        if self.data_encoding == 'json_zlib':
+            return json.loads(zlib.decompress(base64.b64decode(self.data_to_process_compressed)).decode('utf-8'))
+        if self.data_encoding == 'json':
+            return json.loads(self.data_to_process)
+        return safe_eval(self.data_to_process or '{}')
+
+    def convert_legacy_data_to_process(self, batch_size=1000):
+        """ Re-encode queue lines stored as Python literal (pprint) into JSON. """
+        legacy_line_ids = self.search([('data_encoding', '=', False), ('data_to_process', '!=', False)])
+        for lines in tools.split_every(batch_size, legacy_line_ids.ids, self.browse):
+            for line in lines:
+                try:
+                    data = safe_eval(line.data_to_process)
+                except Exception as e:
+                    _logger.warning("Cannot convert data of queue line {} to JSON, ERROR: {}".format(line.id, e))
+                    continue
+                line.write(self.prepare_data_to_process_vals(data, line.mk_instance_id))
+            lines.flush()
+            lines.invalidate_cache()
+        return True
+
     def do_retry_failed(self):
         if not self.queue_id.mk_log_id:
             mk_log_id = self.env['mk.log'].create_update_log(mk_instance_id=self.mk_instance_id, operation_type='import')
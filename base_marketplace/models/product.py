@@ -1,5 +1,5 @@
 import hashlib
-from odoo import models, fields, api, _
+from odoo import models, fields, api, tools, _
 
 
 class ProductTemplate(models.Model):
@@ -127,6 +127,22 @@ class ProductProduct(models.Model):
     def get_product_stock(self, export_qty_type, export_qty_value, location_id, stock_type):
         product_id = self.with_context(location=location_id.ids)
         stock = getattr(product_id, stock_type)
+        return self.get_export_qty(stock, export_qty_type, export_qty_value)
+
+    def get_products_stock(self, location_ids, stock_type):
+        """ Compute stock of all products at once for each location instead of one computation per product.
+        :param location_ids: stock.location records.
+        :param stock_type: name of the stock field, i.e. qty_available.
+        :return: dict of (product id, location id) and stock.
+        """
+        stock_dict = {}
+        for location_id in location_ids:
+            for product_vals in self.with_context(location=location_id.ids).read([stock_type]):
+                stock_dict[(product_vals['id'], location_id.id)] = product_vals[stock_type]
+        return stock_dict
+
+    @api.model
+    def get_export_qty(self, stock, export_qty_type, export_qty_value):
         if stock > 0:
             if export_qty_type == 'percentage':
                 quantity = (stock * export_qty_value) / 100
@@ -149,19 +165,93 @@ class ProductProduct(models.Model):
         return res
 
 
+class ProductAttribute(models.Model):
+    _inherit = 'product.attribute'
+
+    def init(self):
+        # Attribute registry looks up names case-insensitively.
+        tools.create_index(self._cr, 'product_attribute_lower_name_index', self._table, ['lower(name)'])
+
+    @api.model
+    def get_mk_attributes(self, attribute_names, create=True, create_variant=False):
+        """ Find attributes by case-insensitive name through the attribute registry. The registry is shared by all listings of the batch being
+        imported with the listing import cache, names not in it yet are loaded with one query.
+        :param attribute_names: list of attribute names.
+        :param create: create attributes which are not found, all of them in one create call.
+        :param create_variant: only consider attributes having this variant creation mode, Exp. 'always'.
+        :return: dict {lowercase name: product.attribute}
+        """
+        attribute_registry = self.env['mk.listing'].get_listing_import_cache('product_attribute')
+        names_to_load = set(name.lower() for name in attribute_names if name) - set(attribute_registry)
+        if names_to_load:
+            self._cr.execute("SELECT id, lower(name) FROM product_attribute WHERE lower(name) IN %s ORDER BY sequence, id", (tuple(names_to_load),))
+            [attribute_registry.setdefault(name, []) for name in names_to_load]
+            [attribute_registry[name].append(attribute_id) for attribute_id, name in self._cr.fetchall()]
+
+        attribute_dict, attribute_create_vals = {}, {}
+        for name in attribute_names:
+            if not name:
+                continue
+            attribute_ids = self.browse(attribute_registry.get(name.lower(), []))
+            if create_variant:
+                attribute_ids = attribute_ids.filtered(lambda x: x.create_variant == create_variant)
+            attribute_dict[name.lower()] = attribute_ids[:1]
+            if not attribute_ids and create and not create_variant:
+                attribute_create_vals.setdefault(name.lower(), {'name': name})
+        if attribute_create_vals:
+            for attribute_id in self.create(list(attribute_create_vals.values())):
+                attribute_registry[attribute_id.name.lower()] = [attribute_id.id]
+                attribute_dict[attribute_id.name.lower()] = attribute_id
+        return attribute_dict
+
+
+class ProductAttributeValue(models.Model):
+    _inherit = 'product.attribute.value'
+
+    def init(self):
+        tools.create_index(self._cr, 'product_attribute_value_lower_name_index', self._table, ['attribute_id', 'lower(name)'])
+
+    @api.model
+    def get_mk_attribute_values(self, attribute_value_list, create=True):
+        """ Find attribute values by attribute and case-insensitive name through the attribute value registry, see get_mk_attributes.
+        :param attribute_value_list: list of tuple (product.attribute, value name).
+        :param create: create values which are not found, all of them in one create call.
+        :return: dict {(attribute id, lowercase name): product.attribute.value}
+        """
+        value_registry = self.env['mk.listing'].get_listing_import_cache('product_attribute_value')
+        keys_to_load = set((attribute_id.id, name.lower()) for attribute_id, name in attribute_value_list if attribute_id and name) - set(value_registry)
+        if keys_to_load:
+            self._cr.execute("""SELECT id, attribute_id, lower(name) FROM product_attribute_value
+                                 WHERE attribute_id IN %s AND lower(name) IN %s ORDER BY sequence, id""",
+                             (tuple(set(key[0] for key in keys_to_load)), tuple(set(key[1] for key in keys_to_load))))
+            [value_registry.setdefault((attribute_id, name), value_id) for value_id, attribute_id, name in self._cr.fetchall()]
+            [value_registry.setdefault(key, False) for key in keys_to_load]
+
+        value_dict, value_create_vals = {}, {}
+        for attribute_id, name in attribute_value_list:
+            if not attribute_id or not name:
+                continue
+            key = (attribute_id.id, name.lower())
+            value_dict[key] = self.browse(value_registry.get(key))
+            if not value_dict[key] and create:
+                value_create_vals.setdefault(key, {'attribute_id': attribute_id.id, 'name': name})
+        if value_create_vals:
+            for value_id in self.with_context(active_id=False).create(list(value_create_vals.values())):
+                key = (value_id.attribute_id.id, value_id.name.lower())
+                value_registry[key] = value_id.id
+                value_dict[key] = value_id
+        return value_dict
+
+
 class ProductTemplateAttributeLine(models.Model):
     _inherit = 'product.template.attribute.line'
 
     def create_or_update_ptal(self, attribute_dict, product_tmpl_id):
         for name, value in attribute_dict.items():
-            ptal_id = self.env['product.template.attribute.line'].search([('product_tmpl_id', '=', product_tmpl_id.id), ('attribute_id.name', '=ilike', name)])
+            ptal_id = product_tmpl_id.attribute_line_ids.filtered(lambda x: x.attribute_id.name.lower() == name.lower())
             if not ptal_id:
-                # product_tmpl_id.write({'attribute_line_ids': attribute_line_vals})
-                # ptal_id = self.search([('product_tmpl_id', '=', product_tmpl_id.id), ('attribute_id.name', '=ilike', name)])
                 return False
-            attribute_value_id = self.env['product.attribute.value'].search([('name', '=ilike', value), ('attribute_id', '=', ptal_id.attribute_id.id)], limit=1)
-            if not attribute_value_id:
-                attribute_value_id = self.env['product.attribute.value'].create({'name': value, 'attribute_id': ptal_id.attribute_id.id})
+            attribute_value_id = self.env['product.attribute.value'].get_mk_attribute_values([(ptal_id.attribute_id, value)]).get((ptal_id.attribute_id.id, value.lower()))
             if attribute_value_id not in ptal_id.value_ids:
                 ptal_id.write({'value_ids': [(4, attribute_value_id.id, False)]})
         return True
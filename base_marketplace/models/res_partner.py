@@ -1,4 +1,7 @@
-from odoo import fields, models, _
+import hashlib
+from odoo import fields, models, api, _
+
+ADDRESS_HASH_FIELDS = ['name', 'state_id', 'city', 'zip', 'street', 'street2', 'country_id', 'email']
 
 
 class ResPartnerMk(models.Model):
@@ -14,8 +17,63 @@ class ResPartner(models.Model):
     _inherit = "res.partner"
 
     mk_instance_ids = fields.Many2many("mk.instance", "mk_instance_res_partner_rel", "marketplace_id", "partner_id", string="Marketplaces", copy=False)
+    mk_address_hash = fields.Char("Address Hash", compute='_compute_mk_address_hash', store=True, index=True, copy=False,
+                                  help="Hash of name, address and email used to match marketplace customers.")
+
+    @api.depends(*ADDRESS_HASH_FIELDS)
+    def _compute_mk_address_hash(self):
+        for partner in self:
+            partner.mk_address_hash = self.get_mk_address_hash({field: partner[field] for field in ADDRESS_HASH_FIELDS})
+
+    @api.model
+    def get_mk_address_hash(self, partner_vals):
+        """ Hash of partner address values, values are compared as is like the '=' domain of _find_marketplace_partner.
+        :param partner_vals: dict of partner values, relational values can be ids or records.
+        :return: sha1 hex digest
+        """
+        values = []
+        for field in ADDRESS_HASH_FIELDS:
+            value = partner_vals.get(field)
+            if isinstance(value, models.BaseModel):
+                value = value.id
+            values.append(str(value) if value else '')
+        return hashlib.sha1('|'.join(values).encode('utf-8')).hexdigest()
+
+    @api.model
+    def _is_mk_address_hash_match(self, partner_vals):
+        """ The domain of _find_marketplace_partner skips empty values, so a hash only finds the same partners when all address fields are set. """
+        return bool(partner_vals) and all(partner_vals.get(field) for field in ADDRESS_HASH_FIELDS)
+
+    def prefetch_marketplace_partners(self, partner_vals_list):
+        """ Match address hash of all partner values of a batch in one query. Results are kept in context key partner_match_cache
+        which must be set by the caller, Exp. self.with_context(partner_match_cache={}).
+        """
+        partner_match_cache = self.env.context.get('partner_match_cache')
+        if partner_match_cache is None:
+            return False
+        address_hash_list = list(set(self.get_mk_address_hash(partner_vals) for partner_vals in partner_vals_list if self._is_mk_address_hash_match(partner_vals)) - set(partner_match_cache))
+        if not address_hash_list:
+            return True
+        for address_hash in address_hash_list:
+            partner_match_cache[address_hash] = False
+        for partner in self.search_read([('mk_address_hash', 'in', address_hash_list)], ['mk_address_hash']):
+            partner_match_cache[partner['mk_address_hash']] = partner_match_cache[partner['mk_address_hash']] or partner['id']
+        return True
+
+    def _find_marketplace_partner_by_hash(self, partner_vals):
+        address_hash = self.get_mk_address_hash(partner_vals)
+        partner_match_cache = self.env.context.get('partner_match_cache')
+        if partner_match_cache is not None and address_hash in partner_match_cache:
+            return partner_match_cache[address_hash] and self.browse(partner_match_cache[address_hash]) or False
+        res_partner = self.search([('mk_address_hash', '=', address_hash)], limit=1)
+        if partner_match_cache is not None:
+            partner_match_cache[address_hash] = res_partner.id
+        return res_partner or False
 
     def _find_marketplace_partner(self, partner_vals, where_clause=[]):
+        # parent_id is never part of partner_vals, so only the address fields take part in matching.
+        if set(where_clause) - {'parent_id'} == set(ADDRESS_HASH_FIELDS) and self._is_mk_address_hash_match(partner_vals):
+            return self._find_marketplace_partner_by_hash(partner_vals)
         if where_clause and partner_vals:
             domain = []
             for key in where_clause:
@@ -36,9 +94,10 @@ class ResPartner(models.Model):
             res_partner = self._find_marketplace_partner(partner_vals, where_clause)
             if res_partner:
                 not parent_id and res_partner.write({'mk_instance_ids': [(4, mk_instance_id.id)]})
-                log_message = 'EXISTING CUSTOMER FOUND: Found customer with same address, CUSTOMER NAME: {}({})'.format(res_partner.name, res_partner.email)
-                self.env['mk.log'].create_update_log(mk_log_id=mk_log_id,
-                                                     mk_log_line_dict={'success': [{'log_message': log_message, 'queue_job_line_id': queue_line_id and queue_line_id.id or False}]})
+                if self.env['mk.log'].is_log_required('success', mk_log_id=mk_log_id, mk_instance_id=mk_instance_id):
+                    log_message = 'EXISTING CUSTOMER FOUND: Found customer with same address, CUSTOMER NAME: {}({})'.format(res_partner.name, res_partner.email)
+                    self.env['mk.log'].create_update_log(mk_log_id=mk_log_id,
+                                                         mk_log_line_dict={'success': [{'log_message': log_message, 'queue_job_line_id': queue_line_id and queue_line_id.id or False}]})
                 if not self.env.context.get('skip_queue_change_state', False):
                     queue_line_id and queue_line_id.write({'state': 'processed'})
         if not res_partner:
@@ -52,9 +111,14 @@ class ResPartner(models.Model):
             res_partner = self.with_context(tracking_disable=True).create({'company_id': mk_instance_id.company_id.id or self.env.user.company_id.id,
                                                                            'lang': mk_instance_id.lang or self.env.user.lang, 'parent_id': parent_id and parent_id.id or False,
                                                                            'property_product_pricelist': mk_instance_id.pricelist_id.id, **partner_vals})
-            log_message = 'IMPORT CUSTOMER: Successfully created new customer with name : {}({})'.format(res_partner.name, res_partner.email)
-            self.env['mk.log'].create_update_log(mk_log_id=mk_log_id,
-                                                 mk_log_line_dict={'success': [{'log_message': log_message, 'queue_job_line_id': queue_line_id and queue_line_id.id or False}]})
+            partner_match_cache = self.env.context.get('partner_match_cache')
+            if partner_match_cache is not None and self._is_mk_address_hash_match(partner_vals):
+                # Hash of the values actually written, the email of the parent may have been added above.
+                partner_match_cache[self.get_mk_address_hash(partner_vals)] = res_partner.id
+            if self.env['mk.log'].is_log_required('success', mk_log_id=mk_log_id, mk_instance_id=mk_instance_id):
+                log_message = 'IMPORT CUSTOMER: Successfully created new customer with name : {}({})'.format(res_partner.name, res_partner.email)
+                self.env['mk.log'].create_update_log(mk_log_id=mk_log_id,
+                                                     mk_log_line_dict={'success': [{'log_message': log_message, 'queue_job_line_id': queue_line_id and queue_line_id.id or False}]})
             if not self.env.context.get('skip_queue_change_state', False):
                 queue_line_id and queue_line_id.write({'state': 'processed'})
         return res_partner
@@ -11,20 +11,63 @@ class SaleOrder(models.Model):
     updated_in_marketplace = fields.Boolean("Updated in Marketplace?", copy=False)
     canceled_in_marketplace = fields.Boolean("Cancel in Marketplace", default=False, copy=False)
 
+    def action_confirm(self):
+        res = super(SaleOrder, self).action_confirm()
+        if self.filtered('mk_instance_id'):
+            self.env['mk.instance'].invalidate_dashboard_cache()
+        return res
+
+    def _action_cancel(self):
+        res = super(SaleOrder, self)._action_cancel()
+        if self.filtered('mk_instance_id'):
+            self.env['mk.instance'].invalidate_dashboard_cache()
+        return res
+
     def _prepare_invoice(self):
         invoice_vals = super(SaleOrder, self)._prepare_invoice()
         if self.mk_instance_id:
             invoice_vals.update({'mk_instance_id': self.mk_instance_id.id})
         return invoice_vals
 
+    def get_order_import_cache(self, cache_name):
+        """ Lookup cache shared by all orders of the batch being imported, the batch passes an empty dict in context key order_import_cache.
+        Outside of a batch a new dict is returned every time so nothing is cached.
+        :param cache_name: name of the lookup, Exp. 'currency'.
+        :return: dict
+        """
+        order_import_cache = self.env.context.get('order_import_cache')
+        if order_import_cache is None:
+            return {}
+        return order_import_cache.setdefault(cache_name, {})
+
+    def preload_mk_listing_items(self, mk_ids, mk_instance_id):
+        """ Fetch listing items of all given marketplace ids in one query into the order import cache. """
+        listing_item_cache = self.get_order_import_cache('mk_listing_item')
+        mk_ids = list(set(str(mk_id) for mk_id in mk_ids if mk_id and str(mk_id) not in listing_item_cache))
+        if mk_ids:
+            for listing_item in self.env['mk.listing.item'].search([('mk_instance_id', '=', mk_instance_id.id), ('mk_id', 'in', mk_ids)]):
+                listing_item_cache.setdefault(listing_item.mk_id, []).append(listing_item.id)
+        return True
+
+    def get_currency_by_name(self, currency_name):
+        currency_cache = self.get_order_import_cache('currency')
+        if currency_name not in currency_cache:
+            currency_cache[currency_name] = self.env['res.currency'].search([('name', '=', currency_name)], limit=1).id
+        return self.env['res.currency'].browse(currency_cache[currency_name])
+
     def get_odoo_tax(self, mk_instance_id, tax_lines, taxes_included):
         tax_list, tax_obj = [], self.env['account.tax']
         mk_log_line_dict = self.env.context.get('mk_log_line_dict', {'error': [], 'success': []})
         queue_line_id = self.env.context.get('queue_line_id', False)
         company_id = mk_instance_id.warehouse_id.company_id
+        tax_cache = self.get_order_import_cache('tax')
         for tax_line in tax_lines:
             rate = round(tax_line['rate'] * 100, 2)
             tax_title = "{} {} {}".format(tax_line['title'], rate, 'Included' if taxes_included else 'Excluded')
+            tax_key = (tax_title, rate, bool(taxes_included), company_id.id)
+            if tax_key in tax_cache:
+                tax_list.append(tax_cache[tax_key])
+                continue
 
             tax_id = tax_obj.search([('name', '=', tax_title), ('amount', '=', rate), ('type_tax_use', '=', 'sale'), ('company_id', '=', company_id.id),
                                      ('price_include', '=', taxes_included), '|', ('active', '=', False), ('active', '=', True)])
@@ -45,6 +88,7 @@ class SaleOrder(models.Model):
                         refund_repartition_lines.account_id = mk_instance_id.tax_refund_account_id.id
                 log_message = "Tax not found so created new Tax {} for Company {} with rate {}.".format(tax_title, company_id.name, rate)
                 mk_log_line_dict['success'].append({'log_message': 'IMPORT ORDER: {}'.format(log_message), 'queue_job_line_id': queue_line_id and queue_line_id.id or False})
+            tax_cache[tax_key] = tax_id.id
             tax_list.append(tax_id.id)
 
         return [(6, 0, tax_list)]
@@ -87,7 +131,13 @@ class SaleOrder(models.Model):
         return order_vals
 
     def get_mk_listing_item_for_mk_order(self, mk_id, mk_instance_id):
-        return self.env['mk.listing.item'].search([('mk_instance_id', '=', mk_instance_id.id), ('mk_id', '=', mk_id)])
+        listing_item_cache = self.get_order_import_cache('mk_listing_item')
+        if mk_id and str(mk_id) in listing_item_cache:
+            return self.env['mk.listing.item'].browse(listing_item_cache[str(mk_id)])
+        listing_item_ids = self.env['mk.listing.item'].search([('mk_instance_id', '=', mk_instance_id.id), ('mk_id', '=', mk_id)])
+        if mk_id and listing_item_ids:
+            listing_item_cache[str(mk_id)] = listing_item_ids.ids
+        return listing_item_ids
 
     def open_sale_order_in_marketplace(self):
         self.ensure_one()
@@ -1,2 +1,3 @@
 from . import sale_report
 from . import marketpalace_sale_report
+from . import marketplace_sale_report_materialized
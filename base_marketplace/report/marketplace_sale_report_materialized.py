@@ -0,0 +1,142 @@
+import hashlib
+import logging
+from datetime import timedelta
+from odoo import tools
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+# Dashboard loads ask the cron for a refresh at most once per this many seconds.
+REFRESH_TRIGGER_DELAY = 60
+
+
+class MKSaleReportMaterialized(models.Model):
+    _name = "mk.sale.report.materialized"
+    _inherit = "mk.sale.report"
+    _description = "Marketplace Sales Analysis Report (Materialized)"
+    _auto = False
+
+    source_write_date = fields.Datetime('Source Last Updated', readonly=True)
+
+    def _materialized_query(self, order_clause=''):
+        with_clause = order_clause and "changed_order AS (%s)" % order_clause
+        from_clause = order_clause and "join changed_order co on (co.id = s.id)"
+        fields = {'source_write_date': ", greatest(s.write_date, max(l.write_date)) as source_write_date"}
+        return self._query(with_clause=with_clause, fields=fields, from_clause=from_clause)
+
+    @property
+    def _refresh_table(self):
+        return '%s_refresh' % self._table
+
+    def _get_refresh_watermark(self):
+        """ Start of the oldest transaction running right now. write_date is the start of the writing transaction, so orders of transactions which
+        are not committed yet have a write_date after the watermark. It is taken in its own cursor before the refresh transaction starts, every
+        transaction not visible to the refresh is then either running here or started later.
+        """
+        with self.pool.cursor() as cr:
+            cr.execute("""
+                SELECT least(clock_timestamp(), min(xact_start)) AT TIME ZONE 'UTC' FROM pg_stat_activity WHERE datname = current_database() AND xact_start IS NOT NULL
+            """)
+            return cr.fetchone()[0]
+
+    def _set_refresh_watermark(self, watermark):
+        self.env.cr.execute("UPDATE {} SET refresh_date = now() AT TIME ZONE 'UTC', watermark = %s".format(self._refresh_table), (watermark,))
+
+    def _get_last_refresh(self):
+        """ :return: tuple (refresh date, watermark) of the last refresh, (None, None) if the report is not refreshed yet. """
+        self.env.cr.execute("SELECT refresh_date, watermark FROM %s" % self._refresh_table)
+        return self.env.cr.fetchone() or (None, None)
+
+    def _get_schema_version(self):
+        """ Hash of the report query, it changes whenever a module adds or changes the columns of the report. """
+        return hashlib.sha1(self._materialized_query().encode('utf-8')).hexdigest()
+
+    def _is_schema_up_to_date(self, schema_version):
+        cr = self.env.cr
+        if not tools.table_exists(cr, self._table) or not tools.column_exists(cr, self._refresh_table, 'schema_version'):
+            return False
+        cr.execute("SELECT schema_version FROM %s" % self._refresh_table)
+        return (cr.fetchone() or (None,))[0] == schema_version
+
+    def init(self):
+        """ The report is stored in a real table so it can be indexed and refreshed per order, PostgreSQL materialized views can only be refreshed as a whole.
+        The table is kept on module update and only created again, empty, when the report query changes. The next refresh computes all orders then.
+        """
+        cr = self.env.cr
+        tools.create_index(cr, 'sale_order_write_date_index', 'sale_order', ['write_date'])
+        tools.create_index(cr, 'sale_order_line_write_date_index', 'sale_order_line', ['write_date'])
+        schema_version = self._get_schema_version()
+        if self._is_schema_up_to_date(schema_version):
+            return
+        _logger.info("Marketplace sales report columns changed, the report is created again.")
+        cr.execute("DROP TABLE IF EXISTS %s" % self._refresh_table)
+        cr.execute("CREATE TABLE %s (schema_version varchar, refresh_date timestamp, watermark timestamp)" % self._refresh_table)
+        cr.execute("INSERT INTO {} (schema_version) VALUES (%s)".format(self._refresh_table), (schema_version,))
+        cr.execute("DROP TABLE IF EXISTS %s" % self._table)
+        cr.execute("CREATE TABLE %s AS (%s) WITH NO DATA" % (self._table, self._materialized_query()))
+        cr.execute("ALTER TABLE %s ADD PRIMARY KEY (id)" % self._table)
+        tools.create_index(cr, '%s_instance_date_index' % self._table, self._table, ['mk_instance_id', 'date'])
+        tools.create_index(cr, '%s_order_id_index' % self._table, self._table, ['order_id'])
+        tools.create_index(cr, '%s_source_write_date_index' % self._table, self._table, ['source_write_date'])
+        self.trigger_refresh_report()
+
+    @api.model
+    def refresh_report(self, purge_deleted=False):
+        """ Recompute rows of orders changed since the last refresh. The refresh runs and is committed in its own transaction.
+        :param purge_deleted: also recompute orders whose lines or the order itself are deleted meanwhile.
+        :return: False if another transaction is already refreshing the report.
+        """
+        watermark = self._get_refresh_watermark()
+        with self.pool.cursor() as cr:
+            res = self.with_env(self.env(cr=cr))._refresh_report(watermark, purge_deleted=purge_deleted)
+        self.invalidate_cache()
+        return res
+
+    def _refresh_report(self, watermark, purge_deleted=False):
+        cr = self.env.cr
+        cr.execute("SELECT pg_try_advisory_xact_lock(hashtext(%s))", (self._table,))
+        if not cr.fetchone()[0]:
+            return False
+        last_refresh_date = self._get_last_refresh()[1]
+        if last_refresh_date:
+            order_clause = """
+                SELECT id FROM sale_order WHERE write_date >= %(date)s
+                 UNION
+                SELECT order_id FROM sale_order_line WHERE write_date >= %(date)s
+            """
+            if purge_deleted:
+                # Deleting lines or orders changes no write_date, such orders are found by their line count (nbr) which no longer matches.
+                order_clause += """
+                 UNION
+                SELECT r.order_id FROM {} r GROUP BY r.order_id
+                HAVING sum(r.nbr) != (SELECT count(*) FROM sale_order_line l WHERE l.order_id = r.order_id)
+                """.format(self._table)
+        else:
+            order_clause = "SELECT id FROM sale_order WHERE mk_instance_id IS NOT NULL"
+        # Changed orders are collected once, the report rows they are found with are deleted below.
+        cr.execute("DROP TABLE IF EXISTS mk_sale_report_changed_order")
+        cr.execute("CREATE TEMP TABLE mk_sale_report_changed_order ON COMMIT DROP AS ({})".format(order_clause), {'date': last_refresh_date})
+        cr.execute("DELETE FROM {} r USING mk_sale_report_changed_order co WHERE r.order_id = co.id".format(self._table))
+        cr.execute("INSERT INTO {} ({})".format(self._table, self._materialized_query("SELECT id FROM mk_sale_report_changed_order")))
+        _logger.info("Marketplace sales report refreshed: %s rows recomputed.", cr.rowcount)
+        if not last_refresh_date:
+            cr.execute("ANALYZE %s" % self._table)
+        self._set_refresh_watermark(watermark)
+        self.env['mk.instance'].invalidate_dashboard_cache()
+        return True
+
+    @api.model
+    def trigger_refresh_report(self):
+        """ Ask the refresh cron for an early run when the report is not refreshed since REFRESH_TRIGGER_DELAY seconds. """
+        refresh_date = self._get_last_refresh()[0]
+        if refresh_date and refresh_date > fields.Datetime.now() - timedelta(seconds=REFRESH_TRIGGER_DELAY):
+            return False
+        cron = self.env.ref('base_marketplace.mk_refresh_sale_report', raise_if_not_found=False)
+        if not cron or self.env['ir.cron.trigger'].sudo().search_count([('cron_id', '=', cron.id)]):
+            return False
+        cron.sudo()._trigger()
+        return True
+
+    @api.model
+    def cron_refresh_report(self):
+        return self.refresh_report(purge_deleted=True)
@@ -20,6 +20,7 @@
         'views/shopify_payment_gateway_view.xml',
         'views/sale_order_view.xml',
         'views/stock_view.xml',
+        'views/webhook_inbox_view.xml',
 
         'wizards/cancel_order_in_marketplace_view.xml',
         'wizards/operation_view.xml',
@@ -32,6 +33,7 @@
         'data/fulfillment_status_data.xml',
         'data/ir_sequence_data.xml',
         'data/data.xml',
+        'data/ir_cron.xml',
 
     ],
 
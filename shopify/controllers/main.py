@@ -1,4 +1,9 @@
+import hmac
+import json
+import uuid
+import base64
 import codecs
+import hashlib
 from .. import shopify
 import logging
 import psycopg2
@@ -10,31 +15,40 @@ _logger = logging.getLogger("Teqstars:Shopify")
 
 class ShopifyWebhook(http.Controller):
 
+    def verify_webhook_hmac(self, mk_instance_id):
+        """ Check X-Shopify-Hmac-Sha256 header against the raw body signed with the Shared Secret of the instance.
+        Without Shared Secret the webhook cannot be authenticated, so it is rejected.
+        """
+        if not mk_instance_id.shared_secret:
+            _logger.warning("SHOPIFY WEBHOOK RECEIVE: Shared Secret is not set for instance {}, webhook rejected.".format(mk_instance_id.name))
+            return False
+        hmac_header = request.httprequest.headers.get('X-Shopify-Hmac-Sha256', '')
+        digest = hmac.new(mk_instance_id.shared_secret.encode('utf-8'), request.httprequest.get_data(), hashlib.sha256).digest()
+        return hmac.compare_digest(base64.b64encode(digest).decode('utf-8'), hmac_header)
+
     @http.route('/shopify/webhook/notification/<string:db_name>/<int:mk_instance_id>', type='json', auth="public", csrf=False)
     def shopify_webhook_process(self, db_name, mk_instance_id, **kwargs):
+        """ Only store the webhook in the inbox and answer right away, Shopify gives up after 5 seconds and redelivers.
+        The inbox is processed by the cron Shopify : Process Webhook Inbox.
+        """
         webhook_type = request.httprequest.headers.get('X-Shopify-Topic', False)
+        webhook_uid = request.httprequest.headers.get('X-Shopify-Webhook-Id') or str(uuid.uuid4())
         try:
             db_registry = registry(db_name)
             with db_registry.cursor() as cr:
                 env = api.Environment(cr, SUPERUSER_ID, {})
-                response = request.jsonrequest or {}
                 mk_instance_id = env['mk.instance'].browse(int(mk_instance_id))
                 if mk_instance_id.state != 'confirmed':
                     return {'status': 'Instance {} is not in Confirmed State.'.format(mk_instance_id.name)}
-                mk_log_line_dict = env.context.get('mk_log_line_dict', {'error': [], 'success': []})
-                try:
-                    mk_log_id = env['mk.log'].create_update_log(mk_instance_id=mk_instance_id, operation_type='webhook')
-                    self.process_webhook_response(env, webhook_type, response, mk_instance_id, mk_log_id)
-                except Exception as e:
-                    log_message = "Error while processing Shopify webhook {}, ERROR: {}.".format(webhook_type, e)
-                    mk_log_line_dict['error'].append({'log_message': 'WEBHOOK PROCESS: {}'.format(log_message)})
-                finally:
-                    env['mk.log'].create_update_log(mk_instance_id=mk_instance_id, mk_log_id=mk_log_id, operation_type='webhook', mk_log_line_dict=mk_log_line_dict)
-                    if not mk_log_id.log_line_ids:
-                        mk_log_id.unlink()
+                if not self.verify_webhook_hmac(mk_instance_id):
+                    _logger.warning("SHOPIFY WEBHOOK RECEIVE: HMAC verification failed for webhook {} of instance {}.".format(webhook_type, mk_instance_id.name))
+                    return {'status': 'HMAC verification failed.'}
+                payload = request.httprequest.get_data().decode('utf-8') or json.dumps(request.jsonrequest or {})
+                if not env['shopify.webhook.inbox.ts'].receive_webhook(webhook_uid, webhook_type, payload, mk_instance_id):
+                    return {'status': 'Already received.'}
         except psycopg2.Error as e:
             _logger.error(_("SHOPIFY WEBHOOK RECEIVE: Error while Processing webhook request. ERROR: {}".format(e)))
-        return {'status': 'Successfully processed.'}
+        return {'status': 'Successfully received.'}
 
     def process_webhook_response(self, env, webhook_type, response, mk_instance_id, mk_log_id):
         mk_listing_obj = env['mk.listing']
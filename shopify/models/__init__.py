@@ -1,4 +1,5 @@
 from . import misc
+from . import bulk_operation
 from . import marketplace_instance
 from . import locations
 from . import res_partner
@@ -9,6 +10,7 @@ from . import listing_image
 from . import collections_condition
 from . import collections
 from . import stock
+from . import stock_ledger
 from . import shopify_payment_gateway
 from . import shopify_order_status
 from . import sale_order
@@ -16,6 +18,7 @@ from . import delivery
 from . import marketplace_listing_image
 from . import shopify_financial_workflow_config
 from . import webhook
+from . import webhook_inbox
 from . import marketplace_queue_job
 from . import shopify_fraud_analysis
 # from . import account_bank_statement
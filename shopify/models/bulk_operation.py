@@ -0,0 +1,378 @@
+import json
+import time
+import logging
+import requests
+from .. import shopify
+from odoo import _
+from odoo.exceptions import UserError
+
+_logger = logging.getLogger("Teqstars:Shopify")
+
+BULK_POLL_INTERVAL = 2
+BULK_POLL_INTERVAL_MAX = 30
+BULK_TIMEOUT = 4 * 60 * 60
+BULK_DOWNLOAD_TIMEOUT = (10, 300)
+
+WEIGHT_UNIT = {'GRAMS': 'g', 'KILOGRAMS': 'kg', 'OUNCES': 'oz', 'POUNDS': 'lb'}
+FULFILLMENT_STATUS = {'FULFILLED': 'fulfilled', 'PARTIALLY_FULFILLED': 'partial', 'RESTOCKED': 'restocked'}
+
+BULK_OPERATION_RUN_QUERY = """
+mutation bulkOperationRunQuery($query: String!) {
+  bulkOperationRunQuery(query: $query) {
+    bulkOperation {
+      id
+      status
+    }
+    userErrors {
+      field
+      message
+    }
+  }
+}
+"""
+
+BULK_OPERATION_STATUS_QUERY = """
+query bulkOperation($id: ID!) {
+  node(id: $id) {
+    ... on BulkOperation {
+      id
+      status
+      errorCode
+      objectCount
+      url
+    }
+  }
+}
+"""
+
+MAILING_ADDRESS_FIELDS = """
+  id first_name: firstName last_name: lastName name company phone
+  address1 address2 city zip province province_code: provinceCode country country_code: countryCodeV2
+"""
+
+# Fields are aliased to the REST names so converted objects can go through the same import as REST responses.
+PRODUCT_BULK_QUERY = """
+{
+  products%(filter)s {
+    edges {
+      node {
+        id title handle vendor tags status
+        body_html: descriptionHtml
+        product_type: productType
+        created_at: createdAt
+        updated_at: updatedAt
+        published_at: publishedAt
+        options { id name position values }
+        images {
+          edges {
+            node { id src: originalSrc alt: altText width height }
+          }
+        }
+        variants {
+          edges {
+            node {
+              id title sku barcode price position taxable weight weightUnit inventoryPolicy
+              compare_at_price: compareAtPrice
+              fulfillmentService { handle }
+              inventoryItem { id tracked }
+              selectedOptions { name value }
+              image { id }
+            }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+CUSTOMER_BULK_QUERY = """
+{
+  customers%(filter)s {
+    edges {
+      node {
+        id email phone note state tags
+        first_name: firstName
+        last_name: lastName
+        created_at: createdAt
+        updated_at: updatedAt
+        default_address: defaultAddress { %(address)s }
+        addresses { %(address)s }
+      }
+    }
+  }
+}
+"""
+
+ORDER_BULK_QUERY = """
+{
+  orders%(filter)s {
+    edges {
+      node {
+        id name email phone note tags paymentGatewayNames displayFinancialStatus displayFulfillmentStatus
+        created_at: createdAt
+        updated_at: updatedAt
+        processed_at: processedAt
+        cancelled_at: cancelledAt
+        closed_at: closedAt
+        taxes_included: taxesIncluded
+        currency: currencyCode
+        source_name: sourceName
+        physicalLocation { id }
+        fulfillments { id location { id } }
+        customer {
+          id email phone note
+          first_name: firstName
+          last_name: lastName
+          default_address: defaultAddress { %(address)s }
+        }
+        billing_address: billingAddress { %(address)s }
+        shipping_address: shippingAddress { %(address)s }
+        transactions { id kind status gateway amountSet { shopMoney { amount } } }
+        shippingLines {
+          edges {
+            node {
+              id title code source
+              originalPriceSet { shopMoney { amount } }
+              discountAllocations { allocatedAmountSet { shopMoney { amount } } }
+              taxLines { title rate priceSet { shopMoney { amount } } }
+            }
+          }
+        }
+        lineItems {
+          edges {
+            node {
+              id name title sku quantity taxable vendor
+              variant { id }
+              product { id }
+              originalUnitPriceSet { shopMoney { amount } }
+              discountAllocations { allocatedAmountSet { shopMoney { amount } } }
+              taxLines { title rate priceSet { shopMoney { amount } } }
+            }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+
+def get_legacy_id(gid):
+    """ gid://shopify/MailingAddress/123?model_name=CustomerAddress -> 123 """
+    if not gid:
+        return None
+    return int(gid.split('?', 1)[0].rsplit('/', 1)[-1])
+
+
+def get_gid_type(gid):
+    """ gid://shopify/ProductVariant/123 -> ProductVariant """
+    return gid.split('/')[-2] if gid else ''
+
+
+def get_shop_money(money_bag):
+    return ((money_bag or {}).get('shopMoney') or {}).get('amount')
+
+
+def get_date_filter(field_name, operator, date):
+    """ Search filter of a naive UTC datetime, i.e. updated_at:>='2022-01-01T00:00:00Z' """
+    return "{}:{}'{}'".format(field_name, operator, date.strftime('%Y-%m-%dT%H:%M:%SZ')) if date else ''
+
+
+def get_search_filter(query_filter_list):
+    query_filter = ' '.join(query_filter for query_filter in query_filter_list if query_filter)
+    return '(query: %s)' % json.dumps(query_filter) if query_filter else ''
+
+
+def run_bulk_operation(query):
+    """ Submit a bulk query and wait until Shopify has written the result.
+    :return: url of the JSONL result, False if query has no result.
+    """
+    graphql = shopify.GraphQL()
+    result = json.loads(graphql.execute(BULK_OPERATION_RUN_QUERY, {'query': query}))
+    run_result = (result.get('data') or {}).get('bulkOperationRunQuery') or {}
+    errors = result.get('errors') or run_result.get('userErrors')
+    if errors:
+        raise UserError(_("Shopify Bulk Operation is not started. ERROR: {}".format(', '.join(error.get('message', '') for error in errors))))
+    bulk_operation_id = run_result.get('bulkOperation', {}).get('id')
+    _logger.info("Shopify Bulk Operation {} started.".format(bulk_operation_id))
+    poll_interval, deadline = BULK_POLL_INTERVAL, time.time() + BULK_TIMEOUT
+    while True:
+        time.sleep(poll_interval)
+        bulk_operation = (json.loads(graphql.execute(BULK_OPERATION_STATUS_QUERY, {'id': bulk_operation_id})).get('data') or {}).get('node') or {}
+        status = bulk_operation.get('status')
+        if status == 'COMPLETED':
+            _logger.info("Shopify Bulk Operation {} completed with {} objects.".format(bulk_operation_id, bulk_operation.get('objectCount')))
+            return bulk_operation.get('url') or False
+        if status in ('FAILED', 'CANCELED', 'EXPIRED'):
+            raise UserError(_("Shopify Bulk Operation {} is {}. ERROR: {}".format(bulk_operation_id, status, bulk_operation.get('errorCode'))))
+        if time.time() > deadline:
+            raise UserError(_("Shopify Bulk Operation {} is not completed in time.".format(bulk_operation_id)))
+        poll_interval = min(poll_interval * 2, BULK_POLL_INTERVAL_MAX)
+
+
+def iter_bulk_operation_result(url):
+    """ Stream JSONL result of bulk operation line by line without downloading whole file in memory. """
+    if not url:
+        return
+    with requests.get(url, stream=True, timeout=BULK_DOWNLOAD_TIMEOUT) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if line:
+                yield json.loads(line)
+
+
+def iter_bulk_objects(bulk_line_list):
+    """ Reassemble top level objects with their nested connection nodes.
+    Shopify writes every object followed by the nodes of its nested connections, child nodes have __parentId.
+    Only the object being assembled is kept in memory, children are set in __children grouped by their type.
+    """
+    parent_dict, node_dict = None, {}
+    for line in bulk_line_list:
+        parent_gid = line.pop('__parentId', None)
+        if not parent_gid:
+            if parent_dict is not None:
+                yield parent_dict
+            parent_dict, node_dict = line, {line.get('id'): line}
+            continue
+        owner_dict = node_dict.get(parent_gid)
+        if owner_dict is None:
+            _logger.warning("Shopify Bulk Operation: parent {} not found for {}, skipped.".format(parent_gid, line.get('id')))
+            continue
+        owner_dict.setdefault('__children', {}).setdefault(get_gid_type(line.get('id')), []).append(line)
+        if line.get('id'):
+            node_dict[line['id']] = line
+    if parent_dict is not None:
+        yield parent_dict
+
+
+def convert_bulk_address(address_dict):
+    if not address_dict:
+        return address_dict
+    address_dict = dict(address_dict, id=get_legacy_id(address_dict.get('id')))
+    address_dict['country_name'] = address_dict.get('country')
+    return address_dict
+
+
+def convert_bulk_product(product_dict):
+    children = product_dict.pop('__children', {})
+    product_id = get_legacy_id(product_dict.get('id'))
+    option_names = [option.get('name') for option in product_dict.get('options') or []]
+    shopify_product_dict = dict(product_dict, id=product_id, admin_graphql_api_id=product_dict.get('id'), tags=', '.join(product_dict.get('tags') or []),
+                                status=(product_dict.get('status') or '').lower())
+    shopify_product_dict['options'] = [{'id': get_legacy_id(option.get('id')), 'product_id': product_id, 'name': option.get('name'), 'position': option.get('position'),
+                                        'values': option.get('values')} for option in product_dict.get('options') or []]
+    variant_list, image_variant_dict = [], {}
+    for variant in children.get('ProductVariant', []):
+        variant_id = get_legacy_id(variant.get('id'))
+        selected_option_dict = {option.get('name'): option.get('value') for option in variant.get('selectedOptions') or []}
+        inventory_item = variant.get('inventoryItem') or {}
+        variant_dict = {
+            'id': variant_id,
+            'admin_graphql_api_id': variant.get('id'),
+            'product_id': product_id,
+            'title': variant.get('title'),
+            'sku': variant.get('sku'),
+            'barcode': variant.get('barcode'),
+            'price': variant.get('price'),
+            'compare_at_price': variant.get('compare_at_price'),
+            'position': variant.get('position'),
+            'taxable': variant.get('taxable'),
+            'weight': variant.get('weight'),
+            'weight_unit': WEIGHT_UNIT.get(variant.get('weightUnit')),
+            'inventory_policy': (variant.get('inventoryPolicy') or '').lower(),
+            'inventory_management': 'shopify' if inventory_item.get('tracked') else None,
+            'inventory_item_id': get_legacy_id(inventory_item.get('id')),
+            'fulfillment_service': (variant.get('fulfillmentService') or {}).get('handle'),
+            'image_id': get_legacy_id((variant.get('image') or {}).get('id')),
+        }
+        for index, option_name in enumerate(option_names[:3], start=1):
+            variant_dict['option{}'.format(index)] = selected_option_dict.get(option_name)
+        if variant.get('image'):
+            image_variant_dict.setdefault(variant['image'].get('id'), []).append(variant_id)
+        variant_list.append(variant_dict)
+    shopify_product_dict['variants'] = variant_list
+    # Images do not have updated date in GraphQL, product updated date is used so image is downloaded again when product is changed.
+    shopify_product_dict['images'] = [dict(image, id=get_legacy_id(image.get('id')), admin_graphql_api_id=image.get('id'), product_id=product_id, position=position,
+                                           variant_ids=image_variant_dict.get(image.get('id'), []), updated_at=product_dict.get('updated_at'))
+                                      for position, image in enumerate(children.get('ProductImage', []), start=1)]
+    shopify_product_dict['image'] = shopify_product_dict['images'] and shopify_product_dict['images'][0] or None
+    return shopify_product_dict
+
+
+def convert_bulk_customer(customer_dict):
+    customer_dict.pop('__children', None)
+    return dict(customer_dict, id=get_legacy_id(customer_dict.get('id')), admin_graphql_api_id=customer_dict.get('id'), tags=', '.join(customer_dict.get('tags') or []),
+                state=(customer_dict.get('state') or '').lower(), default_address=convert_bulk_address(customer_dict.get('default_address')),
+                addresses=[convert_bulk_address(address) for address in customer_dict.get('addresses') or []])
+
+
+def convert_bulk_tax_lines(tax_line_list):
+    return [{'title': tax_line.get('title'), 'rate': tax_line.get('rate'), 'price': get_shop_money(tax_line.get('priceSet'))} for tax_line in tax_line_list or []]
+
+
+def convert_bulk_discount_allocations(discount_allocation_list):
+    return [{'amount': get_shop_money(discount_allocation.get('allocatedAmountSet'))} for discount_allocation in discount_allocation_list or []]
+
+
+def convert_bulk_order(order_dict):
+    children = order_dict.pop('__children', {})
+    order_id = get_legacy_id(order_dict.get('id'))
+    shopify_order_dict = {key: value for key, value in order_dict.items() if key not in ('paymentGatewayNames', 'displayFinancialStatus', 'displayFulfillmentStatus',
+                                                                                          'physicalLocation', 'fulfillments')}
+    customer_dict = order_dict.get('customer')
+    shopify_order_dict.update({
+        'id': order_id,
+        'admin_graphql_api_id': order_dict.get('id'),
+        'tags': ', '.join(order_dict.get('tags') or []),
+        'gateway': (order_dict.get('paymentGatewayNames') or [''])[0],
+        'payment_gateway_names': order_dict.get('paymentGatewayNames') or [],
+        'financial_status': (order_dict.get('displayFinancialStatus') or '').lower() or None,
+        'fulfillment_status': FULFILLMENT_STATUS.get(order_dict.get('displayFulfillmentStatus')),
+        'location_id': get_legacy_id((order_dict.get('physicalLocation') or {}).get('id')),
+        'fulfillments': [{'id': get_legacy_id(fulfillment.get('id')), 'order_id': order_id, 'location_id': get_legacy_id((fulfillment.get('location') or {}).get('id'))}
+                         for fulfillment in order_dict.get('fulfillments') or []],
+        'customer': customer_dict and dict(customer_dict, id=get_legacy_id(customer_dict.get('id')), default_address=convert_bulk_address(customer_dict.get('default_address'))),
+        'billing_address': convert_bulk_address(order_dict.get('billing_address')),
+        'shipping_address': convert_bulk_address(order_dict.get('shipping_address')),
+        'transactions': [{'id': get_legacy_id(transaction.get('id')), 'order_id': order_id, 'kind': (transaction.get('kind') or '').lower(),
+                          'status': (transaction.get('status') or '').lower(), 'gateway': transaction.get('gateway'), 'amount': get_shop_money(transaction.get('amountSet'))}
+                         for transaction in order_dict.get('transactions') or []],
+    })
+    # REST leaves out empty addresses and customer, import checks for the keys.
+    for key in ('customer', 'billing_address', 'shipping_address'):
+        if not shopify_order_dict.get(key):
+            shopify_order_dict.pop(key, None)
+    shopify_order_dict['shipping_lines'] = [{'id': get_legacy_id(shipping_line.get('id')), 'title': shipping_line.get('title'), 'code': shipping_line.get('code'),
+                                             'source': shipping_line.get('source'), 'price': get_shop_money(shipping_line.get('originalPriceSet')),
+                                             'discount_allocations': convert_bulk_discount_allocations(shipping_line.get('discountAllocations')),
+                                             'tax_lines': convert_bulk_tax_lines(shipping_line.get('taxLines'))}
+                                            for shipping_line in children.get('ShippingLine', [])]
+    shopify_order_dict['line_items'] = [{'id': get_legacy_id(line_item.get('id')), 'name': line_item.get('name'), 'title': line_item.get('title'), 'sku': line_item.get('sku'),
+                                         'quantity': line_item.get('quantity'), 'taxable': line_item.get('taxable'), 'vendor': line_item.get('vendor'),
+                                         'variant_id': get_legacy_id((line_item.get('variant') or {}).get('id')),
+                                         'product_id': get_legacy_id((line_item.get('product') or {}).get('id')),
+                                         'price': get_shop_money(line_item.get('originalUnitPriceSet')),
+                                         'discount_allocations': convert_bulk_discount_allocations(line_item.get('discountAllocations')),
+                                         'tax_lines': convert_bulk_tax_lines(line_item.get('taxLines'))}
+                                        for line_item in children.get('LineItem', [])]
+    return shopify_order_dict
+
+
+def fetch_bulk_objects(query, convert_method):
+    """ Run bulk query and yield every top level object converted to the REST format. """
+    url = run_bulk_operation(query)
+    for bulk_object in iter_bulk_objects(iter_bulk_operation_result(url)):
+        yield convert_method(bulk_object)
+
+
+def fetch_bulk_products(query_filter_list):
+    return fetch_bulk_objects(PRODUCT_BULK_QUERY % {'filter': get_search_filter(query_filter_list)}, convert_bulk_product)
+
+
+def fetch_bulk_customers(query_filter_list):
+    return fetch_bulk_objects(CUSTOMER_BULK_QUERY % {'filter': get_search_filter(query_filter_list), 'address': MAILING_ADDRESS_FIELDS}, convert_bulk_customer)
+
+
+def fetch_bulk_orders(query_filter_list):
+    return fetch_bulk_objects(ORDER_BULK_QUERY % {'filter': get_search_filter(query_filter_list), 'address': MAILING_ADDRESS_FIELDS}, convert_bulk_order)
@@ -67,6 +67,17 @@ class MkInstance(models.Model):
     shopify_location_ids = fields.One2many('shopify.location.ts', 'mk_instance_id', string="Locations")
     shopify_location_count = fields.Integer("Location Count", compute='_get_mk_kanban_counts')
     
+    # Stock Fields.
+    is_batch_stock_export = fields.Boolean("Batch Stock Export?", default=False,
+                                           help="Export stock per location in batches of 250 items through GraphQL instead of one API call per variant.")
+    stock_reconcile_interval = fields.Integer("Stock Reconciliation Interval (Days)", default=7,
+                                              help="Only changed stock is exported, every given days the stock of all listed items is compared with Shopify and exported if different. 0 to disable.")
+    last_stock_reconcile_date = fields.Datetime("Last Stock Reconciled On", copy=False)
+
+    # Import Fields.
+    is_bulk_import = fields.Boolean("Bulk Import?", default=False,
+                                    help="Import Products, Customers and Orders through GraphQL Bulk Operations instead of REST pages. Recommended for first time and full imports.")
+
     # Customer Fields.
     is_create_company_contact = fields.Boolean("Create Company Contact?", default=False, help="It will create company contact if found company while creating Customer.")
 
@@ -166,7 +177,15 @@ class MkInstance(models.Model):
             if data:
                 data = json.dumps(data)
             headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
-            response = requests.request(method, shop_url, auth=(self.api_key, self.password), headers=headers, data=data, params=params)
+            rate_limiter, attempt = shopify.RateLimiter.for_site(shop_url), 0
+            while True:
+                rate_limiter.throttle()
+                response = requests.request(method, shop_url, auth=(self.api_key, self.password), headers=headers, data=data, params=params)
+                rate_limiter.update(response.headers)
+                if response.status_code != 429 or attempt >= rate_limiter.MAX_RETRIES:
+                    break
+                rate_limiter.backoff(attempt, response.headers)  # next throttle() waits for the back-off.
+                attempt += 1
         except Exception as e:
             return e
         return response
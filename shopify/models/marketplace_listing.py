@@ -1,17 +1,38 @@
-import time
-import base64
-import pprint
-import requests
+import json
+import hashlib
+import itertools
 from .. import shopify
 from datetime import timedelta
-import urllib.parse as urlparse
 from odoo import models, fields, tools, _
-from .misc import convert_shopify_datetime_to_utc
+from .misc import convert_shopify_datetime_to_utc, download_images
+from .bulk_operation import fetch_bulk_products, get_date_filter
 from odoo.exceptions import AccessError, UserError
 
+# Keys of the Shopify product and its variants/options/images mapped on listings, items and Odoo products. Changes in other keys like inventory quantities or
+# updated_at do not need the product to be imported again.
+FINGERPRINT_PRODUCT_KEYS = ['title', 'body_html', 'description', 'product_type', 'tags', 'taxable', 'created_at', 'published_at']
+FINGERPRINT_VARIANT_KEYS = ['id', 'title', 'sku', 'barcode', 'price', 'weight', 'weight_unit', 'inventory_policy', 'inventory_management', 'inventory_item_id', 'taxable',
+                            'option1', 'option2', 'option3', 'created_at']
+FINGERPRINT_OPTION_KEYS = ['name', 'values']
+FINGERPRINT_IMAGE_KEYS = ['id', 'position', 'variant_ids']
+
 INVENTORY_MANAGEMENT = [('shopify', 'Track Quantity'), ('dont_track', 'Dont track Inventory')]
 FULFILLMENT_SERVICE = [('manual', 'Manual'), ('shopify', 'shopify'), ('gift_card', 'Gift Card')]
 
+# inventorySetOnHandQuantities is not available in the 2022-01 API used for REST calls.
+INVENTORY_GRAPHQL_API_VERSION = '2023-01'
+INVENTORY_SET_QUANTITIES_LIMIT = 250
+INVENTORY_SET_ON_HAND_QUANTITIES = """
+mutation inventorySetOnHandQuantities($input: InventorySetOnHandQuantitiesInput!) {
+  inventorySetOnHandQuantities(input: $input) {
+    userErrors {
+      field
+      message
+    }
+  }
+}
+"""
+
 
 class MkListing(models.Model):
     _inherit = "mk.listing"
@@ -24,6 +45,8 @@ class MkListing(models.Model):
     is_taxable = fields.Boolean("Taxable", default=False)
     shopify_image_ids = fields.One2many('shopify.product.image.ts', 'mk_listing_id', 'Shopify Images')
     collection_id = fields.One2many("shopify.collection.ts", "mk_listing_ids", "Collections")
+    shopify_fingerprint = fields.Char("Shopify Fingerprint", copy=False, readonly=True, help="Hash of the Shopify product data mapped in Odoo at the last import, "
+                                                                                             "used to skip importing product again when nothing mapped has changed.")
 
     def publish_product_in_shopify(self):
         mk_instance_id = self.mk_instance_id
@@ -82,26 +105,13 @@ class MkListing(models.Model):
         return True
 
     def fetch_all_shopify_products(self, mk_instance_id):
+        """ Yield Shopify products page by page so only one page is kept in memory. """
+        params = {'limit': mk_instance_id.api_limit or 250}
+        if mk_instance_id.last_listing_import_date:
+            params.update({'updated_at_min': mk_instance_id.last_listing_import_date})
         try:
-            shopify_product_list, api_limit, page_info = [], mk_instance_id.api_limit or 250, False
-            while 1:
-                if mk_instance_id.last_listing_import_date:
-                    if page_info:
-                        page_wise_product_list = shopify.Product().find(limit=api_limit, page_info=page_info)
-                    else:
-                        page_wise_product_list = shopify.Product().find(updated_at_min=mk_instance_id.last_listing_import_date, limit=api_limit)
-                else:
-                    if page_info:
-                        page_wise_product_list = shopify.Product().find(limit=api_limit, page_info=page_info)
-                    else:
-                        page_wise_product_list = shopify.Product().find(limit=api_limit)
-                page_url = page_wise_product_list.next_page_url
-                parsed = urlparse.parse_qs(page_url)
-                page_info = parsed.get('page_info', False) and parsed.get('page_info', False)[0] or False
-                shopify_product_list += page_wise_product_list
-                if not page_info:
-                    break
-            return shopify_product_list
+            for page_wise_product_list in shopify.PaginatedIterator(shopify.Product().find(**params)):
+                yield page_wise_product_list
         except Exception as e:
             raise AccessError(e)
 
@@ -118,19 +128,17 @@ class MkListing(models.Model):
         attribute_line_vals = []
         shopify_variant_list = shopify_product_dict.get("variants")
         if len(shopify_variant_list) > 1:
-            for product_attribute_dict in shopify_product_dict.get("options", ""):
-                attribute_name = product_attribute_dict.get("name", "")
-                attribute_values = product_attribute_dict.get('values', '')
-                product_attribute_id = product_attribute_obj.search([("name", "=ilike", attribute_name)], limit=1)
+            shopify_option_list = shopify_product_dict.get("options", "")
+            attribute_dict = product_attribute_obj.get_mk_attributes([product_attribute_dict.get("name", "") for product_attribute_dict in shopify_option_list])
+            attribute_value_list = [(attribute_dict.get(product_attribute_dict.get("name", "").lower()), attribute_value) for product_attribute_dict in shopify_option_list
+                                    for attribute_value in product_attribute_dict.get('values', '')]
+            attribute_value_dict = product_attribute_value_obj.get_mk_attribute_values(attribute_value_list)
+            for product_attribute_dict in shopify_option_list:
+                product_attribute_id = attribute_dict.get(product_attribute_dict.get("name", "").lower())
                 if not product_attribute_id:
-                    product_attribute_id = product_attribute_obj.create({"name": attribute_name})
-
-                product_attribute_value_id_list = []
-                for attribute_value in attribute_values:
-                    attrib_value = product_attribute_value_obj.search([("attribute_id", "=", product_attribute_id.id), ("name", "=ilike", attribute_value)], limit=1)
-                    if not attrib_value:
-                        attrib_value = product_attribute_value_obj.with_context(active_id=False).create({"attribute_id": product_attribute_id.id, "name": attribute_value})
-                    product_attribute_value_id_list.append(attrib_value.id)
+                    continue
+                product_attribute_value_id_list = [attribute_value_dict[(product_attribute_id.id, attribute_value.lower())].id
+                                                   for attribute_value in product_attribute_dict.get('values', '') if attribute_value]
 
                 if product_attribute_value_id_list:
                     attribute_line_ids_data = [0, False, {"attribute_id": product_attribute_id.id, "value_ids": [[6, False, product_attribute_value_id_list]]}]
@@ -267,52 +275,85 @@ class MkListing(models.Model):
         return vals
 
     def prepage_tag_vals(self, shopify_product_tags):
-        shopify_tag_obj = self.env['shopify.tags.ts']
-        shopify_tag_list = []
-        sequence = 1
-        for tag in shopify_product_tags.split(','):
-            if len(tag) < 1:
-                continue
-            shopify_tag_id = shopify_tag_obj.search([('name', '=', tag)], limit=1)
-            if not shopify_tag_id:
-                shopify_tag_id = shopify_tag_obj.create({'name': tag, 'sequence': sequence})
-                sequence += 1
-            shopify_tag_list.append(shopify_tag_id.id)
+        shopify_tag_dict = self.env['shopify.tags.ts'].get_shopify_tag_dict([shopify_product_tags])
+        shopify_tag_list = [shopify_tag_dict[tag] for tag in (shopify_product_tags or '').split(',') if len(tag) >= 1]
         return {'tag_ids': [(6, 0, shopify_tag_list)]}
 
     def sync_product_image_from_shopify(self, mk_instance_id, mk_listing_id, shopify_product_dict):
+        if mk_listing_id.env.context.get('shopify_listing_unchanged'):
+            return True
         shopify_image_response_vals = shopify_product_dict.get('images', {})
         mk_listing_image = self.env['mk.listing.image']
         mk_listing_item_obj = self.env['mk.listing.item']
+        mk_log_line_dict = self.env.context.get('mk_log_line_dict', {'error': [], 'success': []})
         if not shopify_image_response_vals:
             mk_instance_id.connection_to_shopify()
             images = shopify.Image().find(product_id=mk_listing_id.mk_id)
             shopify_image_response_vals = [image.to_dict() for image in images]
-        for image in shopify_image_response_vals:
-            image_url = image.get('src')
-            if image_url:
-                variant_ids, shopify_image_id = image.get('variant_ids'), image.get('id')
-                mk_listing_item_ids = mk_listing_item_obj.search([('mk_instance_id', '=', mk_instance_id.id), ('mk_id', 'in', variant_ids)])
-                listing_image_id = mk_listing_image.search([('mk_id', '=', shopify_image_id)])
-                image_binary = base64.b64encode(requests.get(image_url).content)
-                vals = {
-                    'name': mk_listing_id.name,
-                    'mk_id': shopify_image_id,
-                    'sequence': image.get('position'),
-                    'image': image_binary,
-                    'mk_listing_id': mk_listing_id.id,
-                    'mk_listing_item_ids': [(6, 0, mk_listing_item_ids.ids)],
-                }
-                if listing_image_id:
-                    listing_image_id.write(vals)
-                else:
-                    mk_listing_image.create(vals)
-
-                for listing_item in mk_listing_item_ids:
-                    listing_item.product_id.write({'image_1920': image_binary})
-
-                if image.get('position') == 1:
-                    mk_listing_id.product_tmpl_id.write({'image_1920': image_binary})
+        shopify_image_list = [image for image in shopify_image_response_vals if image.get('src')]
+        if not shopify_image_list:
+            return True
+
+        existing_image_dict = {listing_image.mk_id: listing_image for listing_image in mk_listing_image.search([('mk_id', 'in', [str(image.get('id')) for image in shopify_image_list])])}
+        variant_ids = [variant_id for image in shopify_image_list for variant_id in image.get('variant_ids') or []]
+        mk_listing_item_dict = {}
+        for listing_item in mk_listing_item_obj.search([('mk_instance_id', '=', mk_instance_id.id), ('mk_id', 'in', [str(variant_id) for variant_id in variant_ids])]):
+            mk_listing_item_dict.setdefault(listing_item.mk_id, listing_item)
+
+        # Only download images which are new or changed since last import.
+        image_url_list = []
+        for image in shopify_image_list:
+            listing_image_id = existing_image_dict.get(str(image.get('id')))
+            if not listing_image_id or not listing_image_id.image or listing_image_id.shopify_updated_at != image.get('updated_at'):
+                image_url_list.append(image.get('src'))
+        image_binary_dict = download_images(image_url_list)
+
+        product_image_dict, template_image_binary = {}, False
+        for image in shopify_image_list:
+            image_url, shopify_image_id = image.get('src'), str(image.get('id'))
+            mk_listing_item_ids = mk_listing_item_obj.browse(
+                [mk_listing_item_dict[str(variant_id)].id for variant_id in image.get('variant_ids') or [] if str(variant_id) in mk_listing_item_dict])
+            listing_image_id = existing_image_dict.get(shopify_image_id)
+            vals = {
+                'name': mk_listing_id.name,
+                'mk_id': shopify_image_id,
+                'sequence': image.get('position'),
+                'mk_listing_id': mk_listing_id.id,
+                'mk_listing_item_ids': [(6, 0, mk_listing_item_ids.ids)],
+                'shopify_updated_at': image.get('updated_at'),
+            }
+            if image_url in image_binary_dict:
+                image_binary = image_binary_dict[image_url]
+                if not image_binary:
+                    mk_log_line_dict['error'].append({'log_message': 'IMPORT IMAGE: Unable to download image {} of listing {}.'.format(image_url, mk_listing_id.name)})
+                    continue
+                # Shopify may change updated_at without changing the image itself, skip writing same binary again.
+                is_image_changed = not listing_image_id or listing_image_id.image_hex != hashlib.md5(image_binary).hexdigest()
+            else:
+                image_binary, is_image_changed = listing_image_id.image, False
+            if is_image_changed:
+                vals.update({'image': image_binary})
+                changed_product_ids = mk_listing_item_ids.mapped('product_id')
+            else:
+                changed_product_ids = (mk_listing_item_ids - listing_image_id.mk_listing_item_ids).mapped('product_id')
+            if listing_image_id:
+                listing_image_id.write(vals)
+            else:
+                mk_listing_image.create(vals)
+
+            for product in changed_product_ids:
+                product_image_dict[product.id] = image_binary
+            if image.get('position') == 1 and is_image_changed:
+                template_image_binary = image_binary
+
+        # Write every distinct binary once on all the variants using it.
+        binary_product_dict = {}
+        for product_id, image_binary in product_image_dict.items():
+            binary_product_dict.setdefault(image_binary, []).append(product_id)
+        for image_binary, product_ids in binary_product_dict.items():
+            self.env['product.product'].browse(product_ids).write({'image_1920': image_binary})
+        if template_image_binary:
+            mk_listing_id.product_tmpl_id.write({'image_1920': template_image_binary})
         return True
 
     def get_existing_mk_listing_and_odoo_product(self, shopify_variant_list, mk_instance_id):
@@ -330,6 +371,16 @@ class MkListing(models.Model):
             listing_item_id and existing_mk_product.update({variant_dict.get("id"): listing_item_id})
         return existing_mk_product, existing_odoo_product, odoo_product_template
 
+    def get_shopify_product_fingerprint(self, shopify_product_dict, mk_instance_id):
+        """ Stable hash of the Shopify product data mapped in Odoo, along with the instance settings changing how it is mapped. """
+        fingerprint_dict = {key: shopify_product_dict.get(key) for key in FINGERPRINT_PRODUCT_KEYS}
+        fingerprint_dict.update({
+            'variants': [{key: variant_dict.get(key) for key in FINGERPRINT_VARIANT_KEYS} for variant_dict in shopify_product_dict.get('variants') or []],
+            'options': [{key: option_dict.get(key) for key in FINGERPRINT_OPTION_KEYS} for option_dict in shopify_product_dict.get('options') or []],
+            'images': [{key: image_dict.get(key) for key in FINGERPRINT_IMAGE_KEYS} for image_dict in shopify_product_dict.get('images') or []],
+            'instance': [mk_instance_id.pricelist_id.id, mk_instance_id.sync_product_with, mk_instance_id.is_update_odoo_product_category, mk_instance_id.is_sync_images]})
+        return hashlib.md5(json.dumps(fingerprint_dict, sort_keys=True, default=str).encode()).hexdigest()
+
     def create_update_shopify_product(self, shopify_product_dict, mk_instance_id, update_product_price=False, is_update_existing_products=True):
         mk_log_id = self.env.context.get('mk_log_id', False)
         queue_line_id = self.env.context.get('queue_line_id', False)
@@ -340,6 +391,11 @@ class MkListing(models.Model):
         mk_listing_id = self.search([('mk_instance_id', '=', mk_instance_id.id), ('mk_id', '=', mk_id)])
         if not mk_listing_id and not is_update_existing_products:
             return False
+        # Nothing mapped has changed since the last complete import (Exp. inventory only update), returned listing tells image sync to skip as well.
+        shopify_fingerprint = self.get_shopify_product_fingerprint(shopify_product_dict, mk_instance_id)
+        if len(mk_listing_id) == 1 and mk_listing_id.shopify_fingerprint == shopify_fingerprint and mk_listing_id.item_count == len(shopify_variant_list) \
+                and not self.env.context.get('force_listing_import'):
+            return mk_listing_id.with_context(shopify_listing_unchanged=True)
         variant_sequence = 1
         listing_updated = False
 
@@ -427,9 +483,10 @@ class MkListing(models.Model):
                     shopify_product_template_vals = self.prepare_marketplace_listing_vals_for_shopify(mk_instance_id, shopify_product_dict, variant_dict, odoo_product_id,
                                                                                                       product_category_id)
                     mk_listing_id = self.create(shopify_product_template_vals)
-                    log_message = 'IMPORT LISTING: {} successfully created'.format(mk_listing_id.name)
-                    self.env['mk.log'].create_update_log(mk_instance_id=mk_instance_id, mk_log_id=mk_log_id, mk_log_line_dict={
-                        'success': [{'log_message': log_message, 'queue_job_line_id': queue_line_id and queue_line_id.id or False}]})
+                    if self.env['mk.log'].is_log_required('success', mk_instance_id=mk_instance_id):
+                        log_message = 'IMPORT LISTING: {} successfully created'.format(mk_listing_id.name)
+                        self.env['mk.log'].create_update_log(mk_instance_id=mk_instance_id, mk_log_id=mk_log_id, mk_log_line_dict={
+                            'success': [{'log_message': log_message, 'queue_job_line_id': queue_line_id and queue_line_id.id or False}]})
                 if not odoo_product_id:
                     if not mk_instance_id.is_create_products:
                         log_message = "IMPORT LISTING ITEM: Odoo Product Variant not found for Shopify Product Variant : {} and SKU: {} and Barcode : {}".format(
@@ -440,8 +497,9 @@ class MkListing(models.Model):
                     if odoo_product_template.attribute_line_ids:
                         shopify_attribute_ids = self.env["product.attribute"]
                         odoo_attributes = odoo_product_template.attribute_line_ids.attribute_id
-                        for attribute in shopify_product_dict.get('options'):
-                            attribute_id = self.env["product.attribute"].search([('name', '=ilike', attribute["name"]), ('create_variant', '=', 'always')], limit=1)
+                        attribute_dict = self.env["product.attribute"].get_mk_attributes([attribute["name"] for attribute in shopify_product_dict.get('options')],
+                                                                                         create=False, create_variant='always')
+                        for attribute_id in attribute_dict.values():
                             shopify_attribute_ids |= attribute_id
                         if odoo_attributes != shopify_attribute_ids or len(odoo_attributes) != len(shopify_product_dict.get('options')):
                             log_message = "IMPORT LISTING ITEM: Odoo attribute ({}) isn't matching with Shopify attribute ({}) for Shopify Product : {}".format(
@@ -484,9 +542,10 @@ class MkListing(models.Model):
                     odoo_product_id.weight = converted_weight
                 listing_item_id = mk_listing_item_obj.create(mk_listing_item_vals)
                 variant_sequence += 1
-                self.env['mk.log'].create_update_log(mk_instance_id=mk_instance_id, mk_log_id=mk_log_id, mk_log_line_dict={'success': [
-                    {'log_message': 'IMPORT LISTING ITEM: {} ({}) successfully created'.format(mk_listing_id.name, listing_item_id.mk_id),
-                     'queue_job_line_id': queue_line_id and queue_line_id.id or False}]})
+                if self.env['mk.log'].is_log_required('success', mk_instance_id=mk_instance_id):
+                    self.env['mk.log'].create_update_log(mk_instance_id=mk_instance_id, mk_log_id=mk_log_id, mk_log_line_dict={'success': [
+                        {'log_message': 'IMPORT LISTING ITEM: {} ({}) successfully created'.format(mk_listing_id.name, listing_item_id.mk_id),
+                         'queue_job_line_id': queue_line_id and queue_line_id.id or False}]})
             else:
                 if not listing_updated:
                     listing_vals = self.prepare_marketplace_listing_vals_for_shopify(mk_instance_id, shopify_product_dict, variant_dict,
@@ -500,12 +559,16 @@ class MkListing(models.Model):
                 if converted_weight and odoo_product_id and not odoo_product_id.weight:
                     odoo_product_id.weight = converted_weight
                 variant_sequence = variant_sequence + 1
-                self.env['mk.log'].create_update_log(mk_instance_id=mk_instance_id, mk_log_id=mk_log_id, mk_log_line_dict={'success': [
-                    {'log_message': 'IMPORT LISTING: {} successfully updated'.format(mk_listing_id.name), 'queue_job_line_id': queue_line_id and queue_line_id.id or False}]})
+                if self.env['mk.log'].is_log_required('success', mk_instance_id=mk_instance_id):
+                    self.env['mk.log'].create_update_log(mk_instance_id=mk_instance_id, mk_log_id=mk_log_id, mk_log_line_dict={'success': [
+                        {'log_message': 'IMPORT LISTING: {} successfully updated'.format(mk_listing_id.name), 'queue_job_line_id': queue_line_id and queue_line_id.id or False}]})
             listing_item_id.create_or_update_pricelist_item(float(variant_price))
         if len(shopify_product_dict.get('variants')) != mk_listing_id.item_count:
             mk_id_list = [str(variant_dict.get('id')) for variant_dict in shopify_product_dict.get('variants')]
             mk_listing_id.remove_extra_listing_item(mk_id_list)
+        # Only remember fully imported products, variants which failed this time must be imported again with next update.
+        if mk_listing_id:
+            mk_listing_id.shopify_fingerprint = shopify_fingerprint if len(shopify_variant_list) == mk_listing_id.item_count else False
         return mk_listing_id
 
     def shopify_import_listings(self, mk_instance_id, mk_listing_id=False):
@@ -518,8 +581,8 @@ class MkListing(models.Model):
                 proudct_list.append(shopify.Product().find(product))
             for shopify_product in proudct_list:
                 shopify_product_dict = shopify_product.to_dict()
-                mk_listing_id = self.with_context(mk_log_line_dict=mk_log_line_dict, mk_log_id=mk_log_id).create_update_shopify_product(shopify_product_dict, mk_instance_id,
-                                                                                                                                        update_product_price=True)
+                mk_listing_id = self.with_context(mk_log_line_dict=mk_log_line_dict, mk_log_id=mk_log_id,
+                                                  force_listing_import=True).create_update_shopify_product(shopify_product_dict, mk_instance_id, update_product_price=True)
                 if mk_listing_id and mk_instance_id.is_sync_images:
                     self.sync_product_image_from_shopify(mk_instance_id, mk_listing_id, shopify_product_dict)
             # Comment raise error because if in Shopify product has 5 variant and in odoo one variant is matched and create product if not found is disable then single matched
@@ -530,24 +593,24 @@ class MkListing(models.Model):
             if not mk_log_id.log_line_ids and not self.env.context.get('log_id', False):
                 mk_log_id.unlink()
             return mk_listing_id
+        elif mk_instance_id.is_bulk_import:
+            shopify_product_list = fetch_bulk_products([get_date_filter('updated_at', '>=', mk_instance_id.last_listing_import_date)])
         else:
-            shopify_product_list = self.fetch_all_shopify_products(mk_instance_id)
-
-        if shopify_product_list:
-            batch_size = mk_instance_id.queue_batch_limit or 100
-            for shopify_products in tools.split_every(batch_size, shopify_product_list):
-                queue_id = mk_instance_id.action_create_queue(type='product')
-                for product in shopify_products:
-                    shopify_product_dict = product.to_dict()
-                    name = shopify_product_dict.get('title', '') or ''
-                    line_vals = {
-                        'mk_id': shopify_product_dict.get('id') or '',
-                        'state': 'draft',
-                        'name': name.strip(),
-                        'data_to_process': pprint.pformat(shopify_product_dict),
-                        'mk_instance_id': mk_instance_id.id,
-                    }
-                    queue_id.action_create_queue_lines(line_vals)
+            shopify_product_list = (product.to_dict() for product in itertools.chain.from_iterable(self.fetch_all_shopify_products(mk_instance_id)))
+
+        batch_size = mk_instance_id.queue_batch_limit or 100
+        for shopify_products in tools.split_every(batch_size, shopify_product_list):
+            queue_id = mk_instance_id.action_create_queue(type='product')
+            for shopify_product_dict in shopify_products:
+                name = shopify_product_dict.get('title', '') or ''
+                line_vals = {
+                    'mk_id': shopify_product_dict.get('id') or '',
+                    'state': 'draft',
+                    'name': name.strip(),
+                    'mk_instance_id': mk_instance_id.id,
+                }
+                line_vals.update(self.env['mk.queue.job.line'].prepare_data_to_process_vals(shopify_product_dict, mk_instance_id))
+                queue_id.action_create_queue_lines(line_vals)
         mk_instance_id.last_listing_import_date = fields.Datetime.now()
         return True
 
@@ -570,65 +633,66 @@ class MkListing(models.Model):
                 location_wise_inventory_dict.update({location_mk_id: [inventory_level]})
         return location_wise_inventory_dict
 
-    def create_update_product_quant(self, product_id, location_id, quantity, mk_log_id):
-        quantity = quantity if quantity > 0 else 0
+    def create_update_product_quants(self, product_qty_dict, location_id, mk_log_id):
+        """ Set inventory quantity of all products for one location with one quant search and batched create/write.
+        :param product_qty_dict: dict of product.product record and quantity.
+        :return: stock.quant records.
+        """
         quant_obj = self.env['stock.quant']
-        inventory_quant = quant_obj.search([
-            ('location_id', '=', location_id.id),
-            ('product_id', '=', product_id.id),
-        ])
-        if inventory_quant:
-            inventory_quant.write({
-                'inventory_quantity': quantity,
-            })
-        else:
-            inventory_quant = quant_obj.create({
-                'product_id': product_id.id,
-                'location_id': location_id.id,
-                'inventory_quantity': quantity,
-            })
-            log_message = "IMPORT STOCK: Product {} updated to {} quantity with {} location.".format(product_id.display_name, quantity, location_id.display_name)
-            self.env['mk.log'].create_update_log(mk_log_id=mk_log_id, mk_log_line_dict={'success': [{'log_message': log_message}]})
-        return inventory_quant
+        product_quant_dict = {}
+        for quant in quant_obj.search([('location_id', '=', location_id.id), ('product_id', 'in', [product.id for product in product_qty_dict])]):
+            product_quant_dict.setdefault(quant.product_id.id, []).append(quant.id)
+        qty_wise_quant_dict, quant_vals_list, log_line_list = {}, [], []
+        for product_id, quantity in product_qty_dict.items():
+            quantity = quantity if quantity > 0 else 0
+            inventory_quant_ids = product_quant_dict.get(product_id.id)
+            if inventory_quant_ids:
+                qty_wise_quant_dict.setdefault(quantity, []).extend(inventory_quant_ids)
+            else:
+                quant_vals_list.append({'product_id': product_id.id, 'location_id': location_id.id, 'inventory_quantity': quantity})
+                log_message = "IMPORT STOCK: Product {} updated to {} quantity with {} location.".format(product_id.display_name, quantity, location_id.display_name)
+                log_line_list.append({'log_message': log_message})
+        inventory_quant_ids = []
+        for quantity, quant_ids in qty_wise_quant_dict.items():
+            quant_obj.browse(quant_ids).write({'inventory_quantity': quantity})
+            inventory_quant_ids.extend(quant_ids)
+        for vals_list in tools.split_every(1000, quant_vals_list):
+            inventory_quant_ids.extend(quant_obj.create(list(vals_list)).ids)
+        if log_line_list:
+            self.env['mk.log'].create_update_log(mk_log_id=mk_log_id, mk_log_line_dict={'success': log_line_list})
+        return quant_obj.browse(inventory_quant_ids)
 
     def create_process_inventory_adjustment(self, inventory_level_list, mk_instance_id, shopify_location_id, mk_log_id):
-        product_variant_ids, inventory_line_list = self.env['product.product'], []
+        inventory_item_ids = list(set(str(inventory_level.get('inventory_item_id')) for inventory_level in inventory_level_list))
+        shopify_products = self.env['mk.listing.item'].search(
+            [('product_id.type', '!=', 'service'), ('product_id.tracking', '=', 'none'), ('is_listed', '=', True), ('inventory_item_id', 'in', inventory_item_ids),
+             ('mk_instance_id', '=', mk_instance_id.id)])
+        # First listing item of an inventory item in search order, like the search with limit=1 per level did.
+        inventory_item_product_dict = {}
+        for shopify_product in shopify_products:
+            inventory_item_product_dict.setdefault(shopify_product.inventory_item_id, shopify_product.product_id)
+        # Levels are applied in the order Shopify sends them, so the last level of a product wins when it is linked with multiple inventory items.
+        product_qty_dict = {}
         for inventory_level in inventory_level_list:
-            inventory_item_id = inventory_level.get('inventory_item_id')
-            qty = inventory_level.get('available', 0) or 0
-            shopify_product = self.env['mk.listing.item'].search(
-                [('product_id.type', '!=', 'service'), ('product_id.tracking', '=', 'none'), ('is_listed', '=', True), ('inventory_item_id', '=', inventory_item_id),
-                 ('mk_instance_id', '=', mk_instance_id.id)], limit=1)
-            if shopify_product:
-                odoo_product_id = shopify_product.product_id
-                if not any([line[2].get('product_id') == odoo_product_id.id for line in inventory_line_list]):
-                    product_variant_ids += odoo_product_id
-                    inventory_quant = self.create_update_product_quant(odoo_product_id, shopify_location_id.location_id, qty, mk_log_id)
-                    if mk_instance_id.is_validate_adjustment:
-                        inventory_quant.action_apply_inventory()
-        return inventory_line_list, product_variant_ids
-
-    def fetch_all_shopify_inventory_level(self, mk_instance_id, shopify_loc_mk_ids):
+            odoo_product_id = inventory_item_product_dict.get(str(inventory_level.get('inventory_item_id')))
+            if odoo_product_id:
+                product_qty_dict[odoo_product_id] = inventory_level.get('available', 0) or 0
+        product_variant_ids = self.env['product.product'].browse([product.id for product in product_qty_dict])
+        inventory_quants = self.create_update_product_quants(product_qty_dict, shopify_location_id.location_id, mk_log_id)
+        if inventory_quants and mk_instance_id.is_validate_adjustment:
+            inventory_quants.action_apply_inventory()
+        return [], product_variant_ids
+
+    def fetch_all_shopify_inventory_level(self, mk_instance_id, shopify_loc_mk_ids, is_full_sync=False):
+        """ Yield Shopify inventory levels page by page so only one page is kept in memory.
+        :param is_full_sync: fetch all levels instead of the ones updated since last stock import.
+        """
+        params = {'location_ids': ','.join(shopify_loc_mk_ids)}
+        if mk_instance_id.last_stock_import_date and not is_full_sync:
+            params.update({'updated_at_min': mk_instance_id.last_stock_import_date})
         try:
-            shopify_inventory_level_list, page_info = [], False
-            while 1:
-                if mk_instance_id.last_stock_import_date:
-                    if page_info:
-                        page_wise_inventory_list = shopify.InventoryLevel().find(page_info=page_info)
-                    else:
-                        page_wise_inventory_list = shopify.InventoryLevel().find(updated_at_min=mk_instance_id.last_stock_import_date, location_ids=','.join(shopify_loc_mk_ids))
-                else:
-                    if page_info:
-                        page_wise_inventory_list = shopify.InventoryLevel().find(page_info=page_info)
-                    else:
-                        page_wise_inventory_list = shopify.InventoryLevel().find(location_ids=','.join(shopify_loc_mk_ids))
-                page_url = page_wise_inventory_list.next_page_url
-                parsed = urlparse.parse_qs(page_url)
-                page_info = parsed.get('page_info', False) and parsed.get('page_info', False)[0] or False
-                shopify_inventory_level_list += page_wise_inventory_list
-                if not page_info:
-                    break
-            return shopify_inventory_level_list
+            for page_wise_inventory_list in shopify.PaginatedIterator(shopify.InventoryLevel().find(**params)):
+                yield page_wise_inventory_list
         except Exception as e:
             raise AccessError(e)
 
@@ -655,17 +719,18 @@ class MkListing(models.Model):
                     return False
 
             shopify_loc_mk_ids = location_ids.mapped('shopify_location_id')
-            shopify_inventory_levels = self.fetch_all_shopify_inventory_level(mk_instance_id, shopify_loc_mk_ids)
-            location_wise_inventory_dict = self.prepare_location_wise_inventory_level(shopify_inventory_levels)
-
-            for location_mk_id, inventory_level_list in location_wise_inventory_dict.items():
-                try:
-                    shopify_location_id = self.env['shopify.location.ts'].search([('shopify_location_id', '=', location_mk_id), ('mk_instance_id', '=', mk_instance_id.id)])
-                    self.create_process_inventory_adjustment(inventory_level_list, mk_instance_id, shopify_location_id, mk_log_id)
-                except Exception as e:
-                    log_message = "IMPORT STOCK: Error while Import Stock. ERROR: {}".format(e)
-                    self.env['mk.log'].create_update_log(mk_log_id=mk_log_id, mk_log_line_dict={'success': [{'log_message': log_message}]})
-                    return False
+            shopify_location_dict = {str(location_id.shopify_location_id): location_id for location_id in location_ids}
+            # Every page is applied as soon as it is fetched, so only one page of inventory levels is kept in memory.
+            for page_wise_inventory_list in self.fetch_all_shopify_inventory_level(mk_instance_id, shopify_loc_mk_ids):
+                location_wise_inventory_dict = self.prepare_location_wise_inventory_level(page_wise_inventory_list)
+                for location_mk_id, inventory_level_list in location_wise_inventory_dict.items():
+                    try:
+                        shopify_location_id = shopify_location_dict.get(str(location_mk_id), self.env['shopify.location.ts'])
+                        self.create_process_inventory_adjustment(inventory_level_list, mk_instance_id, shopify_location_id, mk_log_id)
+                    except Exception as e:
+                        log_message = "IMPORT STOCK: Error while Import Stock. ERROR: {}".format(e)
+                        self.env['mk.log'].create_update_log(mk_log_id=mk_log_id, mk_log_line_dict={'success': [{'log_message': log_message}]})
+                        return False
             if not mk_log_id.log_line_ids and not self.env.context.get('log_id', False):
                 mk_log_id.unlink()
             mk_instance_id.last_stock_import_date = fields.Datetime.now()
@@ -845,11 +910,7 @@ class MkListing(models.Model):
         try:
             shopify_product = shopify.Product().find(self.mk_id)
         except Exception as e:
-            if e.code == 429:
-                time.sleep(3)
-                shopify_product = shopify.Product().find(self.mk_id)
-            else:
-                raise AccessError(_("Error while trying to find Shopify Template {} ERROR:{}".format(self.mk_id, e)))
+            raise AccessError(_("Error while trying to find Shopify Template {} ERROR:{}".format(self.mk_id, e)))
 
         if operation_wizard.is_set_quantity:
             self.update_location_wise_qty_in_shopify()
@@ -880,25 +941,23 @@ class MkListing(models.Model):
         self.ensure_one()
         location_ids = self.env['shopify.location.ts'].search([('mk_instance_id', '=', self.mk_instance_id.id)])
         for shopify_location_id in location_ids:
-            location_id = shopify_location_id.location_id or False
-            if not location_id:
+            if not shopify_location_id.location_id:
                 raise UserError(
                     _("Please set Warehouse and Location in the Shopify Location {}. Marketplaces > Shopify > Configuration > Locations ".format(shopify_location_id.name)))
+        stock_dict = self.listing_item_ids.get_listing_item_stock(location_ids.mapped('location_id'), self.mk_instance_id.stock_field_id.name)
+        for shopify_location_id in location_ids:
+            location_id = shopify_location_id.location_id
             for shopify_variant_id in self.listing_item_ids:
                 if shopify_variant_id.product_id.type == 'product' and not shopify_variant_id.inventory_item_id:
                     continue
                 if shopify_variant_id.inventory_management == 'dont_track':
                     continue
-                variant_quantity = shopify_variant_id.product_id.get_product_stock(shopify_variant_id.export_qty_type, shopify_variant_id.export_qty_value, location_id,
-                                                                                   self.mk_instance_id.stock_field_id.name)
+                variant_quantity = stock_dict.get((shopify_variant_id.id, location_id.id), 0)
                 try:
                     shopify.InventoryLevel.set(shopify_location_id.shopify_location_id, shopify_variant_id.inventory_item_id, int(variant_quantity))
                 except Exception as e:
-                    if e.code == 429:
-                        time.sleep(3)
-                        shopify.InventoryLevel.set(shopify_location_id.shopify_location_id, shopify_variant_id.inventory_item_id, int(variant_quantity))
-                    else:
-                        raise AccessError(_("Error while trying to export stock for Shopify Product Variant: {}, ERROR: {}.".format(shopify_variant_id.name, e)))
+                    raise AccessError(_("Error while trying to export stock for Shopify Product Variant: {}, ERROR: {}.".format(shopify_variant_id.name, e)))
+                self.env['shopify.stock.ledger.ts'].update_exported_quantity(shopify_location_id, [(shopify_variant_id, int(variant_quantity))])
 
     def cron_auto_export_stock(self, mk_instance_id):
         mk_instance_id = self.env['mk.instance'].browse(mk_instance_id)
@@ -908,15 +967,45 @@ class MkListing(models.Model):
     def get_shopify_listing_items(self, mk_instance_id, product_ids):
         return self.env['mk.listing.item'].search([('product_id', 'in', product_ids.ids), ('mk_instance_id', '=', mk_instance_id.id)])
 
+    def get_bom_signature(self):
+        """ Count and last write date of BoMs, BoM lines and variants of kit templates. Changes whenever a BoM is created, updated or deleted,
+        or a variant of a template level kit BoM is created, archived or deleted, as the index expands those BoMs to their active variants.
+        """
+        self._cr.execute("""
+            SELECT (SELECT count(*) FROM mrp_bom), (SELECT max(write_date) FROM mrp_bom),
+                   (SELECT count(*) FROM mrp_bom_line), (SELECT max(write_date) FROM mrp_bom_line),
+                   pp.variant_count, pp.variant_write_date
+              FROM (SELECT count(*) AS variant_count, max(write_date) AS variant_write_date
+                      FROM product_product
+                     WHERE active AND product_tmpl_id IN (SELECT product_tmpl_id FROM mrp_bom WHERE type = 'phantom' AND product_id IS NULL)) pp
+        """)
+        return self._cr.fetchone()
+
+    @tools.ormcache('bom_signature')
+    def get_kit_component_index(self, bom_signature):
+        """ Reverse index of active kit (phantom) BoMs, cached until the BoM signature changes.
+        :return: dict of component product id and tuple of kit product ids.
+        """
+        self._cr.execute("""
+            SELECT bl.product_id, COALESCE(b.product_id, pp.id)
+              FROM mrp_bom_line bl
+              JOIN mrp_bom b ON b.id = bl.bom_id
+         LEFT JOIN product_product pp ON b.product_id IS NULL AND pp.product_tmpl_id = b.product_tmpl_id AND pp.active
+             WHERE b.type = 'phantom' AND b.active
+        """)
+        kit_component_dict = {}
+        for component_product_id, kit_product_id in self._cr.fetchall():
+            if kit_product_id:
+                kit_component_dict.setdefault(component_product_id, set()).add(kit_product_id)
+        return {component_product_id: tuple(kit_product_ids) for component_product_id, kit_product_ids in kit_component_dict.items()}
+
     def get_listing_item_for_stock_export_shopify(self, mk_instance_id, listing_item_ids):
-        mrp = self.env['ir.module.module'].search([('name', '=', 'mrp'), ('state', '=', 'installed')])
-        if mrp:
-            for listing_item_id in listing_item_ids:
-                bom_ids = self.env['mrp.bom'].search([('bom_line_ids.product_id', '=', listing_item_id.product_id.id), ('type', '=', 'phantom')])
-                for bom_id in bom_ids:
-                    product_ids = bom_id.product_id if bom_id.product_id else bom_id.product_tmpl_id.product_variant_ids
-                    if product_ids:
-                        listing_item_ids += self.get_shopify_listing_items(mk_instance_id, product_ids)
+        if 'mrp.bom' not in self.env:
+            return listing_item_ids
+        kit_component_dict = self.get_kit_component_index(self.get_bom_signature())
+        kit_product_ids = {kit_product_id for product_id in listing_item_ids.mapped('product_id').ids for kit_product_id in kit_component_dict.get(product_id, ())}
+        if kit_product_ids:
+            listing_item_ids |= self.get_shopify_listing_items(mk_instance_id, self.env['product.product'].browse(kit_product_ids))
         return listing_item_ids
 
     def update_stock_in_shopify_ts(self, mk_instance_ids):
@@ -932,9 +1021,23 @@ class MkListing(models.Model):
                 mk_log_line_dict['error'].append({'log_message': 'UPDATE STOCK: {}'.format(log_message)})
                 return False
             mk_instance_id.connection_to_shopify()
-            result = self.get_mk_listing_item(mk_instance_id)
-            listing_item_ids = self.env['mk.listing.item'].browse(result)
-            new_listing_item_ids = self.get_listing_item_for_stock_export_shopify(mk_instance_id, listing_item_ids)
+            stock_ledger_obj = self.env['shopify.stock.ledger.ts']
+            is_reconcile = stock_ledger_obj.is_stock_reconcile_due(mk_instance_id)
+            if is_reconcile:
+                # Full reconciliation, compare every listed item against what Shopify really has.
+                try:
+                    stock_ledger_obj.reconcile_shopify_stock_ledger(mk_instance_id, location_ids)
+                except Exception as e:
+                    log_message = "Error while reconciling stock with Shopify, only changed stock is exported. ERROR: {}.".format(e)
+                    mk_log_line_dict['error'].append({'log_message': 'UPDATE STOCK: {}'.format(log_message)})
+                    is_reconcile = False
+            if is_reconcile:
+                new_listing_item_ids = self.env['mk.listing.item'].search([('mk_instance_id', '=', mk_instance_id.id), ('is_listed', '=', True)])
+            else:
+                result = self.get_mk_listing_item(mk_instance_id)
+                listing_item_ids = self.env['mk.listing.item'].browse(result)
+                new_listing_item_ids = self.get_listing_item_for_stock_export_shopify(mk_instance_id, listing_item_ids)
+            stock_dict = new_listing_item_ids.get_listing_item_stock(location_ids.mapped('location_id'), mk_instance_id.stock_field_id.name)
 
             for shopify_location_id in location_ids:
                 location_id = shopify_location_id.location_id or False
@@ -942,31 +1045,93 @@ class MkListing(models.Model):
                     log_message = "Warehouse is not set for Shopify Location {}".format(shopify_location_id.name)
                     mk_log_line_dict['error'].append({'log_message': 'UPDATE STOCK: {}'.format(log_message)})
                     continue
+                stock_item_list, exported_item_list = [], []
+                exported_qty_dict = stock_ledger_obj.get_exported_quantity_dict(shopify_location_id, new_listing_item_ids)
                 for shopify_variant_id in new_listing_item_ids:
                     if shopify_variant_id.product_id.type == 'product' and not shopify_variant_id.inventory_item_id:
                         log_message = "Inventory Item ID not found for Product Variant: {} while export stock.".format(shopify_variant_id.name)
                         mk_log_line_dict['error'].append({'log_message': 'UPDATE STOCK: {}'.format(log_message)})
                         continue
-                    variant_quantity = shopify_variant_id.product_id.get_product_stock(shopify_variant_id.export_qty_type, shopify_variant_id.export_qty_value, location_id,
-                                                                                       mk_instance_id.stock_field_id.name)
+                    variant_quantity = int(stock_dict.get((shopify_variant_id.id, location_id.id), 0))
+                    # Shopify already has this quantity, nothing to export.
+                    if exported_qty_dict.get(shopify_variant_id.id) == variant_quantity:
+                        continue
+                    if mk_instance_id.is_batch_stock_export:
+                        stock_item_list.append((shopify_variant_id, variant_quantity))
+                        continue
                     try:
-                        shopify.InventoryLevel.set(shopify_location_id.shopify_location_id, shopify_variant_id.inventory_item_id, int(variant_quantity))
+                        shopify.InventoryLevel.set(shopify_location_id.shopify_location_id, shopify_variant_id.inventory_item_id, variant_quantity)
                     except Exception as e:
-                        if e.code == 429:
-                            time.sleep(3)
-                            shopify.InventoryLevel.set(shopify_location_id.shopify_location_id, shopify_variant_id.inventory_item_id, int(variant_quantity))
-                        else:
-                            log_message = "Error while trying to export stock for Shopify Product Variant: {}, ERROR: {}.".format(shopify_variant_id.name, e)
-                            mk_log_line_dict['error'].append({'log_message': 'UPDATE STOCK: {}'.format(log_message)})
-                            continue
+                        log_message = "Error while trying to export stock for Shopify Product Variant: {}, ERROR: {}.".format(shopify_variant_id.name, e)
+                        mk_log_line_dict['error'].append({'log_message': 'UPDATE STOCK: {}'.format(log_message)})
+                        continue
+                    exported_item_list.append((shopify_variant_id, variant_quantity))
                     log_message = "Successfully Updated {} stock of {} Listing in Shopify.".format(variant_quantity, shopify_variant_id.name)
                     mk_log_line_dict['success'].append({'log_message': 'UPDATE STOCK: {}'.format(log_message)})
+                if stock_item_list:
+                    exported_item_list += self.batch_update_stock_in_shopify_ts(shopify_location_id, stock_item_list, mk_log_line_dict)
+                stock_ledger_obj.update_exported_quantity(shopify_location_id, exported_item_list)
             mk_instance_id.last_stock_update_date = fields.Datetime.now()
             self.env['mk.log'].create_update_log(mk_instance_id=mk_instance_id, mk_log_id=mk_log_id, mk_log_line_dict=mk_log_line_dict)
             if not mk_log_id.log_line_ids:
                 mk_log_id.unlink()
         return True
 
+    def batch_update_stock_in_shopify_ts(self, shopify_location_id, stock_item_list, mk_log_line_dict):
+        """ Set on hand quantities of one Shopify location with GraphQL mutations of up to 250 items.
+        :param shopify_location_id: shopify.location.ts record.
+        :param stock_item_list: list of tuple (listing item, quantity).
+        :param mk_log_line_dict: log dict where per item results are appended.
+        :return: list of tuple (listing item, quantity) successfully exported.
+        """
+        graphql = shopify.GraphQL(version=INVENTORY_GRAPHQL_API_VERSION)
+        location_gid = 'gid://shopify/Location/{}'.format(shopify_location_id.shopify_location_id)
+        pending_item_list, exported_item_list = list(stock_item_list), []
+        while pending_item_list:
+            batch_item_list = pending_item_list[:INVENTORY_SET_QUANTITIES_LIMIT]
+            pending_item_list = pending_item_list[INVENTORY_SET_QUANTITIES_LIMIT:]
+            set_quantities = [{'inventoryItemId': 'gid://shopify/InventoryItem/{}'.format(shopify_variant_id.inventory_item_id),
+                               'locationId': location_gid,
+                               'quantity': quantity} for shopify_variant_id, quantity in batch_item_list]
+            try:
+                result = json.loads(graphql.execute(INVENTORY_SET_ON_HAND_QUANTITIES, {'input': {'reason': 'correction', 'setQuantities': set_quantities}}))
+                if result.get('errors'):
+                    raise UserError(', '.join(error.get('message', '') for error in result['errors']))
+            except Exception as e:
+                for shopify_variant_id, quantity in batch_item_list:
+                    log_message = "Error while trying to export stock for Shopify Product Variant: {}, ERROR: {}.".format(shopify_variant_id.name, e)
+                    mk_log_line_dict['error'].append({'log_message': 'UPDATE STOCK: {}'.format(log_message)})
+                continue
+            user_errors = result.get('data', {}).get('inventorySetOnHandQuantities', {}).get('userErrors', [])
+            item_error_dict, batch_errors = {}, []
+            for user_error in user_errors:
+                # field is the path of the invalid input, e.g. ['input', 'setQuantities', '3', 'quantity'].
+                error_field = user_error.get('field') or []
+                if len(error_field) > 2 and error_field[1] == 'setQuantities' and str(error_field[2]).isdigit():
+                    item_error_dict.setdefault(int(error_field[2]), []).append(user_error.get('message'))
+                else:
+                    batch_errors.append(user_error.get('message'))
+            # An index outside of the batch matches no item, it fails the batch so the items are not sent again unchanged forever.
+            for index in [index for index in item_error_dict if index >= len(batch_item_list)]:
+                batch_errors += item_error_dict.pop(index)
+            if not user_errors:
+                exported_item_list += batch_item_list
+                for shopify_variant_id, quantity in batch_item_list:
+                    log_message = "Successfully Updated {} stock of {} Listing in Shopify.".format(quantity, shopify_variant_id.name)
+                    mk_log_line_dict['success'].append({'log_message': 'UPDATE STOCK: {}'.format(log_message)})
+                continue
+            # The mutation is rejected as a whole, so items without an error of their own are sent again in the next batch.
+            retry_item_list = []
+            for index, (shopify_variant_id, quantity) in enumerate(batch_item_list):
+                if index in item_error_dict or batch_errors:
+                    log_message = "Error while trying to export stock for Shopify Product Variant: {}, ERROR: {}.".format(shopify_variant_id.name,
+                                                                                                                        ', '.join(item_error_dict.get(index, batch_errors)))
+                    mk_log_line_dict['error'].append({'log_message': 'UPDATE STOCK: {}'.format(log_message)})
+                else:
+                    retry_item_list.append((shopify_variant_id, quantity))
+            pending_item_list = retry_item_list + pending_item_list
+        return exported_item_list
+
     def cron_auto_import_stock(self, mk_instance_id):
         mk_instance_id = self.env['mk.instance'].browse(mk_instance_id)
         self.shopify_import_stock(mk_instance_id)
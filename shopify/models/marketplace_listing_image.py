@@ -8,3 +8,4 @@ class ListingImage(models.Model):
     _inherit = 'mk.listing.image'
 
     shopify_alt_text = fields.Char("alt text")
+    shopify_updated_at = fields.Char("Shopify Updated At", copy=False, help="Technical field to skip download of images not changed in Shopify.")
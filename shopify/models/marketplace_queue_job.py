@@ -1,17 +1,16 @@
-import pprint
 from .. import shopify
 from odoo import models, fields, _
-from odoo.tools.safe_eval import safe_eval
 
 
 class MkQueueJob(models.Model):
     _inherit = "mk.queue.job"
 
     def shopify_customer_queue_process(self):
-        res_partner_obj, mk_instance_id = self.env['res.partner'], self.mk_instance_id
+        res_partner_obj, mk_instance_id = self.env['res.partner'].with_context(partner_match_cache={}, partner_import_cache={}), self.mk_instance_id
         draft_queue_line_ids = self.mk_queue_line_ids.filtered(lambda x: x.state == 'draft')
-        for line in draft_queue_line_ids:
-            customer_dict = safe_eval(line.data_to_process)
+        queue_customer_list = [(line, line.get_data_to_process()) for line in draft_queue_line_ids]
+        res_partner_obj.shopify_prefetch_partners([(customer_dict, 'contact') for line, customer_dict in queue_customer_list], mk_instance_id)
+        for line, customer_dict in queue_customer_list:
             res_partner_obj.with_context(queue_line_id=line, mk_log_id=line.queue_id.mk_log_id).create_update_shopify_customers(customer_dict, self.mk_instance_id)
             line.write({'processed_date': fields.Datetime.now()})
         return True
@@ -22,8 +21,17 @@ class MkQueueJob(models.Model):
         draft_queue_line_ids = self.mk_queue_line_ids.filtered(lambda x: x.state == 'draft')
         if not skip_api_call:
             shopify_location_obj.import_location_from_shopify(mk_instance_id)
-        for line in draft_queue_line_ids:
-            shopify_order_dict = safe_eval(line.data_to_process)
+        # Lookups (listing items, partners, currency, taxes, carriers, gateways, workflows) are shared by all orders of this queue.
+        sale_order_obj = sale_order_obj.with_context(order_import_cache={}, partner_match_cache={}, partner_import_cache={})
+        queue_order_list = [(line, line.get_data_to_process()) for line in draft_queue_line_ids]
+        variant_ids = [line_item.get('variant_id') for line, shopify_order_dict in queue_order_list for line_item in shopify_order_dict.get('line_items', [])]
+        sale_order_obj.preload_mk_listing_items(variant_ids, mk_instance_id)
+        customer_dict_list = []
+        for line, shopify_order_dict in queue_order_list:
+            customer_dict_list += [(shopify_order_dict.get('customer'), 'contact'), (shopify_order_dict.get('billing_address'), 'invoice'),
+                                   (shopify_order_dict.get('shipping_address'), 'delivery')]
+        sale_order_obj.env['res.partner'].shopify_prefetch_partners(customer_dict_list, mk_instance_id)
+        for line, shopify_order_dict in queue_order_list:
             order_id = sale_order_obj.with_context(queue_line_id=line, skip_queue_change_state=True, mk_log_id=line.queue_id.mk_log_id).process_import_order_from_shopify_ts(
                 shopify_order_dict, mk_instance_id)
             if order_id:
@@ -51,9 +59,21 @@ class MkQueueJob(models.Model):
     def shopify_product_queue_process(self):
         mk_instance_id, queue_job_line_obj = self.mk_instance_id, self.env['mk.queue.job.line']
         draft_queue_line_ids = self.mk_queue_line_ids.filtered(lambda x: x.state == 'draft')
-        for line in draft_queue_line_ids:
-            shopify_product_dict = safe_eval(line.data_to_process)
-            mk_listing_id = self.with_context(queue_line_id=line, mk_log_id=line.queue_id.mk_log_id).do_import_listing_process(shopify_product_dict, mk_instance_id)
+        # Listing items and Odoo products matching variants of all listings of this queue are resolved upfront and shared through the listing import cache.
+        queue_job = self.with_context(listing_import_cache={})
+        listing_obj = queue_job.env['mk.listing']
+        queue_product_list = [(line, line.get_data_to_process()) for line in draft_queue_line_ids]
+        listing_obj.preload_odoo_product_variant_and_listing_item(mk_instance_id, [variant_dict for line, shopify_product_dict in queue_product_list
+                                                                                   for variant_dict in shopify_product_dict.get('variants', [])])
+        attribute_dict = queue_job.env['product.attribute'].get_mk_attributes([option_dict.get('name') for line, shopify_product_dict in queue_product_list
+                                                                              for option_dict in shopify_product_dict.get('options', [])], create=False)
+        queue_job.env['product.attribute.value'].get_mk_attribute_values([(attribute_dict.get((option_dict.get('name') or '').lower()), value)
+                                                                          for line, shopify_product_dict in queue_product_list for option_dict in shopify_product_dict.get('options', [])
+                                                                          for value in option_dict.get('values', [])], create=False)
+        queue_job.env['shopify.tags.ts'].get_shopify_tag_dict([shopify_product_dict.get('tags') for line, shopify_product_dict in queue_product_list])
+        for line, shopify_product_dict in queue_product_list:
+            mk_listing_id = queue_job.with_context(queue_line_id=line, mk_log_id=line.queue_id.mk_log_id).do_import_listing_process(shopify_product_dict, mk_instance_id)
+            listing_obj.evict_listing_import_cache(shopify_product_dict.get('variants', []))
             line.write({'processed_date': fields.Datetime.now(), 'state': 'processed' if mk_listing_id else 'failed', 'mk_listing_id': mk_listing_id and mk_listing_id.id or False})
             self._cr.commit()
         if not self.env.context.get('hide_notification', False):
@@ -87,7 +107,7 @@ class MkQueueJobLine(models.Model):
         for line in self.filtered(lambda x: x.mk_id):
             shopify_product = shopify.Product.find(line.mk_id)
             shopify_product_dict = shopify_product.to_dict()
-            line.write({'state': 'draft', 'data_to_process': pprint.pformat(shopify_product_dict)})
+            line.write(dict(line.prepare_data_to_process_vals(shopify_product_dict, line.mk_instance_id), state='draft'))
             line.queue_id.with_context(hide_notification=True).shopify_product_queue_process()
         return True
 
@@ -98,7 +118,7 @@ class MkQueueJobLine(models.Model):
             shopify_order = shopify.Order.find(line.mk_id)
             self.env['sale.order'].fetch_order_transaction_from_shopify(shopify_order)  # Fetch payment transactions from Shopify and set in order dict.
             shopify_order_dict = shopify_order.to_dict()
-            line.write({'state': 'draft', 'data_to_process': pprint.pformat(shopify_order_dict)})
+            line.write(dict(line.prepare_data_to_process_vals(shopify_order_dict, line.mk_instance_id), state='draft'))
             line.queue_id.with_context(hide_notification=True).shopify_order_queue_process(skip_api_call=True)
         return True
 
@@ -108,6 +128,6 @@ class MkQueueJobLine(models.Model):
         for line in self.filtered(lambda x: x.mk_id):
             shopify_customer = shopify.Customer.find(line.mk_id)
             shopify_customer_dict = shopify_customer.to_dict()
-            line.write({'state': 'draft', 'data_to_process': pprint.pformat(shopify_customer_dict)})
+            line.write(dict(line.prepare_data_to_process_vals(shopify_customer_dict, line.mk_instance_id), state='draft'))
             line.queue_id.with_context(hide_notification=True).shopify_customer_queue_process()
         return True
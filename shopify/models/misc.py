@@ -1,5 +1,18 @@
+import base64
+import logging
 import dateutil
+import requests
+import threading
 from pytz import timezone
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+
+_logger = logging.getLogger("Teqstars:Shopify")
+
+IMAGE_DOWNLOAD_WORKERS = 8
+IMAGE_DOWNLOAD_TIMEOUT = (5, 30)
+
+_image_session = threading.local()
 
 
 def convert_shopify_datetime_to_utc(datetime):
@@ -8,3 +21,35 @@ def convert_shopify_datetime_to_utc(datetime):
         datetime = dateutil.parser.parse(datetime)
         converted_datetime = datetime.astimezone(timezone('UTC')).strftime('%Y-%m-%d %H:%M:%S')
     return converted_datetime or False
+
+
+def _get_image_session():
+    session = getattr(_image_session, 'session', None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=IMAGE_DOWNLOAD_WORKERS, pool_maxsize=IMAGE_DOWNLOAD_WORKERS, max_retries=2)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        _image_session.session = session
+    return session
+
+
+def _download_image(image_url):
+    try:
+        response = _get_image_session().get(image_url, timeout=IMAGE_DOWNLOAD_TIMEOUT)
+        response.raise_for_status()
+        return base64.b64encode(response.content)
+    except requests.RequestException as e:
+        _logger.warning("Unable to download image {}. ERROR: {}".format(image_url, e))
+        return False
+
+
+def download_images(image_url_list):
+    """ Download images concurrently, connections are kept alive per worker thread.
+    :return: dict of image url and base64 encoded image, False if download failed.
+    """
+    image_url_list = list(dict.fromkeys(image_url_list))
+    if not image_url_list:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(IMAGE_DOWNLOAD_WORKERS, len(image_url_list))) as executor:
+        return dict(zip(image_url_list, executor.map(_download_image, image_url_list)))
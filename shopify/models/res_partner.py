@@ -1,8 +1,8 @@
-import pprint
+import itertools
 from .. import shopify
-import urllib.parse as urlparse
 from odoo import fields, models, tools
 from odoo.exceptions import AccessError
+from .bulk_operation import fetch_bulk_customers, get_date_filter
 
 
 class Partner(models.Model):
@@ -11,30 +11,16 @@ class Partner(models.Model):
     shopify_customer_id = fields.Char("Shopify Customer ID", copy=False)
 
     def fetch_all_shopify_customers(self, instance_id):
+        """ Yield Shopify customers page by page so only one page is kept in memory. """
+        params = {'limit': instance_id.api_limit or 250}
+        if instance_id.last_customer_import_date:
+            params.update({'updated_at_min': instance_id.last_customer_import_date})
         try:
-            shopify_customer_list, api_limit = [], instance_id.api_limit or 250
-            page_info = False
-            while 1:
-                if instance_id.last_customer_import_date:
-                    if page_info:
-                        page_wise_customer_list = shopify.Customer().find(limit=api_limit, page_info=page_info)
-                    else:
-                        page_wise_customer_list = shopify.Customer().find(updated_at_min=instance_id.last_customer_import_date, limit=api_limit)
-                else:
-                    if page_info:
-                        page_wise_customer_list = shopify.Customer().find(limit=api_limit, page_info=page_info)
-                    else:
-                        page_wise_customer_list = shopify.Customer().find(limit=api_limit)
-                page_url = page_wise_customer_list.next_page_url
-                parsed = urlparse.parse_qs(page_url)
-                page_info = parsed.get('page_info', False) and parsed.get('page_info', False)[0] or False
-                shopify_customer_list = page_wise_customer_list + shopify_customer_list
-                if not page_info:
-                    break
-            instance_id.last_customer_import_date = fields.Datetime.now()
-            return shopify_customer_list
+            for page_wise_customer_list in shopify.PaginatedIterator(shopify.Customer().find(**params)):
+                yield page_wise_customer_list
         except Exception as e:
             raise AccessError(e)
+        instance_id.last_customer_import_date = fields.Datetime.now()
 
     def shopify_get_find_partner_where_clause(self, type):
         if type in ['invoice', 'delivery']:
@@ -43,6 +29,47 @@ class Partner(models.Model):
             where_caluse = ['name', 'state_id', 'city', 'zip', 'street', 'street2', 'country_id', 'email']
         return where_caluse
 
+    def _get_country_state_cache(self):
+        """ Countries and states loaded once per batch, the batch sets an empty dict in context key partner_import_cache. """
+        partner_import_cache = self.env.context.get('partner_import_cache')
+        if partner_import_cache is None:
+            return False
+        if 'country' not in partner_import_cache:
+            country_dict, state_dict = {}, {}
+            for country in self.env['res.country'].search_read([], ['code', 'name']):
+                country_dict.setdefault(('code', country['code']), country['id'])
+                country_dict.setdefault(('name', country['name']), country['id'])
+            for state in self.env['res.country.state'].search_read([], ['country_id', 'code', 'name']):
+                state_dict.setdefault((state['country_id'][0], 'code', state['code']), state['id'])
+                state_dict.setdefault((state['country_id'][0], 'name', state['name']), state['id'])
+            partner_import_cache.update({'country': country_dict, 'state': state_dict})
+        return partner_import_cache
+
+    def get_shopify_country_state(self, address_dict):
+        country_obj, state_obj = self.env['res.country'], self.env['res.country.state']
+        country_code, country_name = address_dict.get('country_code'), address_dict.get('country_name')
+        province_code, province = address_dict.get('province_code'), address_dict.get('province')
+        partner_import_cache = self._get_country_state_cache()
+        if partner_import_cache:
+            country_dict, state_dict = partner_import_cache['country'], partner_import_cache['state']
+            country = country_obj.browse(country_dict.get(('code', country_code)) or country_dict.get(('name', country_name)))
+            state = state_obj.browse(state_dict.get((country.id, 'code', province_code)) or state_dict.get((country.id, 'name', province)))
+        else:
+            country = country_obj.search(['|', ('code', '=', country_code), ('name', '=', country_name)], limit=1)
+            state = state_obj.search([('country_id', '=', country.id), '|', ('code', '=', province_code), ('name', '=', province)], limit=1)
+        if not state and province and province_code:
+            state = state_obj.with_context(tracking_disable=True).create({'country_id': country.id, 'name': province, 'code': province_code})
+            if partner_import_cache:
+                partner_import_cache['state'].update({(country.id, 'code', province_code): state.id, (country.id, 'name', province): state.id})
+        return country, state
+
+    def shopify_prefetch_partners(self, customer_dict_list, mk_instance_id):
+        """ Match all partners of a queue batch in one query.
+        :param customer_dict_list: list of tuple (Shopify customer or address dict, partner type)
+        """
+        partner_vals_list = [self._extract_customer_data_from_shopify_dict(customer_dict, mk_instance_id, type=type) for customer_dict, type in customer_dict_list if customer_dict]
+        return self.prefetch_marketplace_partners(partner_vals_list)
+
     def _extract_customer_data_from_shopify_dict(self, customer_dict, mk_instance_id, type='contact'):
         default_address_dict = customer_dict.get('default_address') if customer_dict.get('default_address', False) else customer_dict
         name = default_address_dict.get('name', False)
@@ -55,12 +82,7 @@ class Partner(models.Model):
                 name = "{} {}".format(customer_dict.get('first_name', ''), customer_dict.get('last_name', ''))
             else:
                 name = default_address_dict.get('email') or customer_dict.get('email') or "Untitled"
-        country = self.env['res.country'].search(['|', ('code', '=', default_address_dict.get('country_code')), ('name', '=', default_address_dict.get('country_name'))], limit=1)
-        state = self.env['res.country.state'].search(
-            [('country_id', '=', country.id), '|', ('code', '=', default_address_dict.get('province_code')), ('name', '=', default_address_dict.get('province'))], limit=1)
-        if not state and default_address_dict.get('province') and default_address_dict.get('province_code'):
-            state = self.env['res.country.state'].with_context(tracking_disable=True).create(
-                {'country_id': country.id, 'name': default_address_dict.get('province'), 'code': default_address_dict.get('province_code')})
+        country, state = self.get_shopify_country_state(default_address_dict)
         partner_vals = {
             'name': name,
             'email': default_address_dict.get('email') or customer_dict.get('email'),
@@ -92,22 +114,29 @@ class Partner(models.Model):
             queue_line_id and queue_line_id.write({'state': 'failed'})
         return partner
 
+    def fetch_bulk_shopify_customers(self, instance_id):
+        """ Yield Shopify customers in REST format from a GraphQL Bulk Operation. """
+        for customer_dict in fetch_bulk_customers([get_date_filter('updated_at', '>=', instance_id.last_customer_import_date)]):
+            yield customer_dict
+        instance_id.last_customer_import_date = fields.Datetime.now()
+
     def shopify_import_customers(self, instance_id):
         instance_id.connection_to_shopify()
-        shopify_customer_list = self.fetch_all_shopify_customers(instance_id)
-        if shopify_customer_list:
-            batch_size = instance_id.queue_batch_limit or 100
-            for shopify_customers in tools.split_every(batch_size, shopify_customer_list):
-                queue_id = instance_id.action_create_queue(type='customer')
-                for customer in shopify_customers:
-                    customer_dict = customer.to_dict()
-                    name = "%s %s" % (customer_dict.get('first_name') or '', customer_dict.get('last_name') or '')
-                    line_vals = {
-                        'mk_id': customer_dict.get('id') or '',
-                        'state': 'draft',
-                        'name': name.strip(),
-                        'data_to_process': pprint.pformat(customer_dict),
-                        'mk_instance_id': instance_id.id,
-                    }
-                    queue_id.action_create_queue_lines(line_vals)
+        if instance_id.is_bulk_import:
+            shopify_customer_list = self.fetch_bulk_shopify_customers(instance_id)
+        else:
+            shopify_customer_list = (customer.to_dict() for customer in itertools.chain.from_iterable(self.fetch_all_shopify_customers(instance_id)))
+        batch_size = instance_id.queue_batch_limit or 100
+        for shopify_customers in tools.split_every(batch_size, shopify_customer_list):
+            queue_id = instance_id.action_create_queue(type='customer')
+            for customer_dict in shopify_customers:
+                name = "%s %s" % (customer_dict.get('first_name') or '', customer_dict.get('last_name') or '')
+                line_vals = {
+                    'mk_id': customer_dict.get('id') or '',
+                    'state': 'draft',
+                    'name': name.strip(),
+                    'mk_instance_id': instance_id.id,
+                }
+                line_vals.update(self.env['mk.queue.job.line'].prepare_data_to_process_vals(customer_dict, instance_id))
+                queue_id.action_create_queue_lines(line_vals)
         return True
@@ -1,12 +1,12 @@
-import time
 import pytz
-import pprint
 import logging
+import itertools
 from .. import shopify
 from datetime import timedelta
-import urllib.parse as urlparse
+from concurrent.futures import ThreadPoolExecutor
 from odoo import models, fields, tools, api, _
 from .misc import convert_shopify_datetime_to_utc
+from .bulk_operation import fetch_bulk_orders, get_date_filter
 
 _logger = logging.getLogger("Teqstars:Shopify")
 
@@ -29,6 +29,10 @@ SOURCE_NAME = [('web', 'Online Store'),
                ('iphone', 'iPhone'),
                ('android', 'Android')]
 
+# Shopify returns maximum 250 orders per request.
+ORDER_FIND_BATCH_SIZE = 250
+TRANSACTION_FETCH_WORKERS = 4
+
 
 class SaleOrder(models.Model):
     _inherit = 'sale.order'
@@ -56,12 +60,10 @@ class SaleOrder(models.Model):
     shopify_order_source_name = fields.Char("Shopify Order Source", copy=False, help="Know source of Order creation.")
 
     def fetch_orders_from_shopify(self, from_date, to_date, shopify_fulfillment_status_ids, limit=250, mk_order_id=False):
-        shopify_order_list, page_info = [], False
+        """ Yield Shopify orders page by page so only one page is kept in memory. """
         if mk_order_id:
-            order_list = []
-            for order in ''.join(mk_order_id.split()).split(','):
-                order_list.append(shopify.Order().find(order))
-            return order_list
+            yield [shopify.Order().find(order) for order in ''.join(mk_order_id.split()).split(',')]
+            return
         utc_timezone = pytz.timezone("UTC")
         to_date = utc_timezone.localize(to_date)
         from_date = utc_timezone.localize(from_date)
@@ -69,29 +71,26 @@ class SaleOrder(models.Model):
             shopify_fulfillment_status_ids = self.env.ref('shopify.shopify_order_status_any')
         from_import_screen = self.env.context.get('from_import_screen', False)
         for shopify_fulfillment_status_id in shopify_fulfillment_status_ids:
-            while 1:
-                if page_info:
-                    page_wise_order_list = shopify.Order().find(limit=limit, page_info=page_info)
-                else:
-                    if from_import_screen:
-                        page_wise_order_list = shopify.Order().find(status='any', fulfillment_status=shopify_fulfillment_status_id.status, created_at_min=from_date,
-                                                                    created_at_max=to_date, limit=limit)
-                    else:
-                        page_wise_order_list = shopify.Order().find(status='any', fulfillment_status=shopify_fulfillment_status_id.status, updated_at_min=from_date,
-                                                                    updated_at_max=to_date, limit=limit)
-                page_url = page_wise_order_list.next_page_url
-                parsed = urlparse.parse_qs(page_url)
-                page_info = parsed.get('page_info', False) and parsed.get('page_info', False)[0] or False
-                shopify_order_list = page_wise_order_list + shopify_order_list
-                if not page_info:
-                    break
-        return shopify_order_list
+            params = {'status': 'any', 'fulfillment_status': shopify_fulfillment_status_id.status, 'limit': limit}
+            if from_import_screen:
+                params.update({'created_at_min': from_date, 'created_at_max': to_date})
+            else:
+                params.update({'updated_at_min': from_date, 'updated_at_max': to_date})
+            for page_wise_order_list in shopify.PaginatedIterator(shopify.Order().find(**params)):
+                yield page_wise_order_list
+
+    def fetch_bulk_orders_from_shopify(self, from_date, to_date, shopify_fulfillment_status_ids):
+        """ Yield Shopify orders in REST format from a GraphQL Bulk Operation, only one bulk query can run at a time so statuses are combined. """
+        date_field = 'created_at' if self.env.context.get('from_import_screen', False) else 'updated_at'
+        query_filter_list = [get_date_filter(date_field, '>=', from_date), get_date_filter(date_field, '<=', to_date)]
+        if 'Any' not in shopify_fulfillment_status_ids.mapped('name'):
+            query_filter_list.append('({})'.format(' OR '.join('fulfillment_status:{}'.format(status) for status in shopify_fulfillment_status_ids.mapped('status'))))
+        return fetch_bulk_orders(query_filter_list)
 
     def check_validation_for_import_sale_orders(self, shopify_order_line_list, mk_instance_id, shopify_order_dict):
         odoo_product_variant_obj, is_importable, order_number = self.env['product.product'], True, shopify_order_dict.get('name', '')
         mk_log_id = self.env.context.get('mk_log_id', False)
         queue_line_id = self.env.context.get('queue_line_id', False)
-        mk_listing_item_obj, mk_listing_obj = self.env['mk.listing.item'], self.env['mk.listing']
 
         # validation for Financial workflow
         financial_workflow_config_id = self.validate_shopify_financial_workflow(shopify_order_dict, mk_instance_id)
@@ -101,7 +100,7 @@ class SaleOrder(models.Model):
         for shopify_order_line_dict in shopify_order_line_list:
             variant_id = shopify_order_line_dict.get('variant_id', False)
             if variant_id:
-                shopify_variant = mk_listing_item_obj.search([('mk_id', '=', variant_id), ('mk_instance_id', '=', mk_instance_id.id)])
+                shopify_variant = self.get_mk_listing_item_for_mk_order(variant_id, mk_instance_id)
                 if shopify_variant:
                     continue
                 try:
@@ -135,14 +134,21 @@ class SaleOrder(models.Model):
         gateway_list = [transaction.get('gateway', 'Untitled') for transaction in shopify_order_dict.get('transactions', [{'gateway': 'Untitled'}])]
         main_workflow_config_id, not_found = False, False
 
+        payment_gateway_cache, workflow_config_cache = self.get_order_import_cache('payment_gateway'), self.get_order_import_cache('financial_workflow_config')
         for gateway in gateway_list:
-            shopify_payment_gateway_id = self.env['shopify.payment.gateway.ts'].search([('code', '=', gateway), ('mk_instance_id', '=', mk_instance_id.id)], limit=1)
-            if not shopify_payment_gateway_id:
-                shopify_payment_gateway_id = self.env['shopify.payment.gateway.ts'].create({'name': gateway, 'code': gateway, 'mk_instance_id': mk_instance_id.id})
-
-            financial_workflow_config_id = self.env['shopify.financial.workflow.config'].search(
-                ['|', ('financial_status', '=', shopify_order_dict.get('financial_status')), ('financial_status', '=', 'any'), ('mk_instance_id', '=', mk_instance_id.id),
-                 ('payment_gateway_id', '=', shopify_payment_gateway_id.id)], limit=1)
+            if gateway not in payment_gateway_cache:
+                shopify_payment_gateway_id = self.env['shopify.payment.gateway.ts'].search([('code', '=', gateway), ('mk_instance_id', '=', mk_instance_id.id)], limit=1)
+                if not shopify_payment_gateway_id:
+                    shopify_payment_gateway_id = self.env['shopify.payment.gateway.ts'].create({'name': gateway, 'code': gateway, 'mk_instance_id': mk_instance_id.id})
+                payment_gateway_cache[gateway] = shopify_payment_gateway_id.id
+            shopify_payment_gateway_id = self.env['shopify.payment.gateway.ts'].browse(payment_gateway_cache[gateway])
+
+            workflow_config_key = (shopify_order_dict.get('financial_status'), shopify_payment_gateway_id.id)
+            if workflow_config_key not in workflow_config_cache:
+                workflow_config_cache[workflow_config_key] = self.env['shopify.financial.workflow.config'].search(
+                    ['|', ('financial_status', '=', shopify_order_dict.get('financial_status')), ('financial_status', '=', 'any'), ('mk_instance_id', '=', mk_instance_id.id),
+                     ('payment_gateway_id', '=', shopify_payment_gateway_id.id)], limit=1).id
+            financial_workflow_config_id = self.env['shopify.financial.workflow.config'].browse(workflow_config_cache[workflow_config_key])
             marketplace_workflow_id = financial_workflow_config_id.order_workflow_id or False
             if gateway == main_gateway:
                 main_workflow_config_id = financial_workflow_config_id
@@ -228,7 +234,7 @@ class SaleOrder(models.Model):
         description = shopify_order_line_dict.get('name', shopify_order_line_dict.get('title', 'Untitled'))
 
         price = shopify_order_line_dict.get('price')
-        order_currency_id = self.env['res.currency'].search([('name', '=', shopify_order_currency)], limit=1)
+        order_currency_id = self.get_currency_by_name(shopify_order_currency)
         if order_currency_id:
             price = order_currency_id._convert(float(price), self.currency_id, self.company_id, fields.Date.today())
         line_vals = {
@@ -255,7 +261,7 @@ class SaleOrder(models.Model):
         sale_order_line_obj = self.env['sale.order.line']
 
         price = shopify_order_line_dict.get('price')
-        order_currency_id = self.env['res.currency'].search([('name', '=', shopify_order_currency)], limit=1)
+        order_currency_id = self.get_currency_by_name(shopify_order_currency)
         if order_currency_id:
             price = order_currency_id._convert(float(price), order_id.currency_id, order_id.company_id, fields.Date.today())
         line_vals = {
@@ -281,12 +287,15 @@ class SaleOrder(models.Model):
         return order_line
 
     def get_shopify_delivery_method(self, carrier_name, mk_instance_id):
-        carrier_obj = self.env['delivery.carrier']
+        carrier_obj, carrier_cache = self.env['delivery.carrier'], self.get_order_import_cache('carrier')
+        if carrier_name in carrier_cache:
+            return carrier_obj.browse(carrier_cache[carrier_name])
         carrier_id = carrier_obj.search(['|', ('name', '=', carrier_name), ('shopify_code', '=', carrier_name)], limit=1)
         if not carrier_id:
             carrier_id = carrier_obj.search(['|', ('name', 'ilike', carrier_name), ('shopify_code', 'ilike', carrier_name)], limit=1)
         if not carrier_id:
             carrier_id = carrier_obj.create({'name': carrier_name, 'shopify_code': carrier_name, 'product_id': mk_instance_id.delivery_product_id.id})
+        carrier_cache[carrier_name] = carrier_id.id
         return carrier_id
 
     def create_shopify_shipping_line(self, mk_instance_id, shopify_order_dict, order_id):
@@ -370,9 +379,10 @@ class SaleOrder(models.Model):
             existing_order_id.write({'shopify_financial_status': shopify_order_dict.get('financial_status'),
                                      'fulfillment_status': fulfillment_status,
                                      'updated_in_marketplace': True if fulfillment_status == 'fulfilled' else False})
-            log_message = "IMPORT ORDER: Shopify Order {}({}) is already imported.".format(shopify_order_name, shopify_order_dict.get('id'))
-            self.env['mk.log'].create_update_log(mk_log_id=mk_log_id,
-                                                 mk_log_line_dict={'success': [{'log_message': log_message, 'queue_job_line_id': queue_line_id and queue_line_id.id or False}]})
+            if self.env['mk.log'].is_log_required('success', mk_log_id=mk_log_id, mk_instance_id=mk_instance_id):
+                log_message = "IMPORT ORDER: Shopify Order {}({}) is already imported.".format(shopify_order_name, shopify_order_dict.get('id'))
+                self.env['mk.log'].create_update_log(mk_log_id=mk_log_id,
+                                                     mk_log_line_dict={'success': [{'log_message': log_message, 'queue_job_line_id': queue_line_id and queue_line_id.id or False}]})
             return existing_order_id
 
         shopify_order_line_list = shopify_order_dict.get('line_items')
@@ -434,21 +444,38 @@ class SaleOrder(models.Model):
             self.env['shopify.fraud.analysis'].create_fraud_analysis(shopify_order_dict.get('id'), order_id)
         order_id.with_context(create_date=convert_shopify_datetime_to_utc(shopify_order_dict.get("created_at", "")),
                               order_dict=shopify_order_dict).do_marketplace_workflow_process()
-        if order_id:
+        if order_id and self.env['mk.log'].is_log_required('success', mk_log_id=mk_log_id, mk_instance_id=mk_instance_id):
             log_message = 'IMPORT ORDER: Successfully imported marketplace order {}({})'.format(order_id.name, order_id.mk_id)
             self.env['mk.log'].create_update_log(mk_log_id=mk_log_id,
                                                  mk_log_line_dict={'success': [{'log_message': log_message, 'queue_job_line_id': queue_line_id and queue_line_id.id or False}]})
         return order_id
 
     def fetch_order_transaction_from_shopify(self, shopify_order_list):
+        """ Fetch transactions of all orders in parallel, every worker thread goes through the rate limiter shared for the shop. """
         if not isinstance(shopify_order_list, list):
             shopify_order_list = [shopify_order_list]
-        for order in shopify_order_list:
-            transactions = shopify.Transaction.find(order_id=order.get_id())
-            trans_list = []
-            [trans_list.append(transaction.to_dict()) for transaction in transactions]
-            if trans_list:
-                order.attributes['transactions'] = trans_list
+        if not shopify_order_list:
+            return shopify_order_list
+        # Shopify session is thread local and get_site() has no credentials, worker threads need the whole session of the current instance.
+        # Falling back to the class level session would use whichever shop any thread connected last.
+        resource = shopify.ShopifyResource
+        site, user, password, version, headers = resource.get_site(), resource.get_user(), resource.get_password(), resource.get_version(), dict(resource.get_headers())
+
+        def set_session():
+            resource.set_site(site)
+            resource.set_user(user)
+            resource.set_password(password)
+            resource.set_version(version)
+            resource.set_headers(dict(headers))
+
+        def fetch_transactions(order_id):
+            return [transaction.to_dict() for transaction in shopify.Transaction.find(order_id=order_id)]
+
+        # The initializer runs once in every worker thread, so the session is set thread locally before its first request.
+        with ThreadPoolExecutor(max_workers=min(TRANSACTION_FETCH_WORKERS, len(shopify_order_list)), initializer=set_session) as executor:
+            for order, trans_list in zip(shopify_order_list, executor.map(fetch_transactions, [order.get_id() for order in shopify_order_list])):
+                if trans_list:
+                    order.attributes['transactions'] = trans_list
         return shopify_order_list
 
     def shopify_import_orders(self, mk_instance_ids, from_date=False, to_date=False, mk_order_id=False):
@@ -462,30 +489,34 @@ class SaleOrder(models.Model):
             if not to_date:
                 to_date = fields.Datetime.now()
             shopify_fulfillment_status_ids = mk_instance_id.fulfillment_status_ids
-            shopify_order_list = self.fetch_orders_from_shopify(from_date, to_date, shopify_fulfillment_status_ids, limit=mk_instance_id.api_limit, mk_order_id=mk_order_id)
-            self.fetch_order_transaction_from_shopify(shopify_order_list)  # Fetch payment transactions from Shopify and set in order dict.
-            if mk_order_id and shopify_order_list:
-                for shopify_order in shopify_order_list:
-                    order_id = self.with_context(mk_log_id=mk_log_id).process_import_order_from_shopify_ts(shopify_order.to_dict(), mk_instance_id)
+            if mk_instance_id.is_bulk_import and not mk_order_id:
+                # Transactions are part of the bulk query.
+                shopify_order_list = self.fetch_bulk_orders_from_shopify(from_date, to_date, shopify_fulfillment_status_ids)
+            else:
+                shopify_order_pages = self.fetch_orders_from_shopify(from_date, to_date, shopify_fulfillment_status_ids, limit=mk_instance_id.api_limit, mk_order_id=mk_order_id)
+                # Fetch payment transactions from Shopify and set in order dict, one page at a time.
+                shopify_order_list = (order.to_dict() for order in
+                                      itertools.chain.from_iterable(self.fetch_order_transaction_from_shopify(list(page)) for page in shopify_order_pages))
+            if mk_order_id:
+                for shopify_order_dict in shopify_order_list:
+                    order_id = self.with_context(mk_log_id=mk_log_id).process_import_order_from_shopify_ts(shopify_order_dict, mk_instance_id)
                 if not mk_log_id.log_line_ids and not self.env.context.get('log_id', False):
                     mk_log_id.unlink()
                 self._cr.commit()
                 return True
-            if shopify_order_list:
-                batch_size = mk_instance_id.queue_batch_limit or 100
-                for shopify_orders in tools.split_every(batch_size, shopify_order_list):
-                    queue_id = mk_instance_id.action_create_queue(type='order')
-                    for order in shopify_orders:
-                        shopify_order_dict = order.to_dict()
-                        name = shopify_order_dict.get('name', '') or ''
-                        line_vals = {
-                            'mk_id': shopify_order_dict.get('id') or '',
-                            'state': 'draft',
-                            'name': name.strip(),
-                            'data_to_process': pprint.pformat(shopify_order_dict),
-                            'mk_instance_id': mk_instance_id.id,
-                        }
-                        queue_id.action_create_queue_lines(line_vals)
+            batch_size = mk_instance_id.queue_batch_limit or 100
+            for shopify_orders in tools.split_every(batch_size, shopify_order_list):
+                queue_id = mk_instance_id.action_create_queue(type='order')
+                for shopify_order_dict in shopify_orders:
+                    name = shopify_order_dict.get('name', '') or ''
+                    line_vals = {
+                        'mk_id': shopify_order_dict.get('id') or '',
+                        'state': 'draft',
+                        'name': name.strip(),
+                        'mk_instance_id': mk_instance_id.id,
+                    }
+                    line_vals.update(self.env['mk.queue.job.line'].prepare_data_to_process_vals(shopify_order_dict, mk_instance_id))
+                    queue_id.action_create_queue_lines(line_vals)
             if not mk_log_id.log_line_ids and not self.env.context.get('log_id', False):
                 mk_log_id.unlink()
             mk_instance_id.last_order_sync_date = to_date
@@ -508,9 +539,26 @@ class SaleOrder(models.Model):
         odoo_order_id.write({'shopify_closed_at': fields.Datetime.now()})
         return True
 
+    def fetch_shopify_orders_by_ids(self, shopify_order_ids, mk_log_line_dict, fields_to_fetch='id,fulfillment_status'):
+        """ Fetch Shopify orders in chunks of 250 with ids filter instead of one request per order.
+        :param fields_to_fetch: comma separated Shopify order attributes, only these are returned by Shopify.
+        :return: dict of Shopify order id and shopify.Order.
+        """
+        shopify_order_dict = {}
+        for index in range(0, len(shopify_order_ids), ORDER_FIND_BATCH_SIZE):
+            order_ids = shopify_order_ids[index:index + ORDER_FIND_BATCH_SIZE]
+            try:
+                shopify_orders = shopify.Order.find(ids=','.join(order_ids.mapped('mk_id')), fields=fields_to_fetch, status='any', limit=ORDER_FIND_BATCH_SIZE)
+            except Exception as e:
+                log_message = 'Error while trying to find Shopify Orders {}.ERROR: {}'.format(', '.join(order_ids.mapped('name')), e)
+                mk_log_line_dict['error'].append({'log_message': 'UPDATE ORDER STATUS: {}'.format(log_message)})
+                continue
+            shopify_order_dict.update({str(shopify_order.id): shopify_order for shopify_order in shopify_orders})
+        return shopify_order_dict
+
     def shopify_prepare_fulfillment_line_vals(self, picking_id):
         line_item_list = []
-        mrp = self.env['ir.module.module'].search([('name', '=', 'mrp'), ('state', '=', 'installed')])
+        mrp = 'mrp.bom' in self.env
         for move in picking_id.move_lines:
             if int(move.quantity_done) > 0 and move.sale_line_id.mk_id:
                 if mrp and self.env['mrp.bom']._bom_find(product=move.sale_line_id.product_id, bom_type='phantom'):
@@ -534,19 +582,20 @@ class SaleOrder(models.Model):
             mk_log_id = self.env['mk.log'].create_update_log(mk_instance_id=mk_instance_id, operation_type='export')
             mk_log_line_dict = self.env.context.get('mk_log_line_dict', {'error': [], 'success': []})
             mk_instance_id.connection_to_shopify()
-            shopify_order_ids = self.get_shopify_sale_orders(mk_instance_id)
-            for shopify_order_id in shopify_order_ids:
-                shopify_order, fulfillment_result = False, False
+            order_picking_list = []
+            for shopify_order_id in self.get_shopify_sale_orders(mk_instance_id):
                 picking_ids = shopify_order_id.picking_ids.filtered(
                     lambda x: not x.updated_in_marketplace and x.state == 'done' and x.location_dest_id.usage == 'customer' and x.no_of_retry_count < 3)
-                if not picking_ids:
+                if picking_ids:
+                    order_picking_list.append((shopify_order_id, picking_ids))
+            shopify_order_dict = self.fetch_shopify_orders_by_ids(self.browse([order.id for order, picking_ids in order_picking_list]), mk_log_line_dict)
+            for shopify_order_id, picking_ids in order_picking_list:
+                fulfillment_result = False
+                shopify_order = shopify_order_dict.get(shopify_order_id.mk_id)
+                if not shopify_order:
+                    log_message = 'Error while trying to find Shopify Order {}.ERROR: Order not found in Shopify.'.format(shopify_order_id.name)
+                    mk_log_line_dict['error'].append({'log_message': 'UPDATE ORDER STATUS: {}'.format(log_message)})
                     continue
-                try:
-                    shopify_order = shopify.Order.find(shopify_order_id.mk_id)
-                except Exception as e:
-                    if e.code == 429:
-                        time.sleep(3)
-                        shopify_order = shopify.Order.find(shopify_order_id.mk_id)
                 if shopify_order.to_dict().get('fulfillment_status') == 'fulfilled':
                     picking_ids.write({'updated_in_marketplace': True})
                     shopify_order_id.write({'fulfillment_status': 'fulfilled', 'updated_in_marketplace': True})
@@ -590,20 +639,10 @@ class SaleOrder(models.Model):
                                                                'notify_customer': mk_instance_id.is_notify_customer})
                         fulfillment_result = new_fulfillment.save()
                     except Exception as e:
-                        if e.code == 429:
-                            time.sleep(3)
-                            new_fulfillment = shopify.Fulfillment({'order_id': shopify_order_id.mk_id,
-                                                                   'location_id': shopify_location_id.shopify_location_id,
-                                                                   'tracking_numbers': tracking_no_list,
-                                                                   'tracking_company': carrier_name,
-                                                                   'line_items': line_item_list,
-                                                                   'notify_customer': mk_instance_id.is_notify_customer})
-                            fulfillment_result = new_fulfillment.save()
-                        else:
-                            log_message = 'Error while trying to update Order status of Shopify Order {}.ERROR: {}'.format(shopify_order_id.name, e)
-                            mk_log_line_dict['error'].append({'log_message': 'UPDATE ORDER STATUS: {}'.format(log_message)})
-                            self.shopify_update_picking_retry_count(picking_id)
-                            continue
+                        log_message = 'Error while trying to update Order status of Shopify Order {}.ERROR: {}'.format(shopify_order_id.name, e)
+                        mk_log_line_dict['error'].append({'log_message': 'UPDATE ORDER STATUS: {}'.format(log_message)})
+                        self.shopify_update_picking_retry_count(picking_id)
+                        continue
                     if not fulfillment_result:
                         errors = ''
                         if new_fulfillment.errors and new_fulfillment.errors.errors:
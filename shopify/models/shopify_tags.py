@@ -1,4 +1,4 @@
-from odoo import models, fields
+from odoo import models, fields, api
 
 
 class ShopifyTags(models.Model):
@@ -7,3 +7,27 @@ class ShopifyTags(models.Model):
 
     name = fields.Char("Name", required=1)
     sequence = fields.Integer("Sequence")
+
+    @api.model
+    def get_shopify_tag_dict(self, shopify_tags_list):
+        """ Get or create tags of all given tag strings at once, existing tags are fetched with one query and missing ones created with one create call.
+        Tags are kept in the listing import cache so a batch resolves every tag only once.
+        :param shopify_tags_list: list of comma separated tag strings, Exp. ['summer,shirt', 'winter'].
+        :return: dict {tag name: tag id}
+        """
+        tag_dict = self.env['mk.listing'].get_listing_import_cache('shopify_tag')
+        new_tag_vals = {}
+        for shopify_tags in shopify_tags_list:
+            sequence = 1
+            for tag in (shopify_tags or '').split(','):
+                if len(tag) < 1 or tag in tag_dict or tag in new_tag_vals:
+                    continue
+                new_tag_vals[tag] = {'name': tag, 'sequence': sequence}
+                sequence += 1
+        if new_tag_vals:
+            for tag_id in self.search([('name', 'in', list(new_tag_vals.keys()))], order='id desc'):
+                tag_dict[tag_id.name] = tag_id.id
+            tag_vals_list = [tag_vals for tag, tag_vals in new_tag_vals.items() if tag not in tag_dict]
+            if tag_vals_list:
+                tag_dict.update({tag_id.name: tag_id.id for tag_id in self.create(tag_vals_list)})
+        return tag_dict
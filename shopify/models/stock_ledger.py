@@ -0,0 +1,75 @@
+from datetime import timedelta
+from odoo import models, fields, api, tools
+
+
+class ShopifyStockLedger(models.Model):
+    _name = "shopify.stock.ledger.ts"
+    _description = "Shopify Exported Stock Ledger"
+
+    mk_listing_item_id = fields.Many2one('mk.listing.item', "Listing Item", required=True, ondelete='cascade', index=True)
+    shopify_location_id = fields.Many2one('shopify.location.ts', "Shopify Location", required=True, ondelete='cascade')
+    quantity = fields.Integer("Last Exported Quantity")
+    export_date = fields.Datetime("Last Exported On")
+
+    _sql_constraints = [('listing_item_location_unique', 'unique(mk_listing_item_id,shopify_location_id)', 'Ledger already exists for Listing Item and Location.')]
+
+    @api.model
+    def get_exported_quantity_dict(self, shopify_location_id, listing_item_ids):
+        """ :return: dict of listing item id and quantity Shopify has for given location as far as we know. """
+        if not listing_item_ids:
+            return {}
+        self.env.cr.execute("""
+            SELECT mk_listing_item_id, quantity FROM shopify_stock_ledger_ts
+             WHERE shopify_location_id = %s AND mk_listing_item_id IN %s
+        """, (shopify_location_id.id, tuple(listing_item_ids.ids)))
+        return dict(self.env.cr.fetchall())
+
+    @api.model
+    def update_exported_quantity(self, shopify_location_id, stock_item_list):
+        """ Store quantity successfully exported to Shopify.
+        :param stock_item_list: list of tuple (listing item, quantity).
+        """
+        item_quantity_dict = {listing_item.id: quantity for listing_item, quantity in stock_item_list}
+        if not item_quantity_dict:
+            return True
+        values = [(item_id, shopify_location_id.id, quantity, self.env.uid, self.env.uid) for item_id, quantity in item_quantity_dict.items()]
+        for batch_values in tools.split_every(1000, values):
+            query = """
+                INSERT INTO shopify_stock_ledger_ts (mk_listing_item_id, shopify_location_id, quantity, create_uid, write_uid, export_date, create_date, write_date)
+                VALUES {}
+                ON CONFLICT (mk_listing_item_id, shopify_location_id)
+                DO UPDATE SET quantity = EXCLUDED.quantity, export_date = EXCLUDED.export_date, write_uid = EXCLUDED.write_uid, write_date = EXCLUDED.write_date
+            """.format(', '.join(["(%s, %s, %s, %s, %s, (now() at time zone 'UTC'), (now() at time zone 'UTC'), (now() at time zone 'UTC'))"] * len(batch_values)))
+            self.env.cr.execute(query, [value for row in batch_values for value in row])
+        self.invalidate_cache()
+        return True
+
+    @api.model
+    def is_stock_reconcile_due(self, mk_instance_id):
+        if not mk_instance_id.stock_reconcile_interval:
+            return False
+        last_reconcile_date = mk_instance_id.last_stock_reconcile_date
+        return not last_reconcile_date or last_reconcile_date + timedelta(days=mk_instance_id.stock_reconcile_interval) <= fields.Datetime.now()
+
+    @api.model
+    def reconcile_shopify_stock_ledger(self, mk_instance_id, location_ids):
+        """ Replace the ledger of given locations with the available quantities Shopify actually has.
+        Items Shopify does not stock at a location are dropped from the ledger, so they are exported again.
+        """
+        mk_listing_obj = self.env['mk.listing']
+        shopify_location_dict = {location.shopify_location_id: location for location in location_ids}
+        item_dict = {listing_item.inventory_item_id: listing_item for listing_item in self.env['mk.listing.item'].search(
+            [('mk_instance_id', '=', mk_instance_id.id), ('is_listed', '=', True), ('inventory_item_id', '!=', False)])}
+        location_wise_stock_dict = {location: [] for location in location_ids}
+        for inventory_level_list in mk_listing_obj.fetch_all_shopify_inventory_level(mk_instance_id, list(shopify_location_dict.keys()), is_full_sync=True):
+            for inventory_level in inventory_level_list:
+                inventory_level = inventory_level.to_dict()
+                listing_item = item_dict.get(str(inventory_level.get('inventory_item_id')))
+                shopify_location_id = shopify_location_dict.get(str(inventory_level.get('location_id')))
+                if listing_item and shopify_location_id and inventory_level.get('available') is not None:
+                    location_wise_stock_dict[shopify_location_id].append((listing_item, int(inventory_level.get('available'))))
+        self.env.cr.execute("DELETE FROM shopify_stock_ledger_ts WHERE shopify_location_id IN %s", (tuple(location_ids.ids),))
+        for shopify_location_id, stock_item_list in location_wise_stock_dict.items():
+            self.update_exported_quantity(shopify_location_id, stock_item_list)
+        mk_instance_id.last_stock_reconcile_date = fields.Datetime.now()
+        return True
@@ -0,0 +1,80 @@
+import json
+from datetime import timedelta
+from odoo import models, fields, api
+
+INBOX_STATE = [('draft', 'To Process'), ('done', 'Processed'), ('failed', 'Failed')]
+
+
+class ShopifyWebhookInbox(models.Model):
+    _name = "shopify.webhook.inbox.ts"
+    _description = "Shopify Webhook Inbox"
+    _order = "id desc"
+
+    name = fields.Char("Webhook ID", required=True, readonly=True, help="X-Shopify-Webhook-Id of the delivery, used to skip redelivered webhooks.")
+    webhook_type = fields.Char("Topic", readonly=True)
+    mk_instance_id = fields.Many2one('mk.instance', "Instance", ondelete='cascade', required=True, readonly=True)
+    payload = fields.Text("Payload", readonly=True)
+    state = fields.Selection(INBOX_STATE, default='draft', index=True, readonly=True)
+    error_message = fields.Text("Error", readonly=True)
+    processed_date = fields.Datetime("Processed At", readonly=True)
+
+    _sql_constraints = [('webhook_instance_unique', 'unique(name,mk_instance_id)', 'Webhook is already received.')]
+
+    @api.model
+    def receive_webhook(self, webhook_uid, webhook_type, payload, mk_instance_id):
+        """ Store webhook delivery, deliveries already received with same webhook id are ignored.
+        :return: True if stored, False if duplicate.
+        """
+        self.env.cr.execute("""
+            INSERT INTO shopify_webhook_inbox_ts (name, webhook_type, mk_instance_id, payload, state, create_uid, write_uid, create_date, write_date)
+            VALUES (%s, %s, %s, %s, 'draft', %s, %s, (now() at time zone 'UTC'), (now() at time zone 'UTC'))
+            ON CONFLICT (name, mk_instance_id) DO NOTHING
+        """, (webhook_uid, webhook_type, mk_instance_id.id, payload, self.env.uid, self.env.uid))
+        return bool(self.env.cr.rowcount)
+
+    def _claim_webhooks(self, batch_size):
+        self.env.cr.execute("""
+            SELECT id FROM shopify_webhook_inbox_ts
+             WHERE state = 'draft'
+          ORDER BY id
+             LIMIT %s
+               FOR UPDATE SKIP LOCKED
+        """, (batch_size,))
+        return self.browse([row[0] for row in self.env.cr.fetchall()])
+
+    def process_webhook(self):
+        from ..controllers.main import ShopifyWebhook
+        webhook_controller = ShopifyWebhook()
+        for record in self:
+            mk_instance_id = record.mk_instance_id
+            mk_log_line_dict = {'error': [], 'success': []}
+            mk_log_id = self.env['mk.log'].create_update_log(mk_instance_id=mk_instance_id, operation_type='webhook')
+            try:
+                with self.env.cr.savepoint():
+                    webhook_controller.process_webhook_response(self.env, record.webhook_type, json.loads(record.payload), mk_instance_id, mk_log_id)
+                record.write({'state': 'done', 'processed_date': fields.Datetime.now(), 'error_message': False})
+            except Exception as e:
+                log_message = "Error while processing Shopify webhook {}, ERROR: {}.".format(record.webhook_type, e)
+                mk_log_line_dict['error'].append({'log_message': 'WEBHOOK PROCESS: {}'.format(log_message)})
+                record.write({'state': 'failed', 'processed_date': fields.Datetime.now(), 'error_message': str(e)})
+            finally:
+                self.env['mk.log'].create_update_log(mk_instance_id=mk_instance_id, mk_log_id=mk_log_id, operation_type='webhook', mk_log_line_dict=mk_log_line_dict)
+                if not mk_log_id.log_line_ids:
+                    mk_log_id.unlink()
+        return True
+
+    def action_retry_webhook(self):
+        self.filtered(lambda x: x.state == 'failed').write({'state': 'draft'})
+        return True
+
+    @api.model
+    def cron_process_webhook_inbox(self, batch_size=50, keep_days=7):
+        """ Drain the inbox batch by batch, claimed rows stay locked until the batch is committed so parallel crons skip them. """
+        while True:
+            webhook_ids = self._claim_webhooks(batch_size)
+            if not webhook_ids:
+                break
+            webhook_ids.process_webhook()
+            self.env.cr.commit()
+        self.search([('state', '=', 'done'), ('processed_date', '<', fields.Datetime.now() - timedelta(days=keep_days))]).unlink()
+        return True
@@ -1,7 +1,7 @@
 from .version import VERSION
 from .session import Session, ValidationException
 from .resources import *
-from .limits import Limits
+from .limits import Limits, RateLimiter
 from .api_version import *
 from .api_access import *
 from .collection import PaginatedIterator
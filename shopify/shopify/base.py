@@ -10,6 +10,7 @@ from six.moves import urllib
 import six
 
 from .collection import PaginatedCollection
+from .limits import RateLimiter
 from .pyactiveresource.collection import Collection
 
 # Store the response from the last request in the connection object
@@ -20,15 +21,28 @@ class ShopifyConnection(pyactiveresource.connection.Connection):
 
     def __init__(self, site, user=None, password=None, timeout=None, format=formats.JSONFormat):
         super(ShopifyConnection, self).__init__(site, user, password, timeout, format)
+        self.rate_limiter = RateLimiter.for_site(self.site)
+        self.pool = pyactiveresource.connection.default_pool
 
     def _open(self, *args, **kwargs):
-        self.response = None
-        try:
-            self.response = super(ShopifyConnection, self)._open(*args, **kwargs)
-        except pyactiveresource.connection.ConnectionError as err:
-            self.response = err.response
-            raise
-        return self.response
+        """Throttle every call through the shop's rate limiter and retry the ones rejected with 429."""
+        attempt = 0
+        while True:
+            self.response = None
+            self.rate_limiter.throttle()
+            try:
+                self.response = super(ShopifyConnection, self)._open(*args, **kwargs)
+            except pyactiveresource.connection.ConnectionError as err:
+                self.response = err.response
+                self.rate_limiter.update(err.response.headers)
+                if err.code == 429 and attempt < self.rate_limiter.MAX_RETRIES:
+                    delay = self.rate_limiter.backoff(attempt, err.response.headers)
+                    self.log.info("429 Too Many Requests, retrying in %.2fs (attempt %d)", delay, attempt + 1)
+                    attempt += 1
+                    continue
+                raise
+            self.rate_limiter.update(self.response.headers)
+            return self.response
 
 
 # Inherit from pyactiveresource's metaclass in order to use ShopifyConnection
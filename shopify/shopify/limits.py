@@ -1,3 +1,7 @@
+import time
+import random
+import threading
+from six.moves import urllib
 from .. import shopify
 
 
@@ -60,3 +64,102 @@ class Limits(object):
         How many API calls have I made?
         """
         return int(cls.api_credit_limit_param()[0])
+
+
+class RateLimiter(object):
+    """
+    Client side leaky bucket for the Shopify REST Admin API.
+
+    Shopify drains the bucket at a fixed rate and reports the current fill level
+    in the X-Shopify-Shop-Api-Call-Limit header of every response. One limiter is
+    shared by every thread talking to the same shop, it waits before a call that
+    would overflow the bucket and tells the caller how long to back off after 429.
+
+    >>> limiter = RateLimiter.for_site("https://teqstars.myshopify.com/admin/api/2022-01")
+    >>> limiter.throttle()
+    >>> limiter.update(response.headers)
+    """
+
+    # Keep a few calls free in the bucket for other workers of the same shop.
+    HEADROOM = 4
+    DEFAULT_BUCKET_SIZE = 40
+    # Shopify leaks 2 calls/second for a 40 bucket and 4 calls/second for an 80 bucket (Plus).
+    BUCKET_DRAIN_SECONDS = 20.0
+    MAX_RETRIES = 5
+    BACKOFF_BASE = 1.0
+    BACKOFF_MAX = 30.0
+
+    _registry = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, key):
+        self.key = key
+        self.bucket_size = self.DEFAULT_BUCKET_SIZE
+        self.used = 0.0
+        self.updated_at = time.time()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_site(cls, site):
+        """Return the limiter shared by every connection to the shop of ``site``."""
+        key = urllib.parse.urlparse(site).hostname or site
+        with cls._registry_lock:
+            limiter = cls._registry.get(key)
+            if limiter is None:
+                limiter = cls._registry[key] = cls(key)
+        return limiter
+
+    @property
+    def leak_rate(self):
+        return self.bucket_size / self.BUCKET_DRAIN_SECONDS
+
+    def _current_level(self, now):
+        return max(0.0, self.used - (now - self.updated_at) * self.leak_rate)
+
+    def throttle(self):
+        """Sleep until there is room in the bucket for one more call."""
+        with self._lock:
+            now = time.time()
+            level = self._current_level(now)
+            wait = max(0.0, self.blocked_until - now)
+            threshold = max(1, self.bucket_size - self.HEADROOM)
+            if level + 1 > threshold:
+                wait = max(wait, (level + 1 - threshold) / self.leak_rate)
+            # Reserve the call now so that concurrent threads don't all see the same free slot.
+            self.used = level + 1
+            self.updated_at = now
+        if wait > 0:
+            time.sleep(wait)
+
+    def update(self, headers):
+        """Synchronise the local bucket with the call limit header of a response."""
+        header = headers and (headers.get(Limits.CREDIT_LIMIT_HEADER_PARAM) or headers.get(Limits.CREDIT_LIMIT_HEADER_PARAM.lower()))
+        if not header:
+            return False
+        try:
+            used, bucket_size = [float(value) for value in header.split("/")]
+        except ValueError:
+            return False
+        with self._lock:
+            self.used = used
+            self.bucket_size = bucket_size or self.DEFAULT_BUCKET_SIZE
+            self.updated_at = time.time()
+        return True
+
+    def backoff(self, attempt, headers=None):
+        """
+        Register a 429 response and return the number of seconds to wait before retrying.
+        Retry-After is honoured when present, otherwise an exponential delay with full jitter is used.
+        """
+        retry_after = headers and (headers.get("Retry-After") or headers.get("retry-after"))
+        try:
+            delay = float(retry_after)
+        except (TypeError, ValueError):
+            delay = min(self.BACKOFF_MAX, self.BACKOFF_BASE * (2 ** attempt))
+            delay = random.uniform(delay / 2, delay)
+        with self._lock:
+            self.used = self.bucket_size
+            self.updated_at = time.time()
+            self.blocked_until = max(self.blocked_until, self.updated_at + delay)
+        return delay
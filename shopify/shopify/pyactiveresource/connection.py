@@ -3,10 +3,14 @@
 """A connection object to interface with REST services."""
 
 import base64
+import io
 import logging
 import socket
 import sys
+import threading
+import time
 import six
+from six.moves import http_client
 from six.moves import urllib
 from . import formats
 
@@ -185,6 +189,169 @@ class Response(object):
                    dict(response.headers), response.msg, response)
 
 
+class PooledResponse(object):
+    """A fully read response handed out by HTTPConnectionPool.
+
+    Mimics the attributes of the object returned by urllib.request.urlopen
+    (code, msg, headers, url, read, close) so it can be used in its place.
+    """
+
+    def __init__(self, url, code, msg, headers, body):
+        self.url = url
+        self.code = self.status = code
+        self.msg = self.reason = msg
+        self.headers = headers
+        self._fp = io.BytesIO(body)
+
+    def read(self, *args):
+        return self._fp.read(*args)
+
+    def getcode(self):
+        return self.code
+
+    def info(self):
+        return self.headers
+
+    def geturl(self):
+        return self.url
+
+    def close(self):
+        self._fp.close()
+
+
+class HTTPConnectionPool(object):
+    """Keeps HTTP/1.1 keep-alive connections open per (site, thread).
+
+    urllib.request.urlopen opens (and tears down) a fresh socket for every
+    request, so each call pays a full TCP + TLS handshake. This pool hands
+    out the idle connection of the current thread for the request's host
+    instead, and only opens a new one when there is none or it went stale.
+    Redirects and proxied hosts are left to urllib.
+    """
+
+    DEFAULT_MAXSIZE = 2
+    DEFAULT_TIMEOUT = 60
+    DEFAULT_IDLE_TIMEOUT = 30
+
+    def __init__(self, maxsize=None, timeout=None, idle_timeout=None):
+        """Initialize a new HTTPConnectionPool object.
+
+        Args:
+            maxsize: Idle connections kept per site and thread.
+            timeout: Socket timeout used when the request has none.
+            idle_timeout: Seconds after which an idle connection is dropped
+                instead of reused, before the server closes it on us.
+        """
+        self.maxsize = maxsize or self.DEFAULT_MAXSIZE
+        self.timeout = timeout or self.DEFAULT_TIMEOUT
+        self.idle_timeout = idle_timeout or self.DEFAULT_IDLE_TIMEOUT
+        self._local = threading.local()
+        self.log = logging.getLogger('pyactiveresource.connection')
+
+    def configure(self, maxsize=None, timeout=None, idle_timeout=None):
+        """Change the pool settings and drop the connections of this thread."""
+        if maxsize:
+            self.maxsize = maxsize
+        if timeout:
+            self.timeout = timeout
+        if idle_timeout:
+            self.idle_timeout = idle_timeout
+        self.clear()
+
+    def _idle(self):
+        if not hasattr(self._local, 'idle'):
+            self._local.idle = {}
+        return self._local.idle
+
+    def clear(self):
+        """Close every idle connection of the current thread."""
+        idle = self._idle()
+        for connections in idle.values():
+            for conn, _ in connections:
+                conn.close()
+        idle.clear()
+
+    def _get(self, key, timeout):
+        connections = self._idle().get(key, [])
+        while connections:
+            conn, released_at = connections.pop()
+            if time.time() - released_at < self.idle_timeout:
+                conn.timeout = timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+                return conn, True
+            conn.close()
+        scheme, host = key
+        if scheme == 'https':
+            conn = http_client.HTTPSConnection(host, timeout=timeout)
+        else:
+            conn = http_client.HTTPConnection(host, timeout=timeout)
+        return conn, False
+
+    def _put(self, key, conn):
+        connections = self._idle().setdefault(key, [])
+        if len(connections) >= self.maxsize:
+            conn.close()
+            return
+        connections.append((conn, time.time()))
+
+    def urlopen(self, request, timeout=None):
+        """Perform the request over a pooled connection.
+
+        Args:
+            request: A urllib.request.Request object.
+            timeout: socket timeout, defaults to the pool timeout.
+        Returns:
+            A PooledResponse object.
+        Raises:
+            urllib.error.HTTPError on server errors.
+            urllib.error.URLError on IO errors.
+        """
+        timeout = timeout or self.timeout
+        parts = urllib.parse.urlsplit(request.full_url)
+        if parts.scheme not in ('http', 'https') or self._proxied(parts):
+            return urllib.request.urlopen(request, timeout=timeout)
+        key = (parts.scheme, parts.netloc)
+        path = urllib.parse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+        headers = dict(request.header_items())
+        data = request.data
+
+        while True:
+            conn, reused = self._get(key, timeout)
+            try:
+                conn.request(request.get_method(), path, body=data, headers=headers)
+                http_response = conn.getresponse()
+                body = http_response.read()
+            except (http_client.HTTPException, socket.error) as err:
+                conn.close()
+                if reused:
+                    # The server closed the keep-alive connection in the
+                    # meantime; retry once on a fresh one.
+                    self.log.debug('stale connection to %s dropped: %s', parts.netloc, err)
+                    continue
+                raise urllib.error.URLError(err)
+            break
+
+        if http_response.will_close:
+            conn.close()
+        else:
+            self._put(key, conn)
+
+        code, msg, response_headers = http_response.status, http_response.reason, http_response.msg
+        if code in (301, 302, 303, 307, 308):
+            return urllib.request.urlopen(request, timeout=timeout)
+        if code >= 400:
+            raise urllib.error.HTTPError(request.full_url, code, msg, response_headers, io.BytesIO(body))
+        return PooledResponse(request.full_url, code, msg, response_headers, body)
+
+    def _proxied(self, parts):
+        proxies = urllib.request.getproxies()
+        return parts.scheme in proxies and not urllib.request.proxy_bypass(parts.hostname)
+
+
+default_pool = HTTPConnectionPool()
+
+
 class Connection(object):
     """A connection object to interface with REST services."""
 
@@ -214,6 +381,7 @@ class Connection(object):
         self.timeout = timeout
         self.log = logging.getLogger('pyactiveresource.connection')
         self.format = format
+        self.pool = None
 
     def _parse_site(self, site):
         """Retrieve the auth information and base url for a site.
@@ -312,6 +480,8 @@ class Connection(object):
             urllib.error.HTTPError on server errors.
             urllib.error.URLError on IO errors.
         """
+        if self.pool is not None:
+          return self.pool.urlopen(request, timeout=self.timeout)
         if _urllib_has_timeout():
           return urllib.request.urlopen(request, timeout=self.timeout)
         else:
@@ -1,13 +1,24 @@
 from ... import shopify
 from ..base import ShopifyResource
+from ..pyactiveresource.connection import default_pool
 from six.moves import urllib
+import base64
 import json
+import re
 
 
 class GraphQL:
-    def __init__(self):
-        self.endpoint = shopify.ShopifyResource.get_site() + "/graphql.json"
+    def __init__(self, version=None):
+        site = shopify.ShopifyResource.get_site()
+        if version:
+            # Some mutations only exist in newer API versions than the session's one.
+            site = re.sub(r"/api/[^/]+$", "/api/" + version, site)
+        self.endpoint = site + "/graphql.json"
         self.headers = shopify.ShopifyResource.get_headers()
+        user, password = shopify.ShopifyResource.user, shopify.ShopifyResource.password
+        if "X-Shopify-Access-Token" not in self.headers and (user or password):
+            auth = base64.b64encode(("%s:%s" % (user or "", password or "")).encode("utf-8")).decode("utf-8")
+            self.headers = self.merge_headers(self.headers, {"Authorization": "Basic " + auth})
 
     def merge_headers(self, *headers):
         merged_headers = {}
@@ -24,7 +35,7 @@ class GraphQL:
         req = urllib.request.Request(self.endpoint, json.dumps(data).encode("utf-8"), headers)
 
         try:
-            response = urllib.request.urlopen(req)
+            response = default_pool.urlopen(req, timeout=shopify.ShopifyResource.timeout)
             return response.read().decode("utf-8")
         except urllib.error.HTTPError as e:
             print((e.read()))
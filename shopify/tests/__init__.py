@@ -0,0 +1 @@
+from . import test_bulk_operation
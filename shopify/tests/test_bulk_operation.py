@@ -0,0 +1,145 @@
+import json
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from odoo.tests.common import BaseCase, tagged
+from odoo.addons.shopify.models import bulk_operation
+
+PRODUCT_BULK_LINES = [
+    {'id': 'gid://shopify/Product/1', 'title': 'Shirt', 'tags': ['summer', 'sale'], 'status': 'ACTIVE', 'updated_at': '2022-01-01T00:00:00Z',
+     'options': [{'id': 'gid://shopify/ProductOption/11', 'name': 'Size', 'position': 1, 'values': ['S', 'M']}]},
+    {'id': 'gid://shopify/ProductImage/21', 'src': 'https://cdn.shopify.com/shirt.png', '__parentId': 'gid://shopify/Product/1'},
+    {'id': 'gid://shopify/ProductVariant/31', 'title': 'S', 'sku': 'SHIRT-S', 'price': '10.00', 'weightUnit': 'KILOGRAMS', 'inventoryPolicy': 'DENY',
+     'inventoryItem': {'id': 'gid://shopify/InventoryItem/41', 'tracked': True}, 'selectedOptions': [{'name': 'Size', 'value': 'S'}],
+     'image': {'id': 'gid://shopify/ProductImage/21'}, '__parentId': 'gid://shopify/Product/1'},
+    {'id': 'gid://shopify/ProductVariant/32', 'title': 'M', 'sku': 'SHIRT-M', 'price': '12.00', 'weightUnit': 'GRAMS', 'inventoryPolicy': 'CONTINUE',
+     'inventoryItem': {'id': 'gid://shopify/InventoryItem/42', 'tracked': False}, 'selectedOptions': [{'name': 'Size', 'value': 'M'}],
+     'image': None, '__parentId': 'gid://shopify/Product/1'},
+    {'id': 'gid://shopify/Product/2', 'title': 'Hat', 'tags': [], 'status': 'DRAFT', 'options': []},
+]
+
+ORDER_BULK_LINES = [
+    {'id': 'gid://shopify/Order/5', 'name': '#1005', 'tags': ['pos'], 'paymentGatewayNames': ['cash'], 'displayFinancialStatus': 'PAID',
+     'displayFulfillmentStatus': 'FULFILLED', 'source_name': 'pos', 'physicalLocation': None,
+     'fulfillments': [{'id': 'gid://shopify/Fulfillment/61', 'location': {'id': 'gid://shopify/Location/71'}}],
+     'customer': None, 'billing_address': None,
+     'shipping_address': {'id': 'gid://shopify/MailingAddress/81?model_name=Address', 'name': 'John Doe', 'country': 'India', 'country_code': 'IN'},
+     'transactions': [{'id': 'gid://shopify/OrderTransaction/91', 'kind': 'SALE', 'status': 'SUCCESS', 'gateway': 'cash', 'amountSet': {'shopMoney': {'amount': '22.0'}}}]},
+    {'id': 'gid://shopify/LineItem/101', 'name': 'Shirt - S', 'quantity': 1, 'variant': {'id': 'gid://shopify/ProductVariant/31'}, 'product': {'id': 'gid://shopify/Product/1'},
+     'originalUnitPriceSet': {'shopMoney': {'amount': '10.0'}}, 'discountAllocations': [{'allocatedAmountSet': {'shopMoney': {'amount': '1.0'}}}],
+     'taxLines': [{'title': 'GST', 'rate': 0.18, 'priceSet': {'shopMoney': {'amount': '1.62'}}}], '__parentId': 'gid://shopify/Order/5'},
+    {'id': 'gid://shopify/ShippingLine/111', 'title': 'Standard', 'code': 'STD', 'originalPriceSet': {'shopMoney': {'amount': '5.0'}}, 'discountAllocations': [],
+     'taxLines': [], '__parentId': 'gid://shopify/Order/5'},
+]
+
+
+class BulkResultHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        body = '\n'.join(json.dumps(line) for line in PRODUCT_BULK_LINES).encode('utf-8') + b'\n'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/jsonl')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        return
+
+
+@tagged('post_install', '-at_install')
+class TestBulkOperation(BaseCase):
+
+    def _get_bulk_lines(self, bulk_line_list):
+        return [dict(line) for line in bulk_line_list]
+
+    def test_search_filter(self):
+        self.assertEqual(bulk_operation.get_search_filter([]), '')
+        self.assertEqual(bulk_operation.get_search_filter(['', False]), '')
+        date_filter = bulk_operation.get_date_filter('updated_at', '>=', datetime(2022, 1, 2, 3, 4, 5))
+        self.assertEqual(date_filter, "updated_at:>='2022-01-02T03:04:05Z'")
+        self.assertEqual(bulk_operation.get_search_filter([date_filter, 'status:active']), '(query: "updated_at:>=\'2022-01-02T03:04:05Z\' status:active")')
+
+    def test_legacy_id(self):
+        self.assertEqual(bulk_operation.get_legacy_id('gid://shopify/MailingAddress/123?model_name=CustomerAddress'), 123)
+        self.assertIsNone(bulk_operation.get_legacy_id(None))
+        self.assertEqual(bulk_operation.get_gid_type('gid://shopify/ProductVariant/123'), 'ProductVariant')
+
+    def test_iter_bulk_objects(self):
+        product_list = list(bulk_operation.iter_bulk_objects(self._get_bulk_lines(PRODUCT_BULK_LINES)))
+        self.assertEqual([product['id'] for product in product_list], ['gid://shopify/Product/1', 'gid://shopify/Product/2'])
+        children = product_list[0]['__children']
+        self.assertEqual([variant['id'] for variant in children['ProductVariant']], ['gid://shopify/ProductVariant/31', 'gid://shopify/ProductVariant/32'])
+        self.assertEqual(len(children['ProductImage']), 1)
+        self.assertNotIn('__parentId', children['ProductVariant'][0])
+        self.assertNotIn('__children', product_list[1])
+
+    def test_iter_bulk_objects_orphan_line(self):
+        bulk_line_list = self._get_bulk_lines(PRODUCT_BULK_LINES[:1]) + [{'id': 'gid://shopify/ProductVariant/99', '__parentId': 'gid://shopify/Product/404'}]
+        with self.assertLogs('Teqstars:Shopify', level='WARNING'):
+            product_list = list(bulk_operation.iter_bulk_objects(bulk_line_list))
+        self.assertEqual(len(product_list), 1)
+        self.assertNotIn('__children', product_list[0])
+
+    def test_convert_bulk_product(self):
+        product_list = [bulk_operation.convert_bulk_product(product) for product in bulk_operation.iter_bulk_objects(self._get_bulk_lines(PRODUCT_BULK_LINES))]
+        product_dict = product_list[0]
+        self.assertEqual(product_dict['id'], 1)
+        self.assertEqual(product_dict['tags'], 'summer, sale')
+        self.assertEqual(product_dict['status'], 'active')
+        self.assertEqual(product_dict['options'], [{'id': 11, 'product_id': 1, 'name': 'Size', 'position': 1, 'values': ['S', 'M']}])
+        first_variant, second_variant = product_dict['variants']
+        self.assertEqual((first_variant['id'], first_variant['product_id'], first_variant['option1']), (31, 1, 'S'))
+        self.assertEqual((first_variant['weight_unit'], first_variant['inventory_policy'], first_variant['inventory_management']), ('kg', 'deny', 'shopify'))
+        self.assertEqual((first_variant['inventory_item_id'], first_variant['image_id']), (41, 21))
+        self.assertEqual((second_variant['weight_unit'], second_variant['inventory_management'], second_variant['image_id']), ('g', None, None))
+        self.assertEqual(len(product_dict['images']), 1)
+        self.assertEqual(product_dict['images'][0]['variant_ids'], [31])
+        self.assertEqual(product_dict['images'][0]['updated_at'], '2022-01-01T00:00:00Z')
+        self.assertEqual(product_dict['image']['id'], 21)
+        self.assertNotIn('__children', product_dict)
+        self.assertEqual((product_list[1]['variants'], product_list[1]['images'], product_list[1]['image']), ([], [], None))
+
+    def test_convert_bulk_customer(self):
+        customer_dict = bulk_operation.convert_bulk_customer({
+            'id': 'gid://shopify/Customer/7', 'tags': ['vip'], 'state': 'ENABLED',
+            'default_address': {'id': 'gid://shopify/MailingAddress/8?model_name=CustomerAddress', 'country': 'India'},
+            'addresses': [{'id': 'gid://shopify/MailingAddress/8?model_name=CustomerAddress', 'country': 'India'}]})
+        self.assertEqual((customer_dict['id'], customer_dict['tags'], customer_dict['state']), (7, 'vip', 'enabled'))
+        self.assertEqual(customer_dict['default_address'], {'id': 8, 'country': 'India', 'country_name': 'India'})
+        self.assertEqual(customer_dict['addresses'], [{'id': 8, 'country': 'India', 'country_name': 'India'}])
+
+    def test_convert_bulk_order(self):
+        order_dict = bulk_operation.convert_bulk_order(next(bulk_operation.iter_bulk_objects(self._get_bulk_lines(ORDER_BULK_LINES))))
+        self.assertEqual((order_dict['id'], order_dict['tags'], order_dict['gateway']), (5, 'pos', 'cash'))
+        self.assertEqual((order_dict['financial_status'], order_dict['fulfillment_status']), ('paid', 'fulfilled'))
+        self.assertEqual(order_dict['source_name'], 'pos')
+        self.assertIsNone(order_dict['location_id'])
+        self.assertEqual(order_dict['fulfillments'], [{'id': 61, 'order_id': 5, 'location_id': 71}])
+        # Empty customer and addresses are left out like in the REST response.
+        self.assertNotIn('customer', order_dict)
+        self.assertNotIn('billing_address', order_dict)
+        self.assertEqual(order_dict['shipping_address']['id'], 81)
+        self.assertEqual(order_dict['transactions'], [{'id': 91, 'order_id': 5, 'kind': 'sale', 'status': 'success', 'gateway': 'cash', 'amount': '22.0'}])
+        line_item = order_dict['line_items'][0]
+        self.assertEqual((line_item['id'], line_item['variant_id'], line_item['product_id'], line_item['price']), (101, 31, 1, '10.0'))
+        self.assertEqual(line_item['discount_allocations'], [{'amount': '1.0'}])
+        self.assertEqual(line_item['tax_lines'], [{'title': 'GST', 'rate': 0.18, 'price': '1.62'}])
+        self.assertEqual(order_dict['shipping_lines'], [{'id': 111, 'title': 'Standard', 'code': 'STD', 'source': None, 'price': '5.0', 'discount_allocations': [],
+                                                         'tax_lines': []}])
+        for key in ('paymentGatewayNames', 'displayFinancialStatus', 'displayFulfillmentStatus', 'physicalLocation', '__children'):
+            self.assertNotIn(key, order_dict)
+
+    def test_iter_bulk_operation_result(self):
+        server = HTTPServer(('127.0.0.1', 0), BulkResultHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            url = 'http://127.0.0.1:%s/bulk.jsonl' % server.server_address[1]
+            product_list = list(bulk_operation.iter_bulk_objects(bulk_operation.iter_bulk_operation_result(url)))
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual([product['id'] for product in product_list], ['gid://shopify/Product/1', 'gid://shopify/Product/2'])
+        self.assertEqual(len(product_list[0]['__children']['ProductVariant']), 2)
+        self.assertEqual(list(bulk_operation.iter_bulk_operation_result(False)), [])